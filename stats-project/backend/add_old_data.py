@@ -3,47 +3,106 @@ add_old_data.py
 
 Temporary function to inject our old, less detailed data into the final result derived from query_global_sum, so long as our data remains split.
 
+The historical series are read from 'static/old_data' once, validated, sorted and held in memory as immutable
+tuples. A file is only re-read when its modification time changes, and a missing or invalid file is only
+reported once, through the add_old_data logger.
 
 Functions:
-    inject_old_data: Appends data from the appropriate JSON file ('monthly' or 'yearly') into final_result.
+    load_old_data: Returns the validated, sorted historical series for 'monthly' or 'yearly'.
+    inject_old_data: Merges data from the appropriate JSON file ('monthly' or 'yearly') into final_result.
 
 Modules:
     json: JSON encoder and decoder.
+    logging: Reports missing or invalid files.
     os: Miscellaneous operating system interfaces.
+    threading: Guards the in-memory copy of the historical series.
 """
 import json
+import logging
 import os
+import threading
+
+OLD_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "old_data")
+
+# maps a file path to (modification time, tuple of (time_group, total_sum) pairs); the modification
+# time of a missing file is None
+_loaded = {}
+_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+
+def _read_old_data(json_file_path):
+    """Reads and validates a historical series, returning it as sorted (time_group, total_sum) pairs."""
+    with open(json_file_path, "r", encoding="utf-8") as f:
+        json_data = json.load(f)
+
+    series = {}
+    for entry in json_data:
+        time_group = entry["time_group"]
+        total_sum = entry["total_sum"]
+        if not isinstance(time_group, str) or not isinstance(total_sum, int):
+            raise ValueError(f"Malformed entry: {entry}")
+        series[time_group] = total_sum
+    return tuple(sorted(series.items()))
+
+
+def load_old_data(time_group):
+    """
+    Returns the validated, sorted historical series for 'monthly' or 'yearly'.
+
+    Returns:
+        tuple: (time_group, total_sum) pairs in time order, or an empty tuple if the file is
+            missing or invalid.
+    """
+    json_file_path = os.path.join(OLD_DATA_DIR, f"{time_group}_data.json")
+    try:
+        mtime = os.path.getmtime(json_file_path)
+    except OSError:
+        mtime = None
+
+    with _lock:
+        cached = _loaded.get(json_file_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        series = ()
+        if mtime is None:
+            logger.warning("JSON file %s not found. Skipping injection.", json_file_path)
+        else:
+            try:
+                series = _read_old_data(json_file_path)
+                logger.info("Loaded %s, holding %d entries.", json_file_path, len(series))
+            except json.JSONDecodeError:
+                logger.warning("JSON file %s is not a valid JSON. Skipping injection.", json_file_path)
+            except Exception as e:
+                logger.warning("Unexpected error reading %s: %s", json_file_path, e)
+
+        _loaded[json_file_path] = (mtime, series)
+        return series
 
 
 def inject_old_data(final_result, time_group):
-    """Appends data from the appropriate JSON file ('monthly' or 'yearly') into final_result."""
+    """
+    Merges data from the appropriate JSON file ('monthly' or 'yearly') into final_result.
+
+    final_result must be sorted by 'time_group'. The two series are merged in a single pass; where
+    both hold the same period, the live result is kept.
+    """
 
     if time_group not in {"monthly", "yearly"}:
-        print(f"Invalid time_group: {time_group}. Expected 'monthly' or 'yearly'.")
+        logger.warning("Invalid time_group: %s. Expected 'monthly' or 'yearly'.", time_group)
         return final_result  # Return unchanged if an invalid argument is passed
 
-    # Construct absolute path to the JSON file in 'static/old_data'
-    base_dir = os.path.dirname(os.path.abspath(__file__))  # Directory of this script
-    json_file_path = os.path.join(
-        base_dir, "static", "old_data", f"{time_group}_data.json"
-    )
-    print(json_file_path)
-    #print(f"Looking for {json_file_path}...")
+    old_data = load_old_data(time_group)
+    merged = []
+    index = 0
+    for old_time_group, total_sum in old_data:
+        while index < len(final_result) and final_result[index]["time_group"] < old_time_group:
+            merged.append(final_result[index])
+            index += 1
+        if index < len(final_result) and final_result[index]["time_group"] == old_time_group:
+            continue  # the live result covers this period
+        merged.append({"time_group": old_time_group, "total_sum": total_sum})
+    merged.extend(final_result[index:])
 
-    try:
-        with open(json_file_path, "r", encoding="utf-8") as f:
-            json_data = json.load(f)
-            print(
-                f"Successfully loaded {json_file_path}. Injecting {len(json_data)} entries."
-            )
-
-        final_result[:0] = json_data  # preppend all data
-
-    except FileNotFoundError:
-        print(f"JSON file {json_file_path} not found. Skipping injection.")
-    except json.JSONDecodeError:
-        print(f"JSON file {json_file_path} is not a valid JSON. Skipping injection.")
-    except Exception as e:
-        print(f"Unexpected error reading {json_file_path}: {e}")
-
-    return final_result  # Return modified result (or unchanged if error occurred)
+    return merged
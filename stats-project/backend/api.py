@@ -8,6 +8,9 @@ Functions:
     validate_args(model_name, group_by_column, second_group_by_column=None, time_group=None):
         Helper function to validate model name, column names, and time group.
 
+    validate_top(args):
+        Helper function validating the limit, order and other arguments of get_data.
+
     get_data():
         API endpoint to fetch aggregated data.
 
@@ -17,25 +20,97 @@ Functions:
     get_todays_downloads():
         API endpoint to fetch today's download statistics aggregated by hour.
 
+    batch():
+        API endpoint answering several of the above queries concurrently in one request.
+
+    parse_get_data(args) / parse_get_global_sum(args) / parse_get_todays_downloads(args):
+        Helper functions validating the arguments of each endpoint, shared with batch.
+
+    conditional_response(key, respond):
+        Helper function answering with a 304 when the client already holds the current response.
+
+    conditional_json_async(key, compute, output_format="json"):
+        Helper function like conditional_json, awaiting compute on a cache miss.
+
+    streamed_json(rows, ndjson=False):
+        Helper function streaming rows as a chunked JSON array or as newline delimited JSON.
+
+    get_cache_stats():
+        API endpoint reporting the hit and miss counters of the result cache and of request coalescing.
+
+    slow_queries():
+        Admin endpoint listing, or clearing, the slow query log.
+
 Modules:
     flask: Provides the Flask web framework.
     flask_cors: Provides Cross-Origin Resource Sharing (CORS) support for Flask.
     browse.api_utils: Contains utility functions for querying and aggregating data.
+    browse.async_queries: Async variants of the queries, awaited by the async route handlers.
     browse.models: Contains the SQLAlchemy models for the application.
+    browse.ranking: Names the orders a limited get_data accepts.
+    browse.cache: Caches serialized responses until the next hourly ingest.
+    browse.columnar: Encodes results as dictionary-encoded columns, optionally as MessagePack.
+    browse.metrics: Times the serialization of each response.
+    browse.slow_queries: Records slow aggregation queries and their plans, when enabled.
+    browse.single_flight: Coalesces identical concurrent cache misses into one computation.
+
+Environment Variables:
+    ADMIN_TOKEN: When set, the bearer token the admin endpoints require. Optional.
 
 Usage:
     Import this module and register the Blueprint with your Flask app to enable the API endpoints.
+    The data endpoints are async views, which need Flask's async extra (asgiref) installed.
 """
 
-from flask import Blueprint, jsonify, request
+import asyncio
+import hashlib
+import hmac
+import os
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import partial
+from itertools import islice
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from flask import Blueprint, Response, current_app, jsonify, request
 from flask_cors import CORS
-from api_utils import query_model, query_global_sum, query_todays_downloads
+from api_utils import (
+    FILTER_COLUMNS,
+    STREAM_BATCH_SIZE,
+    query_model_columns,
+    stream_model,
+    query_latest_ingest,
+    load_cube,
+    load_hourly_totals,
+    replica_connections,
+    QueryTimeout,
+)
+from async_queries import (
+    query_model_async,
+    query_rollup_async,
+    query_global_sum_async,
+    query_todays_downloads_async,
+)
+from cache import ResultCache, make_key, result_cache
+from columnar import MSGPACK_AVAILABLE, MSGPACK_MIMETYPE, encode_columnar, pack_msgpack, rows_to_columns
 from models import get_model
+from ranking import ORDERS
+from metrics import span
+from slow_queries import slow_query_log
+from single_flight import single_flight
 
 # Setup Flask Blueprint and CORS
 api = Blueprint("api", __name__)
 CORS(api, resources={r"/*": {"origins": "*"}})
 
+# Queries accepted by /batch, at most BATCH_MAX_QUERIES per request, in JSON based formats
+BATCH_ENDPOINTS = ("get_data", "get_global_sum", "get_todays_downloads")
+BATCH_FORMATS = ("json", "columnar")
+BATCH_MAX_QUERIES = 20
+# the largest number of groups a limited get_data returns
+MAX_LIMIT = 1000
+
+# The newest ingested hour only moves at ingest boundaries, so it is looked up once per hour
+watermark_cache = ResultCache(max_entries=1)
+
 
 def validate_column(model, column_name):
     """Helper function to validate a column name exists on a model."""
@@ -43,96 +118,601 @@ def validate_column(model, column_name):
         raise ValueError(f"Invalid column name: {column_name}")
 
 
-@api.route("/get_data", methods=["GET"])
-def get_data():
-    """API endpoint to fetch aggregated data."""
-    model_name = request.args.get("model")
-    group_by_column = request.args.get("group_by")
-    second_group_by_column = request.args.get("second_group_by")
-    time_group = request.args.get("time_group")
+def validate_datetime(value, name):
+    """
+    Helper function to parse an optional ISO 8601 date or datetime argument.
+
+    Hours are stored as naive UTC, so a datetime with an offset is converted to UTC.
+    """
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name}, use an ISO 8601 date such as 2024-03-01: {value}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def validate_time_range(args):
+    """Helper function to parse the optional start and end arguments, with start no later than end."""
+    start = validate_datetime(args.get("start"), "start")
+    end = validate_datetime(args.get("end"), "end")
+    if start is not None and end is not None and start > end:
+        raise ValueError("Invalid time range, start must not be after end")
+    return start, end
+
+
+def validate_filters(model, args):
+    """
+    Helper function to collect the dimension filters present in the request arguments.
+
+    Each filter takes a comma separated list of values. Countries are stored uncapitalized,
+    so country values are lowercased.
+
+    Returns:
+        dict: Maps each filtered column name to its sorted list of values.
+    """
+    filters = {}
+    for column_name in FILTER_COLUMNS:
+        raw_value = args.get(column_name)
+        if not raw_value:
+            continue
+        validate_column(model, column_name)
+        values = [value.strip() for value in raw_value.split(",") if value.strip()]
+        if not values:
+            raise ValueError(f"Invalid {column_name} filter: {raw_value}")
+        if column_name == "country":
+            values = [value.lower() for value in values]
+        filters[column_name] = sorted(set(values))
+    return filters
+
+
+def validate_top(args):
+    """
+    Helper function validating the limit, order and other arguments of get_data.
+
+    Returns:
+        dict: The limit, order and other keyword arguments of query_model, or an empty dict without a limit.
+
+    Raises:
+        ValueError: If an argument is invalid, or order or other are given without a limit.
+    """
+    limit = args.get("limit")
+    if not limit:
+        if args.get("order") or args.get("other"):
+            raise ValueError("order and other are only used with limit")
+        return {}
+    if not limit.isdigit() or not 0 < int(limit) <= MAX_LIMIT:
+        raise ValueError(f"Invalid limit, use a whole number from 1 to {MAX_LIMIT}")
+
+    order = args.get("order", "desc")
+    if order not in ORDERS:
+        raise ValueError("Invalid order, use desc or asc")
+    other = args.get("other", "false")
+    if other not in ("true", "false"):
+        raise ValueError("Invalid other, use true or false")
+    return {"limit": int(limit), "order": order, "other": other == "true"}
+
+
+def filter_key(filters):
+    """Helper function flattening validated filters into cache key arguments."""
+    return {column_name: ",".join(values) for column_name, values in filters.items()}
+
+
+def validate_format(value, allowed):
+    """Helper function to validate the requested response format."""
+    output_format = value or "json"
+    if output_format not in allowed:
+        raise ValueError(f"Invalid format, use {', '.join(allowed)}: {output_format}")
+    if output_format == "msgpack" and not MSGPACK_AVAILABLE:
+        raise ValueError("The msgpack format is not available on this server")
+    return output_format
+
+
+def serialize(data, output_format="json"):
+    """Helper function serializing data for the response, returning (body, mimetype)."""
+    with span("serialize"):
+        if output_format == "msgpack":
+            return pack_msgpack(data), MSGPACK_MIMETYPE
+        body = current_app.json.dumps(data, separators=(",", ":")).encode("utf-8")
+        return body, "application/json"
+
+
+def cached_json(key, compute, output_format="json"):
+    """
+    Helper function returning a serialized response for key, computing and caching it on a miss.
+
+    The serialized bytes are cached rather than the data, so a hit skips both the database and jsonify.
+    """
+    entry = result_cache.get(key)
+    if entry is None:
+        entry = serialize(compute(), output_format)
+        result_cache.set(key, entry)
+    body, mimetype = entry
+    return Response(body, mimetype=mimetype)
+
+
+def latest_ingest():
+    """Helper function returning the start of the newest ingested hour, or None if there is no data."""
+    key = ("latest_ingest",)
+    watermark = watermark_cache.get(key)
+    if watermark is None:
+        watermark = query_latest_ingest()
+        watermark_cache.set(key, watermark)
+        # new hours may have landed, so bring the in-memory cube and hourly totals up to date as well
+        load_cube()
+        load_hourly_totals()
+    return watermark
+
+
+def streamed_json(rows, ndjson=False):
+    """
+    Helper function streaming rows as a chunked JSON array, or as newline delimited JSON.
+
+    Rows are serialized STREAM_BATCH_SIZE at a time as they arrive from the cursor, so the full
+    result is never held in memory. Streamed responses bypass the result cache.
+
+    The generator holds everything it needs, so it does not keep the request context alive; an async
+    view's context cannot be re-entered from the thread serving the response body.
+    """
+    dumps = partial(current_app.json.dumps, separators=(",", ":"))
+
+    def generate():
+        opened = False
+        while True:
+            chunk = [dumps(row) for row in islice(rows, STREAM_BATCH_SIZE)]
+            if not chunk:
+                break
+            if ndjson:
+                yield "\n".join(chunk) + "\n"
+            else:
+                yield ("," if opened else "[") + ",".join(chunk)
+                opened = True
+        if not ndjson:
+            yield "]" if opened else "[]"
+
+    mimetype = "application/x-ndjson" if ndjson else "application/json"
+    return Response(generate(), mimetype=mimetype)
+
+
+def make_etag(key, watermark):
+    """Helper function deriving the ETag of the response for key from the newest ingested hour."""
+    return hashlib.sha1(repr((key, watermark)).encode("utf-8")).hexdigest()
+
+
+def check_conditional(key):
+    """
+    Helper function working out the validators of the response for key, and whether the client holds it.
+
+    The ETag is derived from the request key and the newest ingested hour, so it can be checked
+    before anything is aggregated. Last-Modified is the end of the newest ingested hour.
+
+    Returns:
+        tuple: (etag, last_modified, not_modified).
+    """
+    watermark = latest_ingest()
+    etag = make_etag(key, watermark)
+    last_modified = None
+    if watermark is not None:
+        last_modified = (watermark + timedelta(hours=1)).replace(tzinfo=ZoneInfo("UTC"))
+
+    if request.if_none_match:
+        # If-None-Match uses the weak comparison (RFC 7232), as proxies may weaken the ETag, e.g. when compressing
+        not_modified = request.if_none_match.contains_weak(etag)
+    else:
+        not_modified = (
+            last_modified is not None
+            and request.if_modified_since is not None
+            and request.if_modified_since >= last_modified
+        )
+    return etag, last_modified, not_modified
+
+
+def set_validators(response, etag, last_modified):
+    """Helper function setting the validators, and allowing clients to reuse the response until the next ingest boundary."""
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = max(
+        int(result_cache.next_expiry() - result_cache.clock()), 0
+    )
+    return response
+
+
+def conditional_response(key, respond):
+    """Helper function answering with a 304 when the client already holds the current response."""
+    etag, last_modified, not_modified = check_conditional(key)
+    response = Response(status=304) if not_modified else respond()
+    return set_validators(response, etag, last_modified)
+
+
+async def cached_entry_async(key, compute, output_format="json"):
+    """
+    Helper function returning the cached (body, mimetype) for key, awaiting compute on a miss.
+
+    Identical requests missing the cache together await one computation, and with COALESCE_DIR set
+    so do those of other workers, see single_flight.py.
+    """
+    entry = result_cache.get(key)
+    if entry is None:
+
+        async def compute_entry():
+            entry = serialize(await compute(), output_format)
+            # cached before the computation is released, so no request falls between the two
+            result_cache.set(key, entry)
+            return entry
+
+        entry = await single_flight.run(key, compute_entry, shared_key=make_etag(key, latest_ingest()))
+        # a result shared by another worker still has to be cached in this one
+        result_cache.set(key, entry)
+    return entry
+
+
+async def conditional_json_async(key, compute, output_format="json"):
+    """
+    Helper function returning the cached response for key, or a 304 if the client holds it.
+
+    Like conditional_json, but compute is a coroutine function, awaited on a cache miss.
+    """
+    etag, last_modified, not_modified = check_conditional(key)
+    if not_modified:
+        response = Response(status=304)
+    else:
+        body, mimetype = await cached_entry_async(key, compute, output_format)
+        response = Response(body, mimetype=mimetype)
+    return set_validators(response, etag, last_modified)
+
+
+def conditional_json(key, compute, output_format="json"):
+    """Helper function returning the cached response for key, or a 304 if the client holds it."""
+    return conditional_response(key, lambda: cached_json(key, compute, output_format))
+
+
+def parse_get_data(args):
+    """
+    Helper function validating the arguments of get_data.
+
+    Returns:
+        tuple: (key, query_args, output_format, stream, levels, top), where query_args are the arguments
+            of query_model, levels are the columns to roll up, if any, and top holds the limit, order
+            and other keyword arguments of query_model, if a limit is given.
+
+    Raises:
+        ValueError: If an argument is missing or invalid.
+    """
+    model_name = args.get("model")
+    group_by_column = args.get("group_by")
+    second_group_by_column = args.get("second_group_by")
+    time_group = args.get("time_group")
+    levels = tuple(level.strip() for level in args.get("rollup", "").split(",") if level.strip())
 
     # check base parameters
-    if not model_name or not group_by_column:
-        return jsonify({"error": "Missing required parameters"}), 400
+    if not model_name or not (group_by_column or levels):
+        raise ValueError("Missing required parameters")
 
-    try:
-        model = get_model(model_name)
-        if model is None:
-            raise ValueError(f"Invalid model name: {model_name}")
+    model = get_model(model_name)
+    if model is None:
+        raise ValueError(f"Invalid model name: {model_name}")
 
-        # Validate our arguments
+    # Validate our arguments
+    if levels:
+        if group_by_column or second_group_by_column:
+            raise ValueError("Use either group_by or rollup, not both")
+        if len(set(levels)) != len(levels):
+            raise ValueError(f"Invalid rollup, a column is repeated: {args.get('rollup')}")
+        for level in levels:
+            validate_column(model, level)
+    else:
         validate_column(model, group_by_column)
-        if second_group_by_column:
-            validate_column(model, second_group_by_column)
-        if time_group and time_group not in ("year", "month", "day"):
-            return (
-                jsonify({"error": "Invalid time_group, use year, month, or day"}),
-                400,
+    if second_group_by_column:
+        validate_column(model, second_group_by_column)
+    if time_group and time_group not in ("year", "month", "day"):
+        raise ValueError("Invalid time_group, use year, month, or day")
+    start, end = validate_time_range(args)
+    filters = validate_filters(model, args)
+
+    top = validate_top(args)
+    if top and levels:
+        raise ValueError("Use either limit or rollup, not both")
+
+    output_format = validate_format(args.get("format"), ("json", "ndjson", "columnar", "msgpack"))
+    stream = output_format == "ndjson" or args.get("stream") == "true"
+    if stream and levels:
+        raise ValueError("Rollups cannot be streamed, use the json, columnar or msgpack format")
+    if stream and top:
+        raise ValueError("Limited results cannot be streamed, use the json, columnar or msgpack format")
+    query_args = (
+        model_name,
+        group_by_column,
+        second_group_by_column,
+        time_group,
+        start,
+        end,
+        filters,
+    )
+    key = make_key(
+        "get_data",
+        {
+            "model": model_name,
+            "group_by": group_by_column,
+            "second_group_by": second_group_by_column,
+            "rollup": ",".join(levels),
+            **{key: str(value) for key, value in top.items()},
+            "time_group": time_group,
+            "start": start and start.isoformat(),
+            "end": end and end.isoformat(),
+            **filter_key(filters),
+            "format": output_format,
+            "stream": stream,
+        },
+    )
+    return key, query_args, output_format, stream, levels, top
+
+
+async def compute_get_data(query_args, output_format, levels=(), top=None):
+    """Helper function computing the data of a non-streamed get_data response."""
+    top = top or {}
+    # every level of a rollup comes from one GROUP BY ROLLUP query
+    if levels:
+        model_name, _, _, time_group, start, end, filters = query_args
+        data = await query_rollup_async(model_name, levels, time_group, start, end, filters)
+        if output_format == "json":
+            return data
+        names = [*levels, "data", *(["time_group"] if time_group else []), "level"]
+        return encode_columnar(rows_to_columns(data, names), {*levels, "time_group"})
+
+    # columnar formats send one dictionary-encoded array per field
+    if output_format in ("columnar", "msgpack"):
+        dimensions = {query_args[1], query_args[2], "time_group"}
+        columns = await asyncio.to_thread(partial(query_model_columns, *query_args, **top))
+        return encode_columnar(columns, dimensions)
+    return await query_model_async(*query_args, **top)
+
+
+def parse_get_global_sum(args):
+    """
+    Helper function validating the arguments of get_global_sum.
+
+    Returns:
+        tuple: (key, query_args, output_format), where query_args are the arguments of query_global_sum.
+
+    Raises:
+        ValueError: If an argument is missing or invalid.
+    """
+    model_name = args.get("model")
+    time_group = args.get("time_group")
+
+    if not model_name or not time_group:
+        raise ValueError("Missing required parameters")
+
+    if time_group not in ("year", "month", "day", "hour"):
+        raise ValueError("Invalid time_group, use year, month, or day")
+
+    model = get_model(model_name)
+    if model is None:
+        raise ValueError(f"Invalid model name: {model_name}")
+    start, end = validate_time_range(args)
+    filters = validate_filters(model, args)
+    output_format = validate_format(args.get("format"), ("json", "columnar", "msgpack"))
+
+    key = make_key(
+        "get_global_sum",
+        {
+            "model": model_name,
+            "time_group": time_group,
+            "start": start and start.isoformat(),
+            "end": end and end.isoformat(),
+            **filter_key(filters),
+            "format": output_format,
+        },
+    )
+    return key, (model_name, time_group, start, end, filters), output_format
+
+
+async def compute_get_global_sum(query_args, output_format):
+    """Helper function computing the data of a get_global_sum response."""
+    data = await query_global_sum_async(*query_args)
+    if output_format == "json":
+        return data
+    return encode_columnar(rows_to_columns(data, ("time_group", "total_sum")), ())
+
+
+def parse_get_todays_downloads(args):
+    """
+    Helper function validating the arguments of get_todays_downloads.
+
+    Returns:
+        tuple: (key, timezone).
+
+    Raises:
+        ValueError: If the timezone is not a known IANA timezone.
+    """
+    timezone = args.get("timezone", "UTC")
+
+    # any IANA timezone is accepted; it is only ever passed as a bound parameter
+    try:
+        ZoneInfo(timezone)
+    except (ValueError, ZoneInfoNotFoundError):
+        raise ValueError(f"Invalid timezone '{timezone}'")
+
+    # "today" depends on the local date as well as on the newest ingested hour
+    local_date = datetime.now(ZoneInfo(timezone)).date().isoformat()
+    return make_key("get_todays_downloads", {"timezone": timezone, "date": local_date}), timezone
+
+
+@api.route("/get_data", methods=["GET"])
+async def get_data():
+    """API endpoint to fetch aggregated data."""
+    try:
+        key, query_args, output_format, stream, levels, top = parse_get_data(request.args)
+
+        # large results can be streamed straight from the cursor instead of being cached
+        if stream:
+            return conditional_response(
+                key,
+                lambda: streamed_json(
+                    stream_model(*query_args), ndjson=output_format == "ndjson"
+                ),
             )
 
         # attempt to query the model using our given arguments and return in json format for the frontend
-        data = query_model(
-            model_name, group_by_column, second_group_by_column, time_group
+        return await conditional_json_async(
+            key, lambda: compute_get_data(query_args, output_format, levels, top), output_format
         )
-        return jsonify(data)
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
+    except QueryTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": "Internal server error"}), 500
 
 
 @api.route("/get_global_sum", methods=["GET"])
-def get_global_sum():
+async def get_global_sum():
     """API endpoint to fetch the global sum of data aggregated by time unit."""
-    model_name = request.args.get("model")
-    time_group = request.args.get("time_group")
-
-    if not model_name or not time_group:
-        return jsonify({"error": "Missing required parameters"}), 400
-
-    if time_group and time_group not in ("year", "month", "day", "hour"):
-        return jsonify({"error": "Invalid time_group, use year, month, or day"}), 400
-
     try:
-        model = get_model(model_name)
-        if model is None:
-            raise ValueError(f"Invalid model name: {model_name}")
-
-        data = query_global_sum(model_name, time_group)
-        return jsonify(data)
+        key, query_args, output_format = parse_get_global_sum(request.args)
+        return await conditional_json_async(
+            key, lambda: compute_get_global_sum(query_args, output_format), output_format
+        )
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
+    except QueryTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": "Internal server error"}), 500
 
 
 @api.route("/get_todays_downloads", methods=["GET"])
-def get_todays_downloads():
+async def get_todays_downloads():
     """API endpoint to fetch today's download statistics aggregated by hour, optionally in a specified timezone. Defaults to UTC."""
     try:
-        timezone = request.args.get("timezone", "UTC")
-
-        # Only allow known safe timezones to prevent SQL injection or invalid queries
-        # TODO: Use more universal timezones / add more. 
-        allowed_timezones = {
-            "UTC",
-            "America/New_York",
-            "America/Chicago",
-            "America/Denver",
-            "America/Los_Angeles",
-            "Europe/London",
-            "Europe/Berlin",
-            "Asia/Tokyo",
-            "Asia/Shanghai",
-            "Asia/Kolkata",
-            "Australia/Sydney"
-        }
-
-        if timezone not in allowed_timezones:
-            return jsonify({"error": f"Invalid timezone '{timezone}'"}), 400
-
-        data = query_todays_downloads(timezone)
-        return jsonify(data)
+        key, timezone = parse_get_todays_downloads(request.args)
+        return await conditional_json_async(key, lambda: query_todays_downloads_async(timezone))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except QueryTimeout as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception:
+        return jsonify({"error": "Internal server error"}), 500
+
+
+def parse_batch_query(spec):
+    """
+    Helper function validating one query of a batch, given as the arguments of its endpoint.
+
+    Returns:
+        tuple: (key, compute, output_format), with the same cache key as the equivalent GET request.
+
+    Raises:
+        ValueError: If the endpoint or an argument is invalid.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("Each query must be an object")
+    endpoint = spec.get("endpoint")
+    args = {
+        name: ",".join(map(str, value)) if isinstance(value, list) else str(value)
+        for name, value in spec.items()
+        if name != "endpoint" and value is not None
+    }
+
+    if endpoint == "get_data":
+        key, query_args, output_format, stream, levels, top = parse_get_data(args)
+        if stream or output_format not in BATCH_FORMATS:
+            raise ValueError(f"Invalid format for a batch, use {', '.join(BATCH_FORMATS)}")
+        return key, lambda: compute_get_data(query_args, output_format, levels, top), output_format
+    if endpoint == "get_global_sum":
+        key, query_args, output_format = parse_get_global_sum(args)
+        if output_format not in BATCH_FORMATS:
+            raise ValueError(f"Invalid format for a batch, use {', '.join(BATCH_FORMATS)}")
+        return key, lambda: compute_get_global_sum(query_args, output_format), output_format
+    if endpoint == "get_todays_downloads":
+        key, timezone = parse_get_todays_downloads(args)
+        return key, lambda: query_todays_downloads_async(timezone), "json"
+    raise ValueError(f"Invalid endpoint, use {', '.join(BATCH_ENDPOINTS)}: {endpoint}")
+
+
+async def batch_error(status, message):
+    """Helper function answering one query of a batch with a serialized {"status", "error"} object."""
+    return serialize({"status": status, "error": message})[0]
+
 
+async def run_batch_query(key, compute, output_format):
+    """Helper function answering one query of a batch as a serialized {"status", "data" | "error"} object."""
+    try:
+        body, _ = await cached_entry_async(key, compute, output_format)
+        return b'{"status":200,"data":' + body + b"}"
+    except ValueError as e:
+        return await batch_error(400, str(e))
+    except QueryTimeout as e:
+        return await batch_error(503, str(e))
+    except Exception:
+        return await batch_error(500, "Internal server error")
+
+
+@api.route("/batch", methods=["POST"])
+async def batch():
+    """API endpoint answering several get_data, get_global_sum and get_todays_downloads queries at once."""
+    payload = request.get_json(silent=True)
+    queries = payload.get("queries") if isinstance(payload, dict) else None
+    if not isinstance(queries, list) or not queries:
+        return jsonify({"error": "Missing required parameters"}), 400
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify({"error": f"A batch may hold at most {BATCH_MAX_QUERIES} queries"}), 400
+
+    try:
+        # brings the in-memory cube up to date, as a GET would
+        latest_ingest()
     except Exception:
         return jsonify({"error": "Internal server error"}), 500
+
+    # identical queries run once, and an invalid query fails on its own without failing the batch
+    answers = {}
+    keys = []
+    for index, spec in enumerate(queries):
+        try:
+            key, compute, output_format = parse_batch_query(spec)
+            if key not in answers:
+                answers[key] = run_batch_query(key, compute, output_format)
+        except ValueError as e:
+            key = ("invalid", index)
+            answers[key] = batch_error(400, str(e))
+        keys.append(key)
+
+    results = dict(zip(answers, await asyncio.gather(*answers.values())))
+    body = b'{"results":[' + b",".join(results[key] for key in keys) + b"]}"
+    return Response(body, mimetype="application/json")
+
+
+@api.route("/cache_stats", methods=["GET"])
+def get_cache_stats():
+    """
+    API endpoint reporting the hit and miss counters of the result cache, how many misses were coalesced,
+    and the connections checked out of each read replica.
+    """
+    return jsonify(
+        {**result_cache.stats(), "single_flight": single_flight.stats(), "replicas": replica_connections()}
+    )
+
+
+@api.route("/slow_queries", methods=["GET", "DELETE"])
+def slow_queries():
+    """
+    Admin endpoint listing the slow query log, newest first, with each query's plan. DELETE clears it.
+
+    Requests must send ADMIN_TOKEN as "Authorization: Bearer <token>"; without ADMIN_TOKEN set, the
+    endpoint refuses every request, as the log holds statements and their bound parameters.
+    """
+    if not slow_query_log.enabled:
+        return jsonify({"error": "The slow query log is disabled, set SLOW_QUERY_MS to enable it"}), 404
+    token = os.getenv("ADMIN_TOKEN")
+    authorization = request.headers.get("Authorization", "").encode()
+    if not token or not hmac.compare_digest(authorization, f"Bearer {token}".encode()):
+        return jsonify({"error": "Forbidden"}), 403
+
+    if request.method == "DELETE":
+        slow_query_log.clear()
+        return "", 204
+    return jsonify({"threshold_ms": slow_query_log.threshold_ms, "queries": slow_query_log.entries()})
@@ -5,31 +5,113 @@ This module provides utility functions for querying and aggregating data from th
 It includes functions for time-based aggregation, querying models, and fetching specific data such as today's downloads.
 
 Functions:
-    get_time_group_column(model, time_group):
-        Helper function to return the appropriate SQLAlchemy/MySQL extract functions for time-based aggregation.
+    apply_filters(query, model, filters):
+        Restricts a query to rows matching the given dimension filters.
 
-    query_model(model_name, group_by_column, second_group_by_column=None, time_group=None):
+    query_cube(model_name, columns, time_group=None, start=None, end=None, filters=None):
+        Answers an aggregation from the in-memory cube, if it holds what is needed.
+
+    load_cube():
+        Loads the in-memory cube, or extends it with newly ingested hours.
+
+    history_split(model_name, columns, start=None, end=None, filters=None):
+        Returns the hour splitting an aggregation between the Parquet files of closed months and the
+        database, or None if it goes to the database alone.
+
+    history_model_rows / history_rollup_rows / history_global_sums(boundary, ...):
+        Aggregate the closed months from the Parquet files and the rest from the database, and merge them.
+
+    cube_model_rows(model_name, group_by_column, ...):
+        Returns the rows of build_model_query from the in-memory cube, or None if it cannot answer them.
+
+    fetch_model_rows(model_name, group_by_column, ...):
+        Returns aggregated rows from the in-memory cube or the database.
+
+    run_model_query(session, model_name, group_by_column, ...):
+        Runs build_model_query, keeping only the top groups when a limit is given.
+
+    query_model(model_name, group_by_column, second_group_by_column=None, time_group=None, start=None, end=None, filters=None, limit=None, order='desc', other=False):
         Query the specified model to aggregate data by a given column, optionally grouped by year, month, or day.
 
-    query_global_sum(model_name, time_group):
+    build_model_query(session, model_name, group_by_column, ...):
+        Builds the aggregation query behind query_model without executing it.
+
+    title_countries(values):
+        Capitalizes a column of country names through a lookup table of those already seen.
+
+    format_model_columns(rows, group_by_column, second_group_by_column=None, time_group=None):
+        Formats aggregated rows into one list per field, transforming whole columns at a time.
+
+    format_model_rows(rows, group_by_column, second_group_by_column=None, time_group=None):
+        Formats aggregated rows into the dicts returned by the API.
+
+    query_model_columns(model_name, group_by_column, ...):
+        Like query_model, but returns one list per field instead of one dict per row.
+
+    stream_model(model_name, group_by_column, ..., batch_size=STREAM_BATCH_SIZE):
+        Streams the rows of query_model from a server-side cursor.
+
+    query_rollup(model_name, levels, time_group=None, start=None, end=None, filters=None):
+        Queries the totals of every level of a hierarchy of columns in one scan.
+
+    fetch_rollup_rows(session, model_name, levels, ...) / format_rollup_rows(rows, levels, time_group=None):
+        Run and format the GROUP BY ROLLUP query behind query_rollup.
+
+    query_global_sum(model_name, time_group, start=None, end=None, filters=None):
         Queries the total sum of data aggregated by time group.
 
-    query_todays_downloads():
+    build_global_sum_query(session, model_name, time_group, ...) / format_global_sums(rows, time_group, ...):
+        Build and format the query behind query_global_sum, shared with async_queries.py.
+
+    query_todays_downloads(timezone='UTC'):
         Queries for today's download statistics aggregated by hour.
 
+    build_todays_downloads_query(session, timezone='UTC', local_date=None):
+        Builds the UTC range query behind query_todays_downloads.
+
+    format_todays_downloads(rows):
+        Formats today's totals by local hour into the list returned by the API.
+
+    load_hourly_totals() / live_todays_downloads(timezone='UTC'):
+        Refresh and read the in-memory per-hour totals answering query_todays_downloads.
+
+    query_latest_ingest():
+        Queries for the start of the newest hour present in the hourly data.
+
 Modules:
+    logging: Reports failures to refresh the in-memory data.
     os: Provides a way of using operating system dependent functionality.
     sqlalchemy: SQL toolkit and Object-Relational Mapping (ORM) library.
     dotenv: Loads environment variables from a .env file.
     browse.models: Contains the SQLAlchemy models for the application.
     browse.add_old_data: Contains functions to inject old data into the results.
+    browse.rollups: Chooses the pre-aggregated rollup table able to answer a query.
+    browse.time_buckets: Groups and filters rows by the start of their time bucket.
+    browse.cube: Holds recent hourly data in memory for vectorized aggregation.
+    browse.grouping: Builds GROUP BY ROLLUP queries, or sums up their subtotals in Python.
+    browse.ranking: Keeps the top N groups of a query, with an optional "Other" row, in SQL or in Python.
+    browse.live_totals: Holds the totals of the last two days of UTC hours in memory.
+    browse.metrics: Times the queries and formatting of each request.
+    browse.slow_queries: Records slow aggregation queries and their plans, when enabled.
+    browse.replicas: Sends the read queries of each session to a read-only replica, when configured.
+    browse.statement_timeouts: Cancels aggregation queries running past their budget with QueryTimeout.
+    browse.parquet_store: Aggregates closed months from Parquet files with DuckDB, when enabled.
 
 Environment Variables:
     PROD_DB_URL: The database URL for the production environment.
+    DATABASE_REPLICA_URIS: Comma separated read-only replica URLs that reads are routed to. Optional.
+    DB_REPLICA_ROUTING: How replicas are chosen, round_robin or least_busy. Defaults to round_robin.
+    DB_POOL_SIZE: Connections each process keeps open. Defaults to 5.
+    DB_MAX_OVERFLOW: Extra connections each process may open under load. Defaults to 10.
+    DB_POOL_RECYCLE: Seconds after which a pooled connection is replaced. Defaults to 1800.
+    DB_POOL_TIMEOUT: Seconds to wait for a free connection before failing. Defaults to 30.
 
 SQLAlchemy Setup:
-    engine: The SQLAlchemy engine created using the database URL.
-    SessionFactory: The session factory created using the engine.
+    engine: The SQLAlchemy engine created using the database URL and engine_options().
+    replica_router: Chooses the replica engine each session reads from, or None without replicas.
+    dispose_engine: Drops the pooled connections, e.g. in a newly forked worker.
+    replica_connections: Returns the connections this process has checked out of each replica.
+    SessionFactory: The session factory created using the engine, routing reads to the replicas.
     Session: The scoped session created using the session factory.
 
 Usage:
@@ -37,155 +119,824 @@ Usage:
     Ensure that the environment variables are properly set before using the functions.
 """
 
+import logging
 import os
-from sqlalchemy import create_engine, func, extract, text
+from datetime import datetime
+from itertools import islice
+from zoneinfo import ZoneInfo
+from sqlalchemy import create_engine, func, or_, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import sessionmaker, scoped_session
 from dotenv import load_dotenv # Uncomment this line if needed
-from models import get_model
+from models import HourlyDownloadData, get_model
 from add_old_data import inject_old_data
+from rollups import select_source_model
+from time_buckets import (
+    get_time_group_column,
+    apply_time_range,
+    format_time_groups,
+    local_day_range,
+    sum_by_local_hour,
+)
+from cube import DIMENSIONS as CUBE_DIMENSIONS, get_cube, refresh_cube
+from grouping import Rollup, rollup_level, rollup_rows, supports_rollup
+from ranking import build_top_n_query, supports_window_functions, top_n_rows
+from live_totals import get_hourly_totals, refresh_hourly_totals
+from metrics import query_shape, span
+from slow_queries import slow_query_log
+from replicas import ReplicaRouter, RoutingSession
+from statement_timeouts import QueryTimeout
+from parquet_store import DIMENSIONS as PARQUET_DIMENSIONS, get_store as get_parquet_store, merge_rows
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()  # Uncomment this line if needed
 DATABASE_URL = os.getenv("DATABASE_URI")
+REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URIS", "").split(",") if url.strip()]
+
+
+def engine_options(database_url):
+    """
+    Returns the connection pool settings for create_engine.
+
+    Connections are checked with a ping before use and recycled before the server times them out.
+    SQLite does not use a sized pool, so it only gets the ping.
+    """
+    options = {"pool_pre_ping": True}
+    if make_url(database_url).get_backend_name() != "sqlite":
+        options.update(
+            pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+            pool_timeout=int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        )
+    return options
+
 
 # SQLAlchemy setup
-engine = create_engine(DATABASE_URL)
-SessionFactory = sessionmaker(bind=engine)
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+replica_router = None
+if REPLICA_URLS:
+    replica_router = ReplicaRouter(
+        [create_engine(url, **engine_options(url)) for url in REPLICA_URLS],
+        os.getenv("DB_REPLICA_ROUTING", "round_robin"),
+    )
+SessionFactory = sessionmaker(bind=engine, class_=RoutingSession, router=replica_router)
 Session = scoped_session(SessionFactory)
 
+# plans of slow queries are captured on the replica that ran them, or else on the regular engine, also
+# for queries run on the asyncio one
+slow_query_log.set_engine(engine, replica_router.engines if replica_router is not None else ())
+
+
+def replica_connections():
+    """Returns the number of connections this process has checked out of each replica, by URL without password."""
+    return replica_router.in_use() if replica_router is not None else {}
+
+
+def dispose_engine():
+    """
+    Drops the pooled connections so this process opens its own.
+
+    Called in each worker after the server forks it, as a socket opened by the parent must not be
+    used by two processes. The parent's connections are left open for the parent.
+    """
+    Session.remove()
+    engine.dispose(close=False)
+    if replica_router is not None:
+        replica_router.dispose()
+
+
+# Rows fetched per round trip when streaming results
+STREAM_BATCH_SIZE = 1000
+
+# Columns the API accepts filters on
+FILTER_COLUMNS = ("country", "category", "archive", "download_type")
+
+
+def apply_filters(query, model, filters):
+    """
+    Restricts a query to rows matching the given dimension filters.
+
+    Args:
+        query (Query): The query to restrict.
+        model (SQLAlchemy Model): The model being queried.
+        filters (dict): Maps a column name to the list of values to keep. A value ending in '*'
+            matches every value starting with the text before it, e.g. 'cs.*'.
 
-def get_time_group_column(model, time_group):
+    Returns:
+        Query: The restricted query.
     """
-    Helper function to return the appropriate SQLAlchemy/MySQL extract functions for time-based aggregation.
+    for column_name, values in (filters or {}).items():
+        column = getattr(model, column_name)
+        exact = [value for value in values if not value.endswith("*")]
+        conditions = [
+            column.startswith(value[:-1], autoescape=True)
+            for value in values
+            if value.endswith("*")
+        ]
+        if exact:
+            conditions.append(column.in_(exact))
+        query = query.filter(or_(*conditions))
+    return query
+
+
+def build_model_query(
+    session,
+    model_name,
+    group_by_column,
+    second_group_by_column=None,
+    time_group=None,
+    start=None,
+    end=None,
+    filters=None,
+):
+    """
+    Builds the aggregation query behind query_model without executing it.
 
     Args:
-        model (SQLAlchemy Model): The SQLAlchemy model to extract time group columns from.
-        time_group (str): The time group to extract ('year', 'month', 'day').
+        session (Session): The session the query will run in.
+        The remaining arguments are those of query_model.
 
     Returns:
-        list: A list of SQLAlchemy extract functions based on the specified time group.
+        Query: The grouped query, whose rows are (group_by, data[, second_group_by][, time_group]).
 
     Raises:
-        ValueError: If an invalid time group is provided.
-    """
-    if time_group == "year":
-        return [extract("year", model.start_dttm)]
-    elif time_group == "month":
-        return [extract("year", model.start_dttm), extract("month", model.start_dttm)]
-    elif time_group == "day":
-        return [
-            extract("year", model.start_dttm),
-            extract("month", model.start_dttm),
-            extract("day", model.start_dttm),
-        ]
+        ValueError: If an incorrect model name or column is given.
+    """
+    model = get_model(model_name)
+    if model is None:
+        raise ValueError(f"Invalid model name: {model_name}")
+
+    # read from the coarsest rollup that holds every column we need
+    model = select_source_model(
+        model,
+        [group_by_column, second_group_by_column, *(filters or {})],
+        time_group,
+        start,
+        end,
+    )
+
+    # Ensure the group_by column is valid
+    group_by_attr = getattr(model, group_by_column, None)
+    if not group_by_attr:
+        raise ValueError(f"Query_model recieved an invalid group_by column: {group_by_column}")
+
+    # Handle optional second grouping column
+    second_group_by_attr = (
+        getattr(model, second_group_by_column, None)
+        if second_group_by_column
+        else None
+    )
+
+    # Base columns and group by settings
+    columns = [group_by_attr, func.sum(model.primary_count).label("data")]
+    group_by_columns = [group_by_attr]
+
+    # Add second group by column if present
+    if second_group_by_attr:
+        columns.append(second_group_by_attr)
+        group_by_columns.append(second_group_by_attr)
+
+    # Handle time aggregation by truncating to the start of the specified time group
+    if time_group:
+        time_bucket = get_time_group_column(model, time_group)
+        columns.append(time_bucket)
+        group_by_columns.append(time_bucket)
+
+    # Construct the query
+    query = apply_time_range(session.query(*columns), model, start, end)
+    query = apply_filters(query, model, filters)
+    shape = query_shape("model", [group_by_column, second_group_by_column], time_group)
+    return query.group_by(*group_by_columns).execution_options(query_shape=shape)
+
+
+# country names as the API returns them, keyed by their stored lowercase names
+_country_titles = {None: None}
+
+
+def title_countries(values):
+    """
+    Capitalizes a column of country names, e.g. 'united states' to 'United States'.
+
+    There are only a few hundred distinct countries, so each name is capitalized once per process
+    and then looked up.
+
+    Args:
+        values (list): Stored country names, or None for rolled up rows.
+
+    Returns:
+        list: The capitalized names, in the order of values.
+    """
+    titles = _country_titles
+    for value in [value for value in set(values) if value not in titles]:
+        titles[value] = value.title()
+    return list(map(titles.__getitem__, values))
+
+
+def format_model_columns(rows, group_by_column, second_group_by_column=None, time_group=None):
+    """
+    Formats rows of build_model_query into one list per field.
+
+    The rows are transposed into columns first, so country names and dates are transformed a whole
+    column at a time rather than row by row.
+
+    Returns:
+        dict: Maps each field name, in the order the API returns them, to the list of its values.
+    """
+    names = [group_by_column, "data"]
+    if second_group_by_column:
+        names.append(second_group_by_column)
+    if time_group:
+        names.append("time_group")
+
+    if rows:
+        columns = dict(zip(names, map(list, zip(*rows))))
     else:
-        raise ValueError(f"get_time_group_column recieved an invalid time group: {time_group}")
+        columns = {name: [] for name in names}
+
+    # capitalize country names
+    if group_by_column == "country":
+        columns["country"] = title_countries(columns["country"])
+
+    # fill in the date
+    if time_group:
+        columns["time_group"] = format_time_groups(columns["time_group"], time_group)
+    return columns
+
+
+def format_model_rows(rows, group_by_column, second_group_by_column=None, time_group=None):
+    """Formats rows of build_model_query into the dicts returned by the API, see format_model_columns."""
+    with span("format", len(rows)):
+        columns = format_model_columns(rows, group_by_column, second_group_by_column, time_group)
+        names = list(columns)
+        return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+
+def query_cube(model_name, columns, time_group=None, start=None, end=None, filters=None):
+    """
+    Answers an aggregation from the in-memory cube, if it is loaded and holds what is needed.
+
+    Args:
+        model_name (str): The name of the model being queried.
+        columns (list): The columns to group by.
+        The remaining arguments are those of query_model.
+
+    Returns:
+        list: Tuples of (*column values, [bucket start,] total), or None to fall back to SQL.
+    """
+    cube = get_cube()
+    if cube is None or get_model(model_name) is not HourlyDownloadData:
+        return None
+    if any(column not in CUBE_DIMENSIONS for column in [*columns, *(filters or {})]):
+        return None
+    if not cube.covers(start, end):
+        return None
+    with span("cube"):
+        return cube.aggregate(columns, time_group, start, end, filters)
+
+
+def load_cube():
+    """Loads the in-memory cube, or extends it with newly ingested hours, if it is enabled."""
+    session = Session()
+    # a lagging replica would have the cube mark hours as loaded without their rows
+    session.use_primary()
+    try:
+        return refresh_cube(session)
+    finally:
+        session.close()
+
+
+def history_split(model_name, columns, start=None, end=None, filters=None):
+    """
+    Returns the hour splitting an aggregation between the Parquet files of closed months and the database.
+
+    Args:
+        model_name (str): The name of the model being queried.
+        columns (list): The columns to group by, None entries being skipped.
+        The remaining arguments are those of query_model.
+
+    Returns:
+        datetime: The end of the exported months, or None if the aggregation goes to the database alone.
+    """
+    store = get_parquet_store()
+    if store is None or get_model(model_name) is not HourlyDownloadData:
+        return None
+    if any(column not in PARQUET_DIMENSIONS for column in [*columns, *(filters or {})] if column):
+        return None
+    return store.split(start, end)
+
+
+def split_range(boundary, start=None, end=None):
+    """Returns the parts of [start, end) before and from boundary, the latter None if it is empty."""
+    history = (start, boundary if end is None else min(end, boundary))
+    recent = None
+    if end is None or end > boundary:
+        recent = (boundary if start is None else max(start, boundary), end)
+    return history, recent
+
+
+def history_model_rows(
+    boundary,
+    model_name,
+    group_by_column,
+    second_group_by_column=None,
+    time_group=None,
+    start=None,
+    end=None,
+    filters=None,
+):
+    """
+    Returns the rows of build_model_query, with the hours before boundary read from the Parquet files.
+
+    Args:
+        boundary (datetime): The hour returned by history_split.
+        The remaining arguments are those of query_model.
+
+    Returns:
+        list: Rows of (group_by, data[, second_group_by][, time_group]), in no particular order.
+    """
+    history, recent = split_range(boundary, start, end)
+    with span("parquet"):
+        rows = get_parquet_store().model_rows(
+            group_by_column, second_group_by_column, time_group, *history, filters
+        )
+    if recent is None:
+        return rows
+
+    session = Session()
+    try:
+        recent_rows = run_model_query(
+            session, model_name, group_by_column, second_group_by_column, time_group, *recent, filters
+        )
+    finally:
+        session.close()
+    return merge_rows([rows, recent_rows], 1)
+
+
+def cube_model_rows(
+    model_name,
+    group_by_column,
+    second_group_by_column=None,
+    time_group=None,
+    start=None,
+    end=None,
+    filters=None,
+):
+    """
+    Returns the rows of build_model_query from the in-memory cube, or None if it cannot answer them.
+
+    Args:
+        The arguments of query_model.
+
+    Returns:
+        list: Rows of (group_by, data[, second_group_by][, time_group]), or None.
+    """
+    columns = [group_by_column] + ([second_group_by_column] if second_group_by_column else [])
+    cube_rows = query_cube(model_name, columns, time_group, start, end, filters)
+    if cube_rows is None:
+        return None
+    return [(row[0], row[-1], *row[1:-1]) for row in cube_rows]
+
+
+def run_model_query(
+    session,
+    model_name,
+    group_by_column,
+    second_group_by_column=None,
+    time_group=None,
+    start=None,
+    end=None,
+    filters=None,
+    limit=None,
+    order="desc",
+    other=False,
+):
+    """
+    Runs build_model_query, keeping only the top groups when a limit is given.
+
+    The groups are ranked in the same statement on databases with window functions, and in Python
+    otherwise, see ranking.py.
+
+    Args:
+        session (Session): The session to run the query in.
+        The remaining arguments are those of query_model.
+
+    Returns:
+        list: Rows of (group_by, data[, second_group_by][, time_group]).
+    """
+    query = build_model_query(
+        session,
+        model_name,
+        group_by_column,
+        second_group_by_column,
+        time_group,
+        start,
+        end,
+        filters,
+    )
+    if not limit:
+        return query.all()
+    if not supports_window_functions(session.get_bind().dialect):
+        return top_n_rows(query.all(), limit, order, other)
+
+    shape = query_shape("model_top", [group_by_column, second_group_by_column], time_group)
+    top = build_top_n_query(session, query, group_by_column, limit, order, other)
+    return top.execution_options(query_shape=shape).all()
+
+
+def fetch_model_rows(
+    model_name,
+    group_by_column,
+    second_group_by_column=None,
+    time_group=None,
+    start=None,
+    end=None,
+    filters=None,
+    limit=None,
+    order="desc",
+    other=False,
+):
+    """
+    Returns the rows of run_model_query, answered from the in-memory cube when it holds the range.
+
+    Args:
+        The arguments of query_model.
+
+    Returns:
+        list: Rows of (group_by, data[, second_group_by][, time_group]).
+    """
+    cube_rows = cube_model_rows(
+        model_name,
+        group_by_column,
+        second_group_by_column,
+        time_group,
+        start,
+        end,
+        filters,
+    )
+    if cube_rows is not None:
+        return top_n_rows(cube_rows, limit, order, other) if limit else cube_rows
+
+    # closed months can be read from Parquet files, see parquet_store.py
+    columns = [group_by_column, second_group_by_column]
+    boundary = history_split(model_name, columns, start, end, filters)
+    if boundary is not None:
+        rows = history_model_rows(
+            boundary,
+            model_name,
+            group_by_column,
+            second_group_by_column,
+            time_group,
+            start,
+            end,
+            filters,
+        )
+        return top_n_rows(rows, limit, order, other) if limit else rows
+
+    session = Session()
+    try:
+        return run_model_query(
+            session,
+            model_name,
+            group_by_column,
+            second_group_by_column,
+            time_group,
+            start,
+            end,
+            filters,
+            limit,
+            order,
+            other,
+        )
+    finally:
+        session.close()
 
 
 def query_model(
-    model_name, group_by_column, second_group_by_column=None, time_group=None
+    model_name,
+    group_by_column,
+    second_group_by_column=None,
+    time_group=None,
+    start=None,
+    end=None,
+    filters=None,
+    limit=None,
+    order="desc",
+    other=False,
 ):
     """
-    Query the specified model to aggregate data by a given column, optionally grouped by year, month, day, or hour.
+    Query the specified model to aggregate data by a given column, optionally grouped by year, month, or day.
 
     Args:
         model_name (str): The name of the model to query.
         group_by_column (str): The column to group by.
         second_group_by_column (str): An optional second column to further group by.
-        time_group (str): Either 'month', 'year', 'day', or 'hour' to aggregate data by that period.
+        time_group (str): Either 'month', 'year', or 'day' to aggregate data by that period.
+        start (datetime): Only include data from this hour onward.
+        end (datetime): Only include data before this hour.
+        filters (dict): Maps a column name to the values to keep, see apply_filters.
+        limit (int): Only return the rows of the limit groups of group_by_column with the largest
+            totals over the whole range. Optional.
+        order (str): 'desc' keeps the largest groups, 'asc' the smallest. Only used with limit.
+        other (bool): Whether the remaining groups are summed into one 'Other' group. Only used
+            with limit.
 
     Returns:
         final_result (list): A list of dicts, with keys corresponding to each given argument and their respective values based on said key.
+            With a limit, the rows are in rank order.
+
+    Raises:
+        ValueError: If an incorrect model name or column is given.
+    """
+    result = fetch_model_rows(
+        model_name,
+        group_by_column,
+        second_group_by_column,
+        time_group,
+        start,
+        end,
+        filters,
+        limit,
+        order,
+        other,
+    )
+
+    # Format results
+    return format_model_rows(result, group_by_column, second_group_by_column, time_group)
+
+
+def query_model_columns(
+    model_name,
+    group_by_column,
+    second_group_by_column=None,
+    time_group=None,
+    start=None,
+    end=None,
+    filters=None,
+    limit=None,
+    order="desc",
+    other=False,
+):
+    """
+    Like query_model, but returns one list per field instead of one dict per row.
+
+    The rows are transposed as they come from the database, so no per-row dicts are built.
+
+    Args:
+        The arguments of query_model.
+
+    Returns:
+        columns (dict): Maps each field name to the list of its values, all of equal length.
+
+    Raises:
+        ValueError: If an incorrect model name or column is given.
+    """
+    result = fetch_model_rows(
+        model_name,
+        group_by_column,
+        second_group_by_column,
+        time_group,
+        start,
+        end,
+        filters,
+        limit,
+        order,
+        other,
+    )
+    with span("format", len(result)):
+        return format_model_columns(result, group_by_column, second_group_by_column, time_group)
+
+
+def stream_model(
+    model_name,
+    group_by_column,
+    second_group_by_column=None,
+    time_group=None,
+    start=None,
+    end=None,
+    filters=None,
+    batch_size=STREAM_BATCH_SIZE,
+):
+    """
+    Streams the rows of query_model without holding the whole result in memory.
+
+    The query runs on a server-side cursor and is fetched batch_size rows at a time, so memory
+    use stays flat however many rows are returned. The arguments are validated before this
+    function returns, so errors are raised to the caller rather than mid-stream.
+
+    Args:
+        The arguments of query_model, plus:
+        batch_size (int): The number of rows fetched from the cursor at a time.
+
+    Returns:
+        generator: Yields one formatted dict per row, and closes the session once exhausted.
+
+    Raises:
+        ValueError: If an incorrect model name or column is given.
+    """
+    session = Session()
+    try:
+        query = build_model_query(
+            session,
+            model_name,
+            group_by_column,
+            second_group_by_column,
+            time_group,
+            start,
+            end,
+            filters,
+        )
+    except Exception:
+        session.close()
+        raise
+
+    def generate():
+        try:
+            rows = iter(query.execution_options(stream_results=True).yield_per(batch_size))
+            # format a batch at a time, so the columns are still transformed together
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                yield from format_model_rows(
+                    batch, group_by_column, second_group_by_column, time_group
+                )
+        finally:
+            session.close()
+
+    return generate()
+
+
+def fetch_rollup_rows(
+    session,
+    model_name,
+    levels,
+    time_group=None,
+    start=None,
+    end=None,
+    filters=None,
+):
+    """
+    Aggregates every subtotal level of the given grouping columns in one scan.
+
+    On PostgreSQL and MySQL this is a single GROUP BY ROLLUP query; elsewhere the finest level is
+    queried and the subtotals are summed up from it, see grouping.py.
+
+    Args:
+        session (Session): The session to run the query in.
+        model_name (str): The name of the model to query.
+        levels (list): The columns to group by, from the coarsest level to the finest.
+        The remaining arguments are those of query_model.
+
+    Returns:
+        list: Rows of (*level values, data[, time_group], grouping).
 
     Raises:
         ValueError: If an incorrect model name or column is given.
     """
-    print("stepped into query model.")
     model = get_model(model_name)
     if model is None:
         raise ValueError(f"Invalid model name: {model_name}")
+    model = select_source_model(model, [*levels, *(filters or {})], time_group, start, end)
+
+    level_attrs = []
+    for level in levels:
+        level_attr = getattr(model, level, None)
+        if level_attr is None:
+            raise ValueError(f"fetch_rollup_rows recieved an invalid level: {level}")
+        level_attrs.append(level_attr)
+
+    columns = [*level_attrs, func.sum(model.primary_count).label("data")]
+    group_by_columns = []
+    if time_group:
+        time_bucket = get_time_group_column(model, time_group)
+        columns.append(time_bucket)
+        group_by_columns.append(time_bucket)
+
+    native = supports_rollup(session.get_bind().dialect.name)
+    if native:
+        columns.append(func.grouping(*level_attrs).label("rollup_grouping"))
+        group_by_columns.append(Rollup(*level_attrs))
+    else:
+        group_by_columns.extend(level_attrs)
+
+    query = apply_time_range(session.query(*columns), model, start, end)
+    query = apply_filters(query, model, filters)
+    shape = query_shape("rollup", levels, time_group)
+    rows = query.group_by(*group_by_columns).execution_options(query_shape=shape).all()
+
+    if not native:
+        return rollup_rows(rows, len(levels), bool(time_group))
+    if time_group:
+        # MySQL also rolls up the time bucket itself, into rows without one
+        rows = [row for row in rows if row[len(levels) + 1] is not None]
+    return rows
+
+
+def cube_rollup_rows(model_name, levels, time_group=None, start=None, end=None, filters=None):
+    """Returns the rows of fetch_rollup_rows from the in-memory cube, or None if it cannot answer them."""
+    cube_rows = query_cube(model_name, levels, time_group, start, end, filters)
+    if cube_rows is None:
+        return None
+    level_count = len(levels)
+    rows = [(*row[:level_count], row[-1], *row[level_count:-1]) for row in cube_rows]
+    return rollup_rows(rows, level_count, bool(time_group))
+
+
+def history_rollup_rows(boundary, model_name, levels, time_group=None, start=None, end=None, filters=None):
+    """Returns the rows of fetch_rollup_rows, with the hours before boundary read from the Parquet files."""
+    history, recent = split_range(boundary, start, end)
+    with span("parquet"):
+        rows = get_parquet_store().rollup_rows(levels, time_group, *history, filters)
+    if recent is None:
+        return rows
 
     session = Session()
     try:
-        # Ensure the group_by column is valid
-        group_by_attr = getattr(model, group_by_column, None)
-        if not group_by_attr:
-            raise ValueError(f"Query_model recieved an invalid group_by column: {group_by_column}")
-
-        # Handle optional second grouping column
-        second_group_by_attr = (
-            getattr(model, second_group_by_column, None)
-            if second_group_by_column
-            else None
-        )
+        recent_rows = fetch_rollup_rows(session, model_name, levels, time_group, *recent, filters)
+    finally:
+        session.close()
+    return merge_rows([rows, recent_rows], len(levels))
 
-        # Base columns and group by settings
-        columns = [group_by_attr, func.sum(model.primary_count).label("data")]
-        group_by_columns = [group_by_attr]
 
-        # Add second group by column if present
-        if second_group_by_attr:
-            columns.append(second_group_by_attr)
-            group_by_columns.append(second_group_by_attr)
+def format_rollup_rows(rows, levels, time_group=None):
+    """
+    Formats rows of fetch_rollup_rows into the dicts returned by the API, a column at a time.
 
-        # Handle time aggregation by extraction specified time group
+    Returns:
+        list: Dicts with a key for each level, 'data', 'time_group' when grouping by time, and
+            'level', the number of levels the row is grouped by.
+    """
+    level_count = len(levels)
+    names = [*levels, "data"] + (["time_group"] if time_group else [])
+    with span("format", len(rows)):
+        if not rows:
+            return []
+        columns = list(map(list, zip(*rows)))
+
+        # capitalize country names
+        if "country" in levels:
+            index = levels.index("country")
+            columns[index] = title_countries(columns[index])
+
+        # fill in the date
         if time_group:
-            time_extracts = get_time_group_column(model, time_group)
-            columns.extend(time_extracts)
-            group_by_columns.extend(time_extracts)
-
-        # Construct and execute query
-        query = session.query(*columns).group_by(*group_by_columns)
-
-        result = query.all()
-
-        # Format results
-        final_result = []
-        for row in result:
-            data = {group_by_column: row[0], "data": row[1]}
-            index = 2
-
-            # capitalize country names
-            if group_by_column == "country":
-                data[group_by_column] = data[group_by_column].title()
-
-            # increase index if a second_group_by_column is present
-            if second_group_by_column:
-                data[second_group_by_column] = row[index]
-                index += 1
-
-            # fill in the rest of the date
-            if time_group:
-                time_values = row[index:]
-                if time_group == "year":
-                    data["time_group"] = f"{time_values[0]}-01-01"
-                elif time_group == "month":
-                    data["time_group"] = f"{time_values[0]}-{time_values[1]:02d}-01"
-                elif time_group == "day":
-                    data["time_group"] = (
-                        f"{time_values[0]}-{time_values[1]:02d}-{time_values[2]:02d}"
-                    )
-
-            final_result.append(data)
-
-        return final_result
+            columns[level_count + 1] = format_time_groups(columns[level_count + 1], time_group)
 
-    except Exception as e:
-        raise
-    finally:
-        session.close()
+        # how many of the levels each row is grouped by, 0 being the grand total
+        level_of = {grouping: rollup_level(grouping, level_count) for grouping in set(columns[-1])}
+        columns[-1] = list(map(level_of.__getitem__, columns[-1]))
+
+        names.append("level")
+        return [dict(zip(names, values)) for values in zip(*columns)]
 
 
-def query_global_sum(model_name, time_group):
+def query_rollup(model_name, levels, time_group=None, start=None, end=None, filters=None):
     """
-    Queries the total sum of data aggregated by time group.
+    Queries the totals of every level of a hierarchy of columns, e.g. each category, each archive and overall.
 
     Args:
         model_name (str): The name of the model to query.
-        time_group (str): The time group to aggregate by ('year', 'month', 'day').
+        levels (list): The columns to group by, from the coarsest level to the finest.
+        time_group (str): Either 'month', 'year', or 'day' to aggregate data by that period.
+        start (datetime): Only include data from this hour onward.
+        end (datetime): Only include data before this hour.
+        filters (dict): Maps a column name to the values to keep, see apply_filters.
 
     Returns:
-        final_result (list): A list of dicts, with keys 'total_sum' and 'time_group' representing the aggregated data.
+        final_result (list): A list of dicts, with a key for each level, 'data', 'time_group' when
+            grouping by time, and 'level', the number of levels the row is grouped by. Rolled up
+            levels are None.
+
+    Raises:
+        ValueError: If an incorrect model name or column is given.
+    """
+    rows = cube_rollup_rows(model_name, levels, time_group, start, end, filters)
+    boundary = history_split(model_name, levels, start, end, filters) if rows is None else None
+    if boundary is not None:
+        rows = history_rollup_rows(boundary, model_name, levels, time_group, start, end, filters)
+    if rows is None:
+        session = Session()
+        try:
+            rows = fetch_rollup_rows(session, model_name, levels, time_group, start, end, filters)
+        finally:
+            session.close()
+    return format_rollup_rows(rows, levels, time_group)
+
+
+def build_global_sum_query(session, model_name, time_group, start=None, end=None, filters=None):
+    """
+    Builds the aggregation query behind query_global_sum without executing it.
+
+    Args:
+        session (Session): The session the query will run in.
+        The remaining arguments are those of query_global_sum.
+
+    Returns:
+        Query: The grouped query, whose rows are (time_group, total_sum) in time order.
 
     Raises:
         ValueError: If an incorrect model name or time value is given.
@@ -193,49 +944,92 @@ def query_global_sum(model_name, time_group):
     model = get_model(model_name)
     if model is None:
         raise ValueError(f"Invalid model name: {model_name}")
+    model = select_source_model(model, list(filters or {}), time_group, start, end)
+
+    time_bucket = get_time_group_column(model, time_group)
+    columns = [time_bucket, func.sum(model.primary_count).label("total_sum")]
+
+    query = apply_time_range(session.query(*columns), model, start, end)
+    query = apply_filters(query, model, filters)
+    shape = query_shape("global_sum", time_group=time_group)
+    return query.group_by(time_bucket).order_by(time_bucket).execution_options(query_shape=shape)
+
+
+def history_global_sums(boundary, model_name, time_group, start=None, end=None, filters=None):
+    """Returns the rows of build_global_sum_query, with the hours before boundary read from the Parquet files."""
+    history, recent = split_range(boundary, start, end)
+    with span("parquet"):
+        rows = get_parquet_store().global_sums(time_group, *history, filters)
+    if recent is None:
+        return rows
 
     session = Session()
     try:
-        # Initialize the database query results
-        columns = [func.sum(model.primary_count).label("total_sum")]
-        group_by_columns = get_time_group_column(model, time_group)
-        columns.extend(group_by_columns)
-
-        # Create the query to fetch database data
-        query = session.query(*columns).group_by(*group_by_columns)
-
-        # Execute the query and fetch results
-        result = query.all()
-        final_result = []
-
-        # Process database results
-        for row in result:
-            data = {"total_sum": row[0]}
-            time_values = row[1:]
-            if time_group:
-                if time_group == "year":
-                    time_group_value = str(time_values[0])
-                elif time_group == "month":
-                    time_group_value = f"{time_values[0]}-{int(time_values[1]):02d}-01"
-                elif time_group == "day":
-                    time_group_value = f"{time_values[0]}-{int(time_values[1]):02d}-{int(time_values[2]):02d}"
- 
-
-            data["time_group"] = time_group_value
-            final_result.append(data)
-
-        # inject old data if required
-        # delete me if our old data is ever imported to the new DB.
+        recent_rows = build_global_sum_query(session, model_name, time_group, *recent, filters).all()
+    finally:
+        session.close()
+    # a bucket spanning the boundary, such as the current year, is summed from both
+    return sorted(merge_rows([rows, recent_rows], 1))
+
+
+def format_global_sums(rows, time_group, start=None, end=None, filters=None):
+    """
+    Formats the rows of build_global_sum_query into the list returned by the API.
+
+    Args:
+        rows (list): Rows of (bucket start, total) in time order.
+        The remaining arguments are those of query_global_sum.
+
+    Returns:
+        list: A list of dicts, with keys 'total_sum' and 'time_group'.
+    """
+    with span("format", len(rows)):
+        buckets = format_time_groups([row[0] for row in rows], time_group)
+        final_result = [
+            {"total_sum": row[1], "time_group": bucket} for row, bucket in zip(rows, buckets)
+        ]
+
+    # inject old data if required, merging on the sorted time groups
+    # delete me if our old data is ever imported to the new DB.
+    if start is None and end is None and not filters:
         if time_group == "month":
             final_result = inject_old_data(final_result, "monthly")
         elif time_group == "year":
             final_result = inject_old_data(final_result, "yearly")
-        return final_result
+    return final_result
 
-    except Exception as e:
-        raise
-    finally:
-        session.close()
+
+def query_global_sum(model_name, time_group, start=None, end=None, filters=None):
+    """
+    Queries the total sum of data aggregated by time group.
+
+    Args:
+        model_name (str): The name of the model to query.
+        time_group (str): The time group to aggregate by ('year', 'month', 'day', 'hour').
+        start (datetime): Only include data from this hour onward.
+        end (datetime): Only include data before this hour.
+        filters (dict): Maps a column name to the values to keep, see apply_filters.
+
+    Returns:
+        final_result (list): A list of dicts, with keys 'total_sum' and 'time_group' representing the aggregated data.
+
+    Raises:
+        ValueError: If an incorrect model name or time value is given.
+    """
+    # recent ranges can be summed from the in-memory cube
+    rows = query_cube(model_name, [], time_group, start, end, filters)
+    boundary = history_split(model_name, [], start, end, filters) if rows is None else None
+    if boundary is not None:
+        rows = history_global_sums(boundary, model_name, time_group, start, end, filters)
+    if rows is None:
+        session = Session()
+        try:
+            rows = build_global_sum_query(
+                session, model_name, time_group, start, end, filters
+            ).all()
+        finally:
+            session.close()
+    return format_global_sums(rows, time_group, start, end, filters)
 
 
 """ def query_todays_downloads():
@@ -275,6 +1069,70 @@ def query_global_sum(model_name, time_group):
     finally:
         session.close() """
 
+def build_todays_downloads_query(session, timezone="UTC", local_date=None):
+    """
+    Builds the query behind query_todays_downloads: the total of each UTC hour of a local day.
+
+    The local day is converted to a UTC [start, end) range once, and start_dttm is compared against it
+    directly, so the (start_dttm, primary_count) index answers the query with a range scan. Converting
+    every row into the timezone, as this query used to, forced a scan of the whole table. The hours
+    are shifted into the timezone afterwards, by sum_by_local_hour.
+
+    Args:
+        session (Session): The session the query will run in.
+        timezone (str): The IANA timezone string.
+        local_date (date): The local day to query. Defaults to today in the timezone.
+
+    Returns:
+        Query: Rows of (UTC hour start, total).
+    """
+    if local_date is None:
+        local_date = datetime.now(ZoneInfo(timezone)).date()
+    start, end = local_day_range(timezone, local_date)
+
+    model = HourlyDownloadData
+    query = session.query(model.start_dttm, func.sum(model.primary_count))
+    query = apply_time_range(query, model, start, end).group_by(model.start_dttm)
+    return query.execution_options(query_shape="todays_downloads")
+
+
+def load_hourly_totals():
+    """
+    Re-reads the in-memory totals of the last two days of UTC hours, see live_totals.py.
+
+    If they cannot be read, the previous totals are kept, or query_todays_downloads falls back to SQL.
+    """
+    session = Session()
+    session.use_primary()
+    try:
+        return refresh_hourly_totals(session)
+    except SQLAlchemyError as e:
+        logger.warning("Could not load the hourly totals: %s", e)
+        return None
+    finally:
+        session.close()
+
+
+def live_todays_downloads(timezone="UTC"):
+    """
+    Answers query_todays_downloads from the in-memory hourly totals.
+
+    Returns:
+        list: As query_todays_downloads, or None if the totals are not loaded or do not hold today.
+    """
+    totals = get_hourly_totals()
+    if totals is None:
+        return None
+    local_date = datetime.now(ZoneInfo(timezone)).date()
+    rows = totals.by_local_hour(timezone, local_date)
+    return None if rows is None else format_todays_downloads(rows)
+
+
+def format_todays_downloads(rows):
+    """Formats (local hour, total) pairs, as from sum_by_local_hour, into the list returned by the API."""
+    return [{"hour": int(row[0]), "total_primary": row[1]} for row in rows]
+
+
 def query_todays_downloads(timezone='UTC'):
     """
     Queries for today's download statistics aggregated by hour in the specified timezone.
@@ -285,29 +1143,32 @@ def query_todays_downloads(timezone='UTC'):
     Returns:
         formatted_result (list): A list of dicts, with keys 'hour' and 'total_primary'.
     """
+    # normally answered from the in-memory totals, refreshed on every ingest
+    formatted_result = live_todays_downloads(timezone)
+    if formatted_result is not None:
+        return formatted_result
+
     session = Session()
     try:
-        query = text(f"""
-            SELECT 
-                EXTRACT(HOUR FROM start_dttm AT TIME ZONE 'UTC' AT TIME ZONE :tz) AS local_hour,
-                SUM(primary_count) AS total_primary_count
-            FROM 
-                hourly_download_data
-            WHERE 
-                start_dttm AT TIME ZONE 'UTC' AT TIME ZONE :tz >= date_trunc('day', now() AT TIME ZONE :tz)
-                AND start_dttm AT TIME ZONE 'UTC' AT TIME ZONE :tz < date_trunc('day', now() AT TIME ZONE :tz) + interval '1 day'
-            GROUP BY 
-                local_hour
-            ORDER BY 
-                local_hour;
-        """)
+        result = build_todays_downloads_query(session, timezone).all()
+        return format_todays_downloads(sum_by_local_hour(result, timezone))
+    finally:
+        session.close()
 
-        result = session.execute(query, {"tz": timezone}).fetchall()
-        formatted_result = [{"hour": int(row[0]), "total_primary": row[1]} for row in result]
-        return formatted_result
 
-    except Exception as e:
-        raise
+def query_latest_ingest():
+    """
+    Queries for the start of the newest hour present in the hourly data.
+
+    Returns:
+        datetime: The newest start_dttm, or None if the table is empty.
+    """
+    model = get_model("hourly")
+    session = Session()
+    # from the primary, as the ETags, the result cache and the in-memory cube are all keyed on it
+    session.use_primary()
+    try:
+        query = session.query(func.max(model.start_dttm))
+        return query.execution_options(query_shape="latest_ingest").scalar()
     finally:
         session.close()
-
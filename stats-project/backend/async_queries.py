@@ -0,0 +1,170 @@
+"""
+async_queries.py
+
+This module provides async variants of the api_utils queries, for the async API route handlers.
+
+When ASYNC_DATABASE_URI is set, queries run on SQLAlchemy's asyncio engine. The engine lives on one
+event loop per process, kept on a background thread, so its connection pool is shared by every request
+and a query waiting on the database holds no thread: any number of slow aggregations can be in flight
+at once. Flask runs each async view on an event loop of its own, so the views hand their queries to
+that loop and await the result.
+
+Without ASYNC_DATABASE_URI, each query runs on the regular engine in a worker thread, so the async
+routes, and independent queries awaited together with asyncio.gather, work in every deployment.
+
+Either way, the queries are built by the same functions as the synchronous ones in api_utils, and
+aggregations the in-memory cube can answer never reach the database.
+
+Functions:
+    get_async_engine():
+        Returns the asyncio engine, or None if ASYNC_DATABASE_URI is not set.
+
+    query_model_async(model_name, group_by_column, ...):
+        Async variant of api_utils.query_model.
+
+    query_rollup_async(model_name, levels, ...):
+        Async variant of api_utils.query_rollup.
+
+    query_global_sum_async(model_name, time_group, ...):
+        Async variant of api_utils.query_global_sum.
+
+    query_todays_downloads_async(timezone='UTC'):
+        Async variant of api_utils.query_todays_downloads.
+
+Modules:
+    asyncio: Runs the database event loop and bridges it to the request's event loop.
+    sqlalchemy: SQL toolkit and Object-Relational Mapping (ORM) library.
+    api_utils: Builds and formats the queries.
+
+Environment Variables:
+    ASYNC_DATABASE_URI: The database URL with an asyncio driver, e.g. postgresql+asyncpg://... or
+        mysql+aiomysql://... Optional. The asyncio engine is only used when it is set.
+"""
+
+import asyncio
+import os
+import threading
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+import api_utils
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URI")
+
+_engine = None
+_loop = None
+_loop_pid = None
+_lock = threading.Lock()
+
+
+def _database_loop():
+    """Returns this process's database event loop, starting it on a background thread if needed."""
+    global _engine, _loop, _loop_pid
+    with _lock:
+        # a forked worker gets its own loop, and its own engine with it
+        if _loop is None or _loop_pid != os.getpid():
+            _engine = None
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            threading.Thread(target=_loop.run_forever, name="database-loop", daemon=True).start()
+        return _loop
+
+
+def get_async_engine():
+    """Returns the asyncio engine, or None if ASYNC_DATABASE_URI is not set."""
+    global _engine
+    if not ASYNC_DATABASE_URL:
+        return None
+    _database_loop()
+    with _lock:
+        if _engine is None:
+            _engine = create_async_engine(
+                ASYNC_DATABASE_URL, **api_utils.engine_options(ASYNC_DATABASE_URL)
+            )
+        return _engine
+
+
+async def _run_in_session(fn, *args):
+    """
+    Runs fn(session, *args) with a session on the asyncio engine and returns its result.
+
+    fn is ordinary synchronous SQLAlchemy code; AsyncSession.run_sync lets it await the database
+    on the database loop without blocking it.
+    """
+
+    async def run():
+        async with AsyncSession(get_async_engine()) as session:
+            return await session.run_sync(fn, *args)
+
+    future = asyncio.run_coroutine_threadsafe(run(), _database_loop())
+    return await asyncio.wrap_future(future)
+
+
+async def query_model_async(
+    model_name,
+    group_by_column,
+    second_group_by_column=None,
+    time_group=None,
+    start=None,
+    end=None,
+    filters=None,
+    limit=None,
+    order="desc",
+    other=False,
+):
+    """Async variant of api_utils.query_model, taking the same arguments."""
+    args = (model_name, group_by_column, second_group_by_column, time_group, start, end, filters)
+    top = (limit, order, other) if limit else ()
+    # closed months read from Parquet files are aggregated by DuckDB in process, so run them on a thread
+    history = api_utils.history_split(model_name, [group_by_column, second_group_by_column], start, end, filters)
+    if get_async_engine() is None or history:
+        return await asyncio.to_thread(api_utils.query_model, *args, *top)
+
+    rows = api_utils.cube_model_rows(*args)
+    if rows is not None and limit:
+        rows = api_utils.top_n_rows(rows, *top)
+    if rows is None:
+        rows = await _run_in_session(
+            lambda session: api_utils.run_model_query(session, *args, *top)
+        )
+    return api_utils.format_model_rows(rows, group_by_column, second_group_by_column, time_group)
+
+
+async def query_rollup_async(model_name, levels, time_group=None, start=None, end=None, filters=None):
+    """Async variant of api_utils.query_rollup, taking the same arguments."""
+    args = (model_name, levels, time_group, start, end, filters)
+    if get_async_engine() is None or api_utils.history_split(model_name, levels, start, end, filters):
+        return await asyncio.to_thread(api_utils.query_rollup, *args)
+
+    rows = api_utils.cube_rollup_rows(*args)
+    if rows is None:
+        rows = await _run_in_session(
+            lambda session: api_utils.fetch_rollup_rows(session, *args)
+        )
+    return api_utils.format_rollup_rows(rows, levels, time_group)
+
+
+async def query_global_sum_async(model_name, time_group, start=None, end=None, filters=None):
+    """Async variant of api_utils.query_global_sum, taking the same arguments."""
+    args = (model_name, time_group, start, end, filters)
+    if get_async_engine() is None or api_utils.history_split(model_name, [], start, end, filters):
+        return await asyncio.to_thread(api_utils.query_global_sum, *args)
+
+    rows = api_utils.query_cube(model_name, [], time_group, start, end, filters)
+    if rows is None:
+        rows = await _run_in_session(
+            lambda session: api_utils.build_global_sum_query(session, *args).all()
+        )
+    return api_utils.format_global_sums(rows, time_group, start, end, filters)
+
+
+async def query_todays_downloads_async(timezone="UTC"):
+    """Async variant of api_utils.query_todays_downloads, taking the same arguments."""
+    live = api_utils.live_todays_downloads(timezone)
+    if live is not None:
+        return live
+    if get_async_engine() is None:
+        return await asyncio.to_thread(api_utils.query_todays_downloads, timezone)
+
+    rows = await _run_in_session(
+        lambda session: api_utils.build_todays_downloads_query(session, timezone).all()
+    )
+    return api_utils.format_todays_downloads(api_utils.sum_by_local_hour(rows, timezone))
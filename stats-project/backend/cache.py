@@ -0,0 +1,149 @@
+"""
+cache.py
+
+This module provides a small in-process cache for serialized API responses.
+
+The hourly download data only changes once per hourly ingest, so every response built between two
+ingests is identical. Entries therefore expire at the next ingest boundary rather than after a fixed
+interval, and the cache is bounded in size with least-recently-used eviction.
+
+When the cache is warmed in the background (see warming.py), expired entries may be served for
+max_stale more seconds, so requests keep getting the previous hour's responses while the new ones are
+computed, and replace swaps a whole set of fresh entries in at once.
+
+Classes:
+    ResultCache:
+        A thread-safe LRU cache whose entries expire at the next hourly ingest boundary.
+
+Functions:
+    make_key(endpoint, args):
+        Builds a cache key from an endpoint name and its request arguments.
+
+Environment Variables:
+    RESULT_CACHE_SIZE: The maximum number of responses held in the cache. Defaults to 256.
+    INGEST_DELAY_SECONDS: Seconds past the hour by which the hourly ingest has completed. Defaults to 300.
+
+Usage:
+    Use the module level result_cache instance to store prebuilt JSON bodies keyed by make_key.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+SECONDS_PER_HOUR = 3600
+
+
+def make_key(endpoint, args):
+    """
+    Builds a cache key from an endpoint name and its request arguments.
+
+    Arguments with empty values are dropped and the rest are sorted, so equivalent requests
+    share an entry regardless of parameter order.
+
+    Args:
+        endpoint (str): The name of the endpoint being cached.
+        args (Mapping): The request arguments, e.g. request.args.
+
+    Returns:
+        tuple: A hashable key.
+    """
+    return (endpoint,) + tuple(sorted((k, v) for k, v in args.items() if v))
+
+
+class ResultCache:
+    """
+    A thread-safe LRU cache whose entries expire at the next hourly ingest boundary.
+
+    Attributes:
+        max_entries (int): The maximum number of entries held before evicting.
+        ingest_delay (int): Seconds past the hour at which new data becomes visible.
+        max_stale (int): Seconds past its expiry an entry is still served, while it is being refreshed.
+        hits (int): The number of lookups answered from the cache, stale_hits included.
+        stale_hits (int): The number of lookups answered with an expired entry.
+        misses (int): The number of lookups that were absent or expired.
+        evictions (int): The number of entries dropped to respect max_entries.
+    """
+
+    def __init__(self, max_entries=256, ingest_delay=300, clock=time.time, max_stale=0):
+        self.max_entries = max_entries
+        self.ingest_delay = ingest_delay
+        self.clock = clock
+        self.max_stale = max_stale
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def next_expiry(self):
+        """Returns the timestamp of the next ingest boundary after now."""
+        now = self.clock()
+        current_hour = (now - self.ingest_delay) // SECONDS_PER_HOUR * SECONDS_PER_HOUR
+        return current_hour + SECONDS_PER_HOUR + self.ingest_delay
+
+    def get(self, key):
+        """Returns the value stored under key, or None if it is missing or expired more than max_stale ago."""
+        with self._lock:
+            entry = self._entries.get(key)
+            now = self.clock()
+            if entry is None or entry[1] + self.max_stale <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if entry[1] <= now:
+                self.stale_hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        """Stores value under key until the next ingest boundary."""
+        with self._lock:
+            self._entries[key] = (value, self.next_expiry())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def replace(self, entries):
+        """
+        Atomically replaces every entry with entries, which expire at the next ingest boundary.
+
+        Entries not in entries are dropped, so nothing computed before the swap outlives it.
+        """
+        expiry = self.next_expiry()
+        fresh = OrderedDict((key, (value, expiry)) for key, value in entries.items())
+        with self._lock:
+            while len(fresh) > self.max_entries:
+                fresh.popitem(last=False)
+                self.evictions += 1
+            self._entries = fresh
+
+    def clear(self):
+        """Drops every entry, e.g. after new data has been ingested."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the hit, miss and eviction counters along with the current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+            }
+
+
+result_cache = ResultCache(
+    max_entries=int(os.getenv("RESULT_CACHE_SIZE", "256")),
+    ingest_delay=int(os.getenv("INGEST_DELAY_SECONDS", "300")),
+)
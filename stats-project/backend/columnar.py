@@ -0,0 +1,90 @@
+"""
+columnar.py
+
+This module encodes aggregation results column by column instead of as one object per row.
+
+A row based response repeats every key in every row. The columnar encoding sends one array per field,
+and replaces the values of dimension fields (country, category, time_group, ...) with integer codes
+into a per-field dictionary of the distinct values, which keeps large series compact.
+
+    {
+        "length": 3,
+        "columns": {"country": [0, 1, 0], "data": [5, 7, 2], "time_group": [0, 0, 1]},
+        "dictionaries": {"country": ["Gb", "Us"], "time_group": ["2024-03-01", "2024-04-01"]}
+    }
+
+The same structure can be sent as MessagePack when the optional msgpack package is installed.
+
+Functions:
+    rows_to_columns(rows, names):
+        Transposes a list of dicts into a dict of parallel lists.
+
+    encode_columnar(columns, dictionary_columns):
+        Builds the columnar structure, dictionary-encoding the given columns.
+
+    pack_msgpack(value):
+        Serializes a value with MessagePack.
+
+Modules:
+    msgpack: Optional. MessagePack serializer used by the msgpack response format.
+"""
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+MSGPACK_AVAILABLE = msgpack is not None
+MSGPACK_MIMETYPE = "application/vnd.msgpack"
+
+
+def rows_to_columns(rows, names):
+    """Transposes a list of dicts into a dict mapping each name to the list of its values."""
+    return {name: [row.get(name) for row in rows] for name in names}
+
+
+def dictionary_encode(values):
+    """
+    Replaces each value with its index in a list of the distinct values.
+
+    Returns:
+        tuple: (codes, dictionary), with the dictionary in order of first appearance.
+    """
+    lookup = {}
+    codes = [lookup.setdefault(value, len(lookup)) for value in values]
+    return codes, list(lookup)
+
+
+def encode_columnar(columns, dictionary_columns):
+    """
+    Builds the columnar structure, dictionary-encoding the given columns.
+
+    Args:
+        columns (dict): Maps each field name to the list of its values.
+        dictionary_columns (iterable): The names of the fields to dictionary-encode.
+
+    Returns:
+        dict: With keys 'length', 'columns' and 'dictionaries'.
+    """
+    encoded = {}
+    dictionaries = {}
+    for name, values in columns.items():
+        if name in dictionary_columns:
+            encoded[name], dictionaries[name] = dictionary_encode(values)
+        else:
+            encoded[name] = values
+    length = len(next(iter(columns.values()))) if columns else 0
+    return {"length": length, "columns": encoded, "dictionaries": dictionaries}
+
+
+def pack_msgpack(value):
+    """
+    Serializes a value with MessagePack.
+
+    Raises:
+        ValueError: If the msgpack package is not installed.
+    """
+    if msgpack is None:
+        raise ValueError("The msgpack format is not available on this server")
+    # sums come back as Decimal on some drivers, which msgpack cannot serialize natively
+    return msgpack.packb(value, default=int)
@@ -12,8 +12,12 @@ class TestingConfig(Config):
     TESTING = True
     DEBUG = True
 
+class ProductionConfig(Config):
+    """Production configuration, used when served by gunicorn through wsgi.py."""
+
 config = {
     'development': DevelopmentConfig,
     'testing': TestingConfig,
+    'production': ProductionConfig,
     'default': DevelopmentConfig
 }
\ No newline at end of file
@@ -0,0 +1,254 @@
+"""
+cube.py
+
+This module holds an optional in-memory cube of recent hourly download data.
+
+Every dashboard slice is a sum of primary_count grouped by some of country, category, archive and
+download_type over a time range. The cube keeps the most recent CUBE_DAYS of hourly rows in NumPy
+arrays, with each dimension dictionary-encoded as integer codes, so those slices can be answered with
+vectorized reductions instead of a database round trip. Queries reaching outside the held range fall
+back to SQL.
+
+A cube is never modified once built. Refreshing builds a new cube holding the newly ingested hours and
+swaps it in, so requests never see a partially updated cube. An ingest commits batch by batch and may
+rewrite hours already held, so each refresh also re-reads the last CUBE_REFRESH_HOURS hours it holds.
+
+Classes:
+    DownloadCube:
+        Immutable, dictionary-encoded arrays of hourly counts over a range of hours.
+
+Functions:
+    get_cube():
+        Returns the current cube, or None if the cube is disabled or not loaded.
+
+    refresh_cube(session):
+        Loads the cube, or extends it with every hour ingested since it was built.
+
+Modules:
+    numpy: Optional. The cube is disabled when it is not installed.
+    sqlalchemy: SQL toolkit and Object-Relational Mapping (ORM) library.
+    models: Contains the SQLAlchemy models for the application.
+
+Environment Variables:
+    CUBE_DAYS: How many days of recent data to hold in memory. Defaults to 0, which disables the cube.
+    CUBE_REFRESH_HOURS: How many of the newest hours held are re-read on each refresh. Defaults to 3.
+"""
+
+import os
+import threading
+from datetime import timedelta
+from sqlalchemy import func
+from models import HourlyDownloadData
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+CUBE_DAYS = int(os.getenv("CUBE_DAYS", "0"))
+CUBE_REFRESH_HOURS = int(os.getenv("CUBE_REFRESH_HOURS", "3"))
+
+DIMENSIONS = ("country", "category", "archive", "download_type")
+
+# NumPy datetime units matching each time group
+TIME_UNITS = {"hour": "h", "day": "D", "month": "M", "year": "Y"}
+
+
+class DownloadCube:
+    """
+    Immutable, dictionary-encoded arrays of hourly counts over the hours [start, end).
+
+    Attributes:
+        start (datetime): The first hour held.
+        end (datetime): The hour after the last hour held.
+        dictionaries (dict): Maps each dimension to the list of its values, indexed by code.
+        codes (dict): Maps each dimension to an int32 array of codes, one per row.
+        hours (ndarray): The datetime64[h] start of each row.
+        counts (ndarray): The int64 primary_count of each row.
+    """
+
+    def __init__(self, start, end, dictionaries, codes, hours, counts):
+        self.start = start
+        self.end = end
+        self.dictionaries = dictionaries
+        self.codes = codes
+        self.hours = hours
+        self.counts = counts
+        self._lookups = {
+            dimension: {value: code for code, value in enumerate(values)}
+            for dimension, values in dictionaries.items()
+        }
+
+    @classmethod
+    def empty(cls, start):
+        """Returns a cube holding no hours, starting at start."""
+        return cls(
+            start,
+            start,
+            {dimension: [] for dimension in DIMENSIONS},
+            {dimension: np.empty(0, dtype=np.int32) for dimension in DIMENSIONS},
+            np.empty(0, dtype="datetime64[h]"),
+            np.empty(0, dtype=np.int64),
+        )
+
+    def __len__(self):
+        return len(self.counts)
+
+    def extended(self, rows, end, keep_from=None, replace_from=None):
+        """
+        Returns a new cube holding this cube's rows plus rows, up to the hour end.
+
+        Args:
+            rows (list): Tuples of (country, category, archive, download_type, start_dttm, primary_count).
+            end (datetime): The hour after the last hour now held.
+            keep_from (datetime): Drop rows before this hour, to bound the cube's size.
+            replace_from (datetime): Drop this cube's rows from this hour on, as rows holds them again.
+        """
+        dictionaries = {dimension: list(values) for dimension, values in self.dictionaries.items()}
+        lookups = {dimension: dict(lookup) for dimension, lookup in self._lookups.items()}
+        held = slice(None)
+        if replace_from is not None:
+            held = self.hours < np.datetime64(replace_from, "h")
+
+        columns = list(zip(*rows)) if rows else [()] * (len(DIMENSIONS) + 2)
+        codes = {}
+        for index, dimension in enumerate(DIMENSIONS):
+            lookup = lookups[dimension]
+            values = dictionaries[dimension]
+            new_codes = []
+            for value in columns[index]:
+                code = lookup.get(value)
+                if code is None:
+                    code = lookup[value] = len(values)
+                    values.append(value)
+                new_codes.append(code)
+            codes[dimension] = np.concatenate(
+                [self.codes[dimension][held], np.asarray(new_codes, dtype=np.int32)]
+            )
+        hours = np.concatenate([self.hours[held], np.asarray(columns[4], dtype="datetime64[h]")])
+        counts = np.concatenate([self.counts[held], np.asarray(columns[5], dtype=np.int64)])
+
+        start = self.start
+        if keep_from is not None and keep_from > start:
+            keep = hours >= np.datetime64(keep_from, "h")
+            codes = {dimension: array[keep] for dimension, array in codes.items()}
+            hours, counts, start = hours[keep], counts[keep], keep_from
+        return DownloadCube(start, end, dictionaries, codes, hours, counts)
+
+    def covers(self, start, end=None):
+        """Whether every hour in [start, end) is held. An open end means up to the newest hour."""
+        return start is not None and start >= self.start and (end is None or end <= self.end)
+
+    def _mask(self, start, end, filters):
+        """Selects the rows within [start, end) matching the dimension filters."""
+        mask = self.hours >= np.datetime64(start, "h")
+        if end is not None:
+            mask &= self.hours < np.datetime64(end, "h")
+        for dimension, values in (filters or {}).items():
+            exact = {value for value in values if not value.endswith("*")}
+            prefixes = tuple(value[:-1] for value in values if value.endswith("*"))
+            allowed = [
+                code
+                for value, code in self._lookups[dimension].items()
+                if value in exact or (prefixes and value.startswith(prefixes))
+            ]
+            mask &= np.isin(self.codes[dimension], allowed)
+        return mask
+
+    def aggregate(self, columns, time_group=None, start=None, end=None, filters=None):
+        """
+        Sums primary_count grouped by the given dimensions and time group.
+
+        Args:
+            columns (list): The dimensions to group by.
+            time_group (str): 'hour', 'day', 'month' or 'year', or None.
+            start (datetime): The first hour to include. Must be covered by the cube.
+            end (datetime): The hour after the last hour to include, or None.
+            filters (dict): Maps a dimension to the values to keep, as for api_utils.apply_filters.
+
+        Returns:
+            list: One tuple per group of (*column values, [bucket start,] total).
+        """
+        mask = self._mask(start, end, filters)
+        keys = [self.codes[column][mask] for column in columns]
+        sizes = [len(self.dictionaries[column]) for column in columns]
+
+        if time_group:
+            buckets = self.hours[mask].astype(f"datetime64[{TIME_UNITS[time_group]}]")
+            bucket_numbers = buckets.astype(np.int64)
+            first_bucket = int(bucket_numbers.min()) if len(bucket_numbers) else 0
+            keys.append(bucket_numbers - first_bucket)
+            sizes.append(int(keys[-1].max()) + 1 if len(bucket_numbers) else 1)
+
+        counts = self.counts[mask]
+        if not keys:
+            return [(int(counts.sum()),)] if len(counts) else []
+        if not len(counts):
+            return []
+
+        # one integer per group, so a single unique/bincount pass does the whole group by
+        combined = np.ravel_multi_index(keys, sizes)
+        groups, inverse = np.unique(combined, return_inverse=True)
+        totals = np.bincount(inverse, weights=counts).astype(np.int64).tolist()
+        group_codes = np.unravel_index(groups, sizes)
+
+        result_columns = [
+            [self.dictionaries[column][code] for code in group_codes[index].tolist()]
+            for index, column in enumerate(columns)
+        ]
+        if time_group:
+            bucket_starts = (group_codes[-1] + first_bucket).astype(
+                f"datetime64[{TIME_UNITS[time_group]}]"
+            )
+            result_columns.append(bucket_starts.astype("datetime64[s]").astype(object).tolist())
+        return list(zip(*result_columns, totals))
+
+
+_cube = None
+_refresh_lock = threading.Lock()
+
+
+def get_cube():
+    """Returns the current cube, or None if the cube is disabled or not loaded."""
+    return _cube
+
+
+def refresh_cube(session):
+    """
+    Loads the cube, or extends it with every hour ingested since it was built.
+
+    Only the rows of the last CUBE_REFRESH_HOURS hours held and of the hours after them are read, as
+    an ingest may have rewritten those hours since, and rows older than CUBE_DAYS are dropped.
+
+    Args:
+        session (Session): The session to read new rows with.
+
+    Returns:
+        DownloadCube: The new current cube, or None if the cube is disabled.
+    """
+    global _cube
+    if np is None or CUBE_DAYS <= 0:
+        return None
+
+    with _refresh_lock:
+        newest = session.query(func.max(HourlyDownloadData.start_dttm)).scalar()
+        if newest is None:
+            return _cube
+        end = newest + timedelta(hours=1)
+        keep_from = end - timedelta(days=CUBE_DAYS)
+        cube = _cube if _cube is not None else DownloadCube.empty(keep_from)
+        reread_from = max(min(cube.end, end) - timedelta(hours=CUBE_REFRESH_HOURS), keep_from)
+
+        model = HourlyDownloadData
+        rows = (
+            session.query(
+                *(getattr(model, dimension) for dimension in DIMENSIONS),
+                model.start_dttm,
+                model.primary_count,
+            )
+            .filter(model.start_dttm >= reread_from, model.start_dttm < end)
+            .execution_options(query_shape="cube_refresh")
+            .all()
+        )
+        _cube = cube.extended(rows, end, keep_from, replace_from=reread_from)
+        return _cube
@@ -5,11 +5,15 @@ from flask import Flask
 from flask_cors import CORS
 from config import config
 from api import api
+import metrics
+import warming
+from api_utils import load_cube, load_hourly_totals
 from routes.graph_routes import graph_routes
 
 
 def create_app(app_config="development"):
     app = Flask(__name__)
+    app.config.from_object(config[app_config])
 
     # Apply CORS
     CORS(app)
@@ -18,6 +22,16 @@ def create_app(app_config="development"):
     app.register_blueprint(graph_routes)  # Frontend routes
     app.register_blueprint(api, url_prefix="/api")  # Backend API
 
+    # Server-Timing headers and the /metrics endpoint
+    metrics.init_app(app)
+
+    # Load recent data into the in-memory cube, if CUBE_DAYS is set, and today's hourly totals
+    load_cube()
+    load_hourly_totals()
+
+    # Recompute the dashboard queries in the background after each ingest, if WARM_CACHE is set
+    warming.init_app(app)
+
     return app
 
 
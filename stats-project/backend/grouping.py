@@ -0,0 +1,93 @@
+"""
+grouping.py
+
+This module provides hierarchical (ROLLUP) aggregation, returning every subtotal level of a list of
+grouping columns from one scan.
+
+For the levels ['archive', 'category'], a rollup returns the total of each (archive, category), the
+subtotal of each archive, and the grand total. On PostgreSQL and MySQL this is a single
+GROUP BY ROLLUP(...) / GROUP BY ... WITH ROLLUP query, with GROUPING() telling the subtotal rows apart
+from rows whose value is genuinely NULL. Other databases, and the in-memory cube, return the finest
+level only and the subtotals are summed up from it in Python, which still needs one scan.
+
+Each row carries the bitmask GROUPING(levels...) would give it: the bit of every rolled up column is
+set, with the first level as the most significant bit. rollup_level turns it into the number of
+levels the row is grouped by, 0 being the grand total.
+
+Classes:
+    Rollup:
+        SQL GROUP BY element rolling up the given columns.
+
+Functions:
+    supports_rollup(dialect_name):
+        Whether the database can compute the rollup itself.
+
+    rollup_rows(rows, level_count, has_time_group=False):
+        Adds the subtotal rows to the rows of the finest level.
+
+    rollup_level(grouping, level_count):
+        Returns the number of levels a row with the given GROUPING() bitmask is grouped by.
+
+Modules:
+    sqlalchemy: SQL toolkit and Object-Relational Mapping (ORM) library.
+"""
+
+from collections import defaultdict
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+ROLLUP_DIALECTS = ("postgresql", "mysql")
+
+
+class Rollup(FunctionElement):
+    """SQL GROUP BY element rolling up the given columns, most significant first."""
+
+    name = "rollup"
+    inherit_cache = True
+
+
+@compiles(Rollup)
+def _compile_rollup(element, compiler, **kw):
+    return "ROLLUP(%s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(Rollup, "mysql")
+def _compile_rollup_mysql(element, compiler, **kw):
+    # MySQL rolls up the whole GROUP BY list, so the Rollup must come last in it
+    return "%s WITH ROLLUP" % compiler.process(element.clauses, **kw)
+
+
+def supports_rollup(dialect_name):
+    """Whether the database can compute the rollup itself."""
+    return dialect_name in ROLLUP_DIALECTS
+
+
+def rollup_rows(rows, level_count, has_time_group=False):
+    """
+    Adds the subtotal rows to the rows of the finest level, as GROUP BY ROLLUP would.
+
+    Args:
+        rows (list): Rows of (*level values, data[, time_group]), one per group of every level.
+        level_count (int): The number of level columns.
+        has_time_group (bool): Whether the rows end with a time bucket, which is never rolled up.
+
+    Returns:
+        list: Rows of (*level values, data[, time_group], grouping), with None for rolled up values.
+    """
+    result = [(*row, 0) for row in rows]
+    for level in range(level_count - 1, -1, -1):
+        totals = defaultdict(int)
+        for row in rows:
+            time_bucket = (row[level_count + 1],) if has_time_group else ()
+            totals[(*row[:level], *time_bucket)] += row[level_count]
+
+        grouping = (1 << (level_count - level)) - 1
+        padding = (None,) * (level_count - level)
+        for key, data in totals.items():
+            result.append((*key[:level], *padding, data, *key[level:], grouping))
+    return result
+
+
+def rollup_level(grouping, level_count):
+    """Returns the number of levels a row with the given GROUPING() bitmask is grouped by."""
+    return level_count - int(grouping).bit_length()
@@ -0,0 +1,53 @@
+# backend/gunicorn.conf.py
+#
+# gunicorn settings for serving the API in production, see wsgi.py.
+#
+# The app is loaded once in the master process and each worker is forked from it, so the in-memory
+# cube and the historical data are built once. The master's database connections must not be shared
+# with the workers: each worker drops them after the fork and opens its own through its own pool
+# (sized by DB_POOL_SIZE and DB_MAX_OVERFLOW, see api_utils.py). Keep DB_POOL_SIZE at or above
+# GUNICORN_THREADS so a busy worker does not wait for a connection.
+#
+# Environment Variables:
+#     PORT: The port to listen on. Defaults to 8080.
+#     WEB_CONCURRENCY: The number of worker processes. Defaults to 2 per CPU plus 1.
+#     GUNICORN_THREADS: Request threads per worker. Defaults to 4.
+#     GUNICORN_TIMEOUT: Seconds a request may take before its worker is restarted. Defaults to 60.
+#     GUNICORN_GRACEFUL_TIMEOUT: Seconds workers get to finish requests on shutdown. Defaults to 30.
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+worker_class = "gthread"
+preload_app = True
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+# restart workers now and then, so a slow leak cannot grow without bound
+max_requests = 10000
+max_requests_jitter = 1000
+
+accesslog = "-"
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    """Gives each worker its own database connections instead of the master's."""
+    from api_utils import dispose_engine
+
+    dispose_engine()
+
+
+def worker_exit(server, worker):
+    """Closes the worker's pooled connections once it has finished its requests."""
+    from api_utils import engine, replica_router
+
+    engine.dispose()
+    if replica_router is not None:
+        for replica in replica_router.engines:
+            replica.dispose()
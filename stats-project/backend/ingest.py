@@ -0,0 +1,238 @@
+"""
+ingest.py
+
+This module loads hourly download extracts into hourly_download_data.
+
+Extracts are read as a stream and written in batches, so files of any size can be loaded with flat memory
+use. Every batch is upserted against the primary key of HourlyDownloadData, which makes re-running an
+ingest over the same hours idempotent: rows already present are overwritten rather than duplicated.
+On PostgreSQL each batch is COPY'd into a temporary staging table and merged with INSERT ... ON CONFLICT;
+other databases use multi-row INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE statements. Once every
+batch is written, the rollup tables are refreshed over the hours that were touched, and when PARQUET_DIR
+is set, the months that were touched or have just closed are exported to Parquet (see parquet_store.py).
+
+Functions:
+    read_extract(path, file_format=None):
+        Yields the rows of an hourly extract, one dict at a time.
+
+    ingest(engine, rows, batch_size=DEFAULT_BATCH_SIZE, refresh=True):
+        Upserts rows into hourly_download_data in batches and refreshes derived aggregates.
+
+Modules:
+    csv, io, json: Used to read extracts and build COPY payloads.
+    sqlalchemy: SQL toolkit and Object-Relational Mapping (ORM) library.
+    models: Contains the SQLAlchemy models for the application.
+    rollups: Maintains the rollup tables derived from the hourly data.
+    parquet_store: Exports closed months to Parquet files, when enabled.
+
+Usage:
+    python ingest.py extracts/2024-03-25T14.ndjson [more files ...] [--batch-size 5000]
+
+    Extracts may be newline delimited JSON (.ndjson, .jsonl), CSV with a header row (.csv), or a JSON
+    array such as tests/test_data/test_download_data.json (.json, which is loaded whole). Use '-' to
+    read newline delimited JSON from standard input.
+"""
+
+import csv
+import io
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from sqlalchemy import inspect, text
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import Session
+from models import HourlyDownloadData
+from parquet_store import export_closed_months, get_store
+from rollups import refresh_rollups
+
+DEFAULT_BATCH_SIZE = 5000
+
+TABLE = HourlyDownloadData.__table__
+COLUMNS = [column.name for column in TABLE.columns]
+KEY_COLUMNS = [column.name for column in TABLE.primary_key.columns]
+VALUE_COLUMNS = [name for name in COLUMNS if name not in KEY_COLUMNS]
+
+
+def parse_row(raw):
+    """Converts one raw extract record into a row of hourly_download_data."""
+    start_dttm = raw["start_dttm"]
+    if not isinstance(start_dttm, datetime):
+        start_dttm = datetime.fromisoformat(start_dttm)
+    return {
+        "country": raw["country"],
+        "download_type": raw["download_type"],
+        "archive": raw["archive"],
+        "category": raw["category"],
+        "primary_count": int(raw["primary_count"]),
+        "cross_count": int(raw["cross_count"]),
+        "start_dttm": start_dttm,
+    }
+
+
+def read_extract(path, file_format=None):
+    """
+    Yields the rows of an hourly extract, one dict at a time.
+
+    Args:
+        path (str): The file to read, or '-' for newline delimited JSON on standard input.
+        file_format (str): 'ndjson', 'csv' or 'json'. Guessed from the extension if omitted.
+    """
+    if file_format is None:
+        extension = path.rsplit(".", 1)[-1].lower()
+        file_format = {"csv": "csv", "json": "json"}.get(extension, "ndjson")
+
+    handle = sys.stdin if path == "-" else open(path, "r", encoding="utf-8", newline="")
+    try:
+        if file_format == "csv":
+            records = csv.DictReader(handle)
+        elif file_format == "json":
+            records = json.load(handle)
+        else:
+            records = (json.loads(line) for line in handle if line.strip())
+        for record in records:
+            yield parse_row(record)
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+
+def _dedupe(batch):
+    """Keeps the last row for each primary key, as one upsert cannot touch a row twice."""
+    rows = {tuple(row[name] for name in KEY_COLUMNS): row for row in batch}
+    return list(rows.values())
+
+
+def _copy_upsert_postgres(connection, batch):
+    """COPYs a batch into a staging table and merges it with INSERT ... ON CONFLICT."""
+    connection.execute(
+        text(
+            "CREATE TEMP TABLE hourly_download_staging "
+            "(LIKE hourly_download_data INCLUDING DEFAULTS) ON COMMIT DROP"
+        )
+    )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        writer.writerow([row[name] for name in COLUMNS])
+    buffer.seek(0)
+
+    copy_sql = f"COPY hourly_download_staging ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+    cursor = connection.connection.cursor()
+    if hasattr(cursor, "copy_expert"):  # psycopg2
+        cursor.copy_expert(copy_sql, buffer)
+    else:  # pg8000
+        cursor.execute(copy_sql, stream=buffer)
+
+    updates = ", ".join(f"{name} = EXCLUDED.{name}" for name in VALUE_COLUMNS)
+    connection.execute(
+        text(
+            f"INSERT INTO hourly_download_data ({', '.join(COLUMNS)}) "
+            f"SELECT {', '.join(COLUMNS)} FROM hourly_download_staging "
+            f"ON CONFLICT ({', '.join(KEY_COLUMNS)}) DO UPDATE SET {updates}"
+        )
+    )
+
+
+def _upsert_statement(dialect_name):
+    """Builds the multi-row upsert statement for databases without a COPY path."""
+    if dialect_name == "mysql":
+        statement = mysql.insert(TABLE)
+        return statement.on_duplicate_key_update(
+            {name: statement.inserted[name] for name in VALUE_COLUMNS}
+        )
+    if dialect_name == "sqlite":
+        statement = sqlite.insert(TABLE)
+    elif dialect_name == "postgresql":
+        statement = postgresql.insert(TABLE)
+    else:
+        raise ValueError(f"Ingest does not support the {dialect_name} dialect")
+    return statement.on_conflict_do_update(
+        index_elements=KEY_COLUMNS,
+        set_={name: statement.excluded[name] for name in VALUE_COLUMNS},
+    )
+
+
+def _write_batch(engine, batch):
+    """Upserts one batch in its own transaction."""
+    with engine.begin() as connection:
+        if engine.dialect.name == "postgresql" and engine.dialect.driver in ("psycopg2", "pg8000"):
+            _copy_upsert_postgres(connection, batch)
+        else:
+            connection.execute(_upsert_statement(engine.dialect.name), batch)
+
+
+def ingest(engine, rows, batch_size=DEFAULT_BATCH_SIZE, refresh=True, log=print):
+    """
+    Upserts rows into hourly_download_data in batches and refreshes derived aggregates.
+
+    Args:
+        engine (Engine): The engine of the database to load into.
+        rows (iterable): Rows as produced by read_extract. Consumed lazily.
+        batch_size (int): The number of rows written per transaction.
+        refresh (bool): Whether to refresh the rollup tables, if they exist, and the Parquet store,
+            if it is enabled, afterwards.
+        log (callable): Receives a progress line after each batch.
+
+    Returns:
+        dict: The number of rows written, the elapsed seconds, rows per second, and the
+            [start, end) range of hours that were touched.
+    """
+    rows = iter(rows)
+    written = 0
+    start = end = None
+    began = time.perf_counter()
+
+    while True:
+        batch = _dedupe(islice(rows, batch_size))
+        if not batch:
+            break
+        _write_batch(engine, batch)
+
+        written += len(batch)
+        batch_start = min(row["start_dttm"] for row in batch)
+        batch_end = max(row["start_dttm"] for row in batch) + timedelta(hours=1)
+        start = batch_start if start is None else min(start, batch_start)
+        end = batch_end if end is None else max(end, batch_end)
+
+        elapsed = time.perf_counter() - began
+        log(f"{written} rows written, {written / elapsed:.0f} rows/sec")
+
+    if refresh and start is not None and inspect(engine).has_table("daily_download_rollup"):
+        with Session(engine) as session, session.begin():
+            refresh_rollups(session, start, end)
+        log(f"Refreshed rollups over {start} to {end}")
+
+    store = get_store()
+    if refresh and start is not None and store is not None:
+        export_closed_months(engine, store, since=start, log=log)
+
+    elapsed = time.perf_counter() - began
+    return {
+        "rows": written,
+        "seconds": elapsed,
+        "rows_per_second": written / elapsed if elapsed else 0.0,
+        "start": start,
+        "end": end,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    from itertools import chain
+    from api_utils import engine
+
+    parser = argparse.ArgumentParser(description="Load hourly download extracts.")
+    parser.add_argument("paths", nargs="+", help="extract files, or - for stdin")
+    parser.add_argument("--format", choices=("ndjson", "csv", "json"), help="extract format")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--skip-rollups", action="store_true", help="do not refresh rollups")
+    args = parser.parse_args()
+
+    rows = chain.from_iterable(read_extract(path, args.format) for path in args.paths)
+    summary = ingest(engine, rows, args.batch_size, refresh=not args.skip_rollups)
+    print(
+        f"Ingested {summary['rows']} rows in {summary['seconds']:.1f}s "
+        f"({summary['rows_per_second']:.0f} rows/sec), hours {summary['start']} to {summary['end']}"
+    )
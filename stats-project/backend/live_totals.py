@@ -0,0 +1,110 @@
+"""
+live_totals.py
+
+This module keeps the download totals of each UTC hour of the last two days in memory, to answer
+get_todays_downloads without a database query.
+
+"Today" in any timezone starts less than 48 hours before the current hour, so the per-hour totals of
+that window are enough to build today's breakdown by local hour for every IANA timezone: each UTC hour
+is shifted into the requested zone in Python. The totals are re-read whenever a new ingest is seen,
+which is one small index range scan per hour instead of one timezone-converting query per visitor.
+
+Like the cube, a snapshot is never modified once built; refreshing swaps in a new one.
+
+Classes:
+    HourlyTotals:
+        Immutable download totals per UTC hour, from a given hour onward.
+
+Functions:
+    get_hourly_totals():
+        Returns the current snapshot, or None if it has not been loaded.
+
+    refresh_hourly_totals(session, now=None):
+        Re-reads the totals of the last HOURS_HELD hours.
+
+Modules:
+    sqlalchemy: SQL toolkit and Object-Relational Mapping (ORM) library.
+    models: Contains the SQLAlchemy models for the application.
+    time_buckets: Converts between UTC hours and local days.
+"""
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+from sqlalchemy import func
+from models import HourlyDownloadData
+from time_buckets import local_day_range, sum_by_local_hour
+
+HOURS_HELD = 48
+
+
+class HourlyTotals:
+    """
+    Immutable download totals per UTC hour, holding every hour from start onward.
+
+    Attributes:
+        start (datetime): The first UTC hour held.
+        totals (dict): Maps the naive UTC start of each hour with downloads to its total.
+    """
+
+    def __init__(self, start, totals):
+        self.start = start
+        self.totals = totals
+
+    def covers(self, start):
+        """Whether every hour from start onward is held."""
+        return start >= self.start
+
+    def by_local_hour(self, timezone, local_date):
+        """
+        Sums the hours of a local day by their local hour, like query_todays_downloads.
+
+        Returns:
+            list: Tuples of (local hour, total) in hour order, or None if the day is not held.
+        """
+        start, end = local_day_range(timezone, local_date)
+        if not self.covers(start):
+            return None
+
+        hours = [
+            (hour_start, total)
+            for hour_start, total in self.totals.items()
+            if start <= hour_start < end
+        ]
+        return sum_by_local_hour(hours, timezone)
+
+
+_totals = None
+
+
+def get_hourly_totals():
+    """Returns the current snapshot, or None if it has not been loaded."""
+    return _totals
+
+
+def refresh_hourly_totals(session, now=None):
+    """
+    Re-reads the totals of the last HOURS_HELD hours.
+
+    The whole window is re-read, as an ingest may have rewritten any of its hours.
+
+    Args:
+        session (Session): The session to read the totals with.
+        now (datetime): The current naive UTC time. Defaults to now.
+
+    Returns:
+        HourlyTotals: The new snapshot.
+    """
+    global _totals
+    if now is None:
+        now = datetime.now(dt_timezone.utc).replace(tzinfo=None)
+    start = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=HOURS_HELD - 1)
+
+    model = HourlyDownloadData
+    rows = (
+        session.query(model.start_dttm, func.sum(model.primary_count))
+        .filter(model.start_dttm >= start)
+        .group_by(model.start_dttm)
+        .execution_options(query_shape="hourly_totals")
+        .all()
+    )
+    _totals = HourlyTotals(start, {hour_start: int(total) for hour_start, total in rows})
+    return _totals
@@ -0,0 +1,309 @@
+"""
+metrics.py
+
+This module instruments requests and SQL queries, reporting each request's breakdown in a Server-Timing
+header and process-wide latency histograms on a Prometheus-style /metrics endpoint.
+
+Time spent in a request is split into spans:
+    sql: Executing statements, measured by SQLAlchemy cursor events, with the number of statements.
+    cube: Aggregating from the in-memory cube.
+    format: Turning rows into the dicts or columns returned by the API, with the number of rows.
+    serialize: Encoding the response body.
+    total: The whole request, as seen by Flask.
+
+Each request collects its spans in a context variable, so spans recorded in worker threads and on the
+database event loop (see async_queries.py), which inherit the request's context, are counted too.
+
+Every query builder in api_utils tags its statement with a query shape, e.g. "model:country:day",
+through the query_shape execution option; statements without one are counted as "other". Shapes are
+built from validated column names and time groups only, so there are few of them.
+
+The histograms are kept per process: under gunicorn, each scrape of /metrics reports the worker that
+answered it.
+
+Classes:
+    Histogram / Counter:
+        Minimal thread-safe Prometheus metrics with labels.
+
+Functions:
+    query_shape(kind, columns=(), time_group=None):
+        Returns the shape name of a query, for the query_shape execution option.
+
+    span(name, count=None):
+        Context manager adding the time spent in its block to the current request's span.
+
+    init_app(app):
+        Adds the Server-Timing header, the request histograms and the /metrics endpoint to an app.
+
+    render():
+        Returns every metric in the Prometheus text exposition format.
+
+Modules:
+    flask: Web framework used to hook into requests.
+    sqlalchemy: SQL toolkit and Object-Relational Mapping (ORM) library.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import Response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PROMETHEUS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# what the count of each span counts, singular and plural, for the Server-Timing description
+SPAN_UNITS = {"sql": ("query", "queries"), "format": ("row", "rows")}
+
+
+def _label_text(names, values):
+    """Formats label pairs as {name="value",...}, escaped as Prometheus requires."""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """
+    A Prometheus counter with labels.
+
+    Attributes:
+        name (str): The metric name.
+        help (str): The metric description.
+        labelnames (tuple): The names of the labels every sample carries.
+    """
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """Adds amount to the sample with the given labels."""
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        """Returns the metric in the text exposition format."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    A Prometheus histogram with labels, counting observations into BUCKETS.
+
+    Attributes:
+        name (str): The metric name.
+        help (str): The metric description.
+        labelnames (tuple): The names of the labels every sample carries.
+    """
+
+    def __init__(self, name, help, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        # maps label values to [count per bucket..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """Records one observation with the given labels."""
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[index] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def render(self):
+        """Returns the metric in the text exposition format, with cumulative buckets."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        bucket_labels = self.labelnames + ("le",)
+        with self._lock:
+            for key, values in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, values):
+                    labels = _label_text(bucket_labels, key + (repr(float(bound)),))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _label_text(bucket_labels, key + ("+Inf",))
+                lines.append(f"{self.name}_bucket{labels} {values[-1]}")
+                labels = _label_text(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {values[-2]}")
+                lines.append(f"{self.name}_count{labels} {values[-1]}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    "stats_request_duration_seconds", "Time spent handling requests.", ("endpoint",)
+)
+REQUESTS = Counter("stats_requests_total", "Requests handled.", ("endpoint", "status"))
+QUERY_SECONDS = Histogram(
+    "stats_query_duration_seconds", "Time spent executing SQL statements.", ("shape",)
+)
+QUERY_ROWS = Counter(
+    "stats_query_rows_total", "Rows returned by SQL statements, where the driver reports them.", ("shape",)
+)
+SPAN_SECONDS = Histogram(
+    "stats_span_duration_seconds", "Time spent in each part of a request.", ("endpoint", "span")
+)
+WARM_SECONDS = Histogram(
+    "stats_cache_warm_duration_seconds", "Time spent recomputing the dashboard queries, see warming.py."
+)
+WARM_FAILURES = Counter(
+    "stats_cache_warm_failures_total",
+    "Dashboard queries, or whole refreshes, that failed to recompute, see warming.py.",
+    ("endpoint",),
+)
+METRICS = (REQUEST_SECONDS, REQUESTS, QUERY_SECONDS, QUERY_ROWS, SPAN_SECONDS, WARM_SECONDS, WARM_FAILURES)
+
+
+class RequestTimings:
+    """The spans of one request: maps each span name to [seconds, count]."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, count=None):
+        """Adds seconds, and count if given, to a span."""
+        with self._lock:
+            span_values = self.spans.setdefault(name, [0.0, 0])
+            span_values[0] += seconds
+            span_values[1] += count or 0
+
+    def server_timing(self, total):
+        """Returns the Server-Timing header value, durations in milliseconds."""
+        entries = []
+        with self._lock:
+            for name, (seconds, count) in self.spans.items():
+                entry = f"{name};dur={seconds * 1000:.2f}"
+                if name in SPAN_UNITS:
+                    entry += f';desc="{count} {SPAN_UNITS[name][count != 1]}"'
+                entries.append(entry)
+        entries.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(entries)
+
+
+_timings = ContextVar("request_timings", default=None)
+
+
+def query_shape(kind, columns=(), time_group=None):
+    """
+    Returns the shape name of a query, for the query_shape execution option.
+
+    Args:
+        kind (str): The kind of query, e.g. 'model' or 'global_sum'.
+        columns (list): The columns grouped by, None entries being skipped.
+        time_group (str): The time group, if any.
+
+    Returns:
+        str: e.g. 'model:country,download_type:day'.
+    """
+    shape = kind
+    columns = [column for column in columns if column]
+    if columns:
+        shape += ":" + ",".join(columns)
+    if time_group:
+        shape += ":" + time_group
+    return shape
+
+
+@contextmanager
+def span(name, count=None):
+    """Adds the time spent in the block, and count, to the current request's span, if in a request."""
+    began = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _timings.get()
+        if timings is not None:
+            timings.add(name, time.perf_counter() - began, count)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_start_times"].pop()
+    shape = context.execution_options.get("query_shape", "other") if context else "other"
+    QUERY_SECONDS.observe(seconds, shape=shape)
+    # SELECT row counts are reported by PostgreSQL and MySQL drivers, but not by SQLite
+    if not executemany and cursor.rowcount is not None and cursor.rowcount >= 0:
+        QUERY_ROWS.inc(cursor.rowcount, shape=shape)
+
+    timings = _timings.get()
+    if timings is not None:
+        timings.add("sql", seconds, 1)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    # the statement failed, so after_cursor_execute will not pop its start time
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_start_times"):
+        connection.info["query_start_times"].pop()
+
+
+def render():
+    """Returns every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _start_request():
+    _timings.set(RequestTimings())
+
+
+def _finish_request(response):
+    timings = _timings.get()
+    if timings is None:
+        return response
+    total = time.perf_counter() - timings.started
+    endpoint = request.endpoint or "unmatched"
+
+    response.headers["Server-Timing"] = timings.server_timing(total)
+    REQUEST_SECONDS.observe(total, endpoint=endpoint)
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    for name, (seconds, _) in timings.spans.items():
+        SPAN_SECONDS.observe(seconds, endpoint=endpoint, span=name)
+    return response
+
+
+def _end_request(exception=None):
+    _timings.set(None)
+
+
+def metrics_endpoint():
+    """Serves every metric in the Prometheus text exposition format."""
+    return Response(render(), content_type=PROMETHEUS_MIMETYPE)
+
+
+def init_app(app):
+    """Adds the Server-Timing header, the request histograms and the /metrics endpoint to an app."""
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_end_request)
+    app.add_url_rule("/metrics", "metrics", metrics_endpoint, methods=["GET"])
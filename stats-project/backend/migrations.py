@@ -0,0 +1,75 @@
+"""
+migrations.py
+
+Brings an existing stats database up to date with the schema the API expects.
+
+Every step is idempotent, so the script can be re-run safely after each deploy. Tables missing from
+the database (such as the rollup tables) are created, and indexes added to the models after their
+tables were first created are built. Indexes the models have replaced are dropped.
+
+Functions:
+    migrate(engine):
+        Creates every missing table and index.
+
+Modules:
+    sqlalchemy: SQL toolkit and Object-Relational Mapping (ORM) library.
+    models: Contains the SQLAlchemy models for the application.
+
+Usage:
+    python migrations.py
+"""
+
+from sqlalchemy import Index, inspect, text
+from models import Base, HourlyDownloadData
+
+# Indexes replaced by one in the models, dropped once their replacement exists
+SUPERSEDED_INDEXES = {
+    "ix_hourly_download_data_start_dttm": ["start_dttm"],
+}
+
+# Expression indexes matching the date_trunc() buckets time_buckets.py groups the hourly data by
+POSTGRES_INDEXES = [
+    f"CREATE INDEX IF NOT EXISTS ix_hourly_download_data_{time_group} "
+    f"ON hourly_download_data (date_trunc('{time_group}', start_dttm))"
+    for time_group in ("day", "month", "year")
+]
+
+
+def migrate(engine):
+    """
+    Creates every missing table and index.
+
+    Args:
+        engine (Engine): The engine of the database to migrate.
+
+    Returns:
+        list: A description of each step that was run.
+    """
+    steps = []
+    Base.metadata.create_all(engine)
+    steps.append("created missing tables")
+
+    table = HourlyDownloadData.__table__
+    for index in table.indexes:
+        index.create(engine, checkfirst=True)
+        steps.append(f"ensured index {index.name}")
+
+    existing = {index["name"] for index in inspect(engine).get_indexes(table.name)}
+    for name, columns in SUPERSEDED_INDEXES.items():
+        if name in existing:
+            Index(name, *(table.c[column] for column in columns)).drop(engine)
+            steps.append(f"dropped superseded index {name}")
+
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as connection:
+            for statement in POSTGRES_INDEXES:
+                connection.execute(text(statement))
+                steps.append(statement)
+    return steps
+
+
+if __name__ == "__main__":
+    from api_utils import engine
+
+    for step in migrate(engine):
+        print(step)
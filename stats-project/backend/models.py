@@ -8,10 +8,16 @@ Classes:
     HourlyDownloadData:
         A class to represent the hourly download data sheet in the database.
 
+    DailyDownloadRollup, MonthlyDownloadRollup, YearlyDownloadRollup:
+        Pre-aggregated copies of the hourly data, summed into day, month and year buckets.
+
 Functions:
     get_model(model_name):
         Returns the ORM model specified by the model name.
 
+    get_rollup_model(time_group):
+        Returns the rollup model holding data at the given time grain.
+
 Modules:
     sqlalchemy: SQL toolkit and Object-Relational Mapping (ORM) library.
     sqlalchemy.orm: Provides the base class for ORM models and other ORM utilities.
@@ -21,8 +27,8 @@ Usage:
     Use the get_model function to retrieve models by name.
 """
 
-from sqlalchemy import Column, String, Integer, DateTime, PrimaryKeyConstraint
-from sqlalchemy.orm import declarative_base
+from sqlalchemy import Column, String, Integer, DateTime, Index, PrimaryKeyConstraint
+from sqlalchemy.orm import declarative_base, declared_attr
 
 Base = declarative_base()
 
@@ -65,9 +71,69 @@ class HourlyDownloadData(Base):
 
     __table_args__ = (
         PrimaryKeyConstraint("country", "download_type", "category", "start_dttm"),
+        # serves time range filters, which the primary key cannot as start_dttm is its last column;
+        # primary_count is included so range sums can be answered from the index alone
+        Index("ix_hourly_download_data_start_dttm_primary_count", "start_dttm", "primary_count"),
     )
 
 
+class DownloadRollupMixin:
+    """
+    Columns shared by the rollup tables.
+
+    Each rollup row holds the summed counts of every hourly row sharing its dimensions
+    within one time bucket. start_dttm is kept as the column name so the rollups can be
+    queried exactly like HourlyDownloadData; it holds the first instant of the bucket.
+    """
+
+    time_group = None
+
+    start_dttm = Column(DateTime, nullable=False)
+    country = Column(String, nullable=False)
+    category = Column(String, nullable=False)
+    archive = Column(String, nullable=False)
+    download_type = Column(String, nullable=False)
+    primary_count = Column(Integer, nullable=False)
+    cross_count = Column(Integer, nullable=False)
+
+    @declared_attr
+    def __table_args__(cls):
+        return (
+            PrimaryKeyConstraint(
+                "start_dttm", "country", "category", "archive", "download_type"
+            ),
+        )
+
+
+class DailyDownloadRollup(DownloadRollupMixin, Base):
+    """Hourly download data summed per day."""
+
+    __tablename__ = "daily_download_rollup"
+    time_group = "day"
+
+
+class MonthlyDownloadRollup(DownloadRollupMixin, Base):
+    """Hourly download data summed per month."""
+
+    __tablename__ = "monthly_download_rollup"
+    time_group = "month"
+
+
+class YearlyDownloadRollup(DownloadRollupMixin, Base):
+    """Hourly download data summed per year."""
+
+    __tablename__ = "yearly_download_rollup"
+    time_group = "year"
+
+
+# ordered finest to coarsest
+ROLLUP_MODELS = {
+    "day": DailyDownloadRollup,
+    "month": MonthlyDownloadRollup,
+    "year": YearlyDownloadRollup,
+}
+
+
 def get_model(model_name):
     """
     Returns the ORM model specified.
@@ -86,3 +152,17 @@ def get_model(model_name):
     # return none if the model does not exist
     else:
         return None
+
+
+def get_rollup_model(time_group):
+    """
+    Returns the rollup model storing data at the given time grain.
+
+    Args:
+        time_group: str
+            'day', 'month' or 'year'.
+
+    Returns:
+        The rollup ORM model, or None if there is no rollup at that grain.
+    """
+    return ROLLUP_MODELS.get(time_group)
@@ -0,0 +1,434 @@
+"""
+parquet_store.py
+
+This module provides an optional columnar copy of the closed months of hourly data, queried in process
+with DuckDB.
+
+The hourly data only changes for the current month: once a month has been fully ingested, its rows are
+never touched again, short of a reload. Each closed month is exported to one Parquet file,
+PARQUET_DIR/YYYY-MM.parquet, sorted by start_dttm. Aggregations reaching back into the exported months
+are then split at the end of the newest one: DuckDB scans the Parquet files of the months before it,
+reading only the columns and months the query needs, the database aggregates the rest as before, and
+the two sets of rows are summed together. Queries on the current month alone never touch Parquet.
+
+A month is closed once an hour after it has been ingested. ingest.py exports newly closed months, and
+re-exports any exported month it loads rows into, so the files stay in step with the database.
+Exports are written to a temporary file and renamed into place, so queries never read a partial file.
+The store also records the first month of data, in PARQUET_DIR/first_month, and is only used once the
+exports run from that month without a gap; a partial export, e.g. of one --month, is never queried alone.
+
+Only aggregations the Parquet files can answer are split, like those of the in-memory cube: grouped
+and filtered by country, category, archive or download_type, over the hourly data. Everything else,
+streamed results included, still goes to the database alone.
+
+Classes:
+    ParquetStore:
+        The exported months in a directory, and the aggregations DuckDB runs over them.
+
+Functions:
+    get_store():
+        Returns the store, or None if PARQUET_DIR is not set or DuckDB is not installed.
+
+    export_closed_months(engine, store, since=None, force=False, log=print):
+        Exports every closed month missing from the store, and re-exports those from since onward.
+
+    merge_rows(row_sets, data_index):
+        Sums rows of the same group from several sets of aggregated rows.
+
+Modules:
+    duckdb: Optional. The store is disabled when it is not installed.
+    sqlalchemy: SQL toolkit and Object-Relational Mapping (ORM) library.
+    models: Contains the SQLAlchemy models for the application.
+
+Environment Variables:
+    PARQUET_DIR: The directory holding the exported months. Optional; the store is disabled without it.
+    DUCKDB_THREADS: The number of threads each DuckDB query may use. Defaults to DuckDB's, one per core.
+
+Usage:
+    python parquet_store.py [--force] [--month 2024-03]
+
+    Exports every closed month not exported yet, or with --force every closed month, or with --month
+    only the given one.
+"""
+
+import csv
+import os
+import re
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from models import HourlyDownloadData
+
+try:
+    import duckdb
+except ImportError:  # optional dependency
+    duckdb = None
+
+PARQUET_DIR = os.getenv("PARQUET_DIR")
+
+# the columns the files can group and filter on, as for the in-memory cube
+DIMENSIONS = ("country", "category", "archive", "download_type")
+
+TABLE = HourlyDownloadData.__table__
+COLUMNS = {
+    "country": "VARCHAR",
+    "download_type": "VARCHAR",
+    "archive": "VARCHAR",
+    "category": "VARCHAR",
+    "primary_count": "INTEGER",
+    "cross_count": "INTEGER",
+    "start_dttm": "TIMESTAMP",
+}
+
+MONTH_FILE = re.compile(r"^(\d{4})-(\d{2})\.parquet$")
+# holds the first month of data, as YYYY-MM, which the exports must start from
+FIRST_MONTH_FILE = "first_month"
+TIME_GROUPS = ("hour", "day", "month", "year")
+
+# how NULLs are written in the intermediate CSV, as no stored value looks like it
+NULL = "\\N"
+
+
+def month_start(value):
+    """Returns the start of the month holding value."""
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(month):
+    """Returns the start of the month after the one starting at month."""
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def merge_rows(row_sets, data_index):
+    """
+    Sums rows of the same group from several sets of aggregated rows.
+
+    Args:
+        row_sets (list): Lists of rows with the same columns, one being the sum at data_index.
+        data_index (int): The position of the summed column; every other column identifies the group.
+
+    Returns:
+        list: One row per group, in the order groups were first seen.
+    """
+    totals = defaultdict(int)
+    for rows in row_sets:
+        for row in rows:
+            totals[(*row[:data_index], *row[data_index + 1:])] += row[data_index]
+    return [(*key[:data_index], data, *key[data_index:]) for key, data in totals.items()]
+
+
+def _quote(text):
+    return "'" + text.replace("'", "''") + "'"
+
+
+class ParquetStore:
+    """
+    The exported months in a directory, and the aggregations DuckDB runs over them.
+
+    Attributes:
+        directory (str): Where the monthly Parquet files are kept.
+        threads (int): The threads each query may use, or None for DuckDB's default.
+    """
+
+    def __init__(self, directory, threads=None):
+        self.directory = directory
+        self.threads = threads
+        self._months = []
+        self._first_month = None
+        self._scanned = None
+        self._database = None
+        self._database_pid = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, month):
+        """Returns the path of a month's file."""
+        return os.path.join(self.directory, f"{month:%Y-%m}.parquet")
+
+    def months(self):
+        """Returns the starts of the exported months, oldest first, rescanning the directory when it changes."""
+        return self._scan()[0]
+
+    def first_month(self):
+        """Returns the first month of data, as recorded by export_closed_months, or None if it was never run."""
+        return self._scan()[1]
+
+    def set_first_month(self, month):
+        """Records the first month of data, which the exports must start from to be queried."""
+        path = os.path.join(self.directory, FIRST_MONTH_FILE)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as file:
+            file.write(f"{month:%Y-%m}\n")
+        os.replace(temporary_path, path)
+
+    def _scan(self):
+        # files are only ever renamed into place, which changes the directory's modification time
+        changed = os.stat(self.directory).st_mtime_ns
+        with self._lock:
+            if changed != self._scanned:
+                months = []
+                for name in os.listdir(self.directory):
+                    match = MONTH_FILE.match(name)
+                    if match:
+                        months.append(datetime(int(match.group(1)), int(match.group(2)), 1))
+                self._months = sorted(months)
+                try:
+                    with open(os.path.join(self.directory, FIRST_MONTH_FILE)) as file:
+                        self._first_month = datetime.strptime(file.read().strip(), "%Y-%m")
+                except (FileNotFoundError, ValueError):
+                    self._first_month = None
+                self._scanned = changed
+            return self._months, self._first_month
+
+    def boundary(self):
+        """
+        Returns the end of the exported months, or None unless they run from the first month of data
+        without a gap, so every hour before the boundary is in a file.
+        """
+        months, first_month = self._scan()
+        if not months or months[0] != first_month:
+            return None
+        for month, following in zip(months, months[1:]):
+            if next_month(month) != following:
+                return None
+        return next_month(months[-1])
+
+    def split(self, start=None, end=None):
+        """
+        Returns the hour at which to split an aggregation over [start, end) between the files and the
+        database, or None if the files hold none of the range.
+        """
+        boundary = self.boundary()
+        if boundary is None or (start is not None and start >= boundary):
+            return None
+        return boundary
+
+    def _connection(self):
+        # DuckDB connections are not shared across a fork, and each query takes a cursor of its own
+        with self._lock:
+            if self._database is None or self._database_pid != os.getpid():
+                self._database = duckdb.connect()
+                if self.threads:
+                    self._database.execute(f"SET threads TO {int(self.threads)}")
+                self._database_pid = os.getpid()
+            return self._database.cursor()
+
+    def _source(self, start, end):
+        """Returns the read_parquet() call over the files of the months [start, end) overlaps."""
+        paths = [
+            self.path(month)
+            for month in self.months()
+            if (end is None or month < end) and (start is None or next_month(month) > start)
+        ]
+        if not paths:
+            return None
+        return "read_parquet([" + ", ".join(_quote(path) for path in paths) + "])"
+
+    @staticmethod
+    def _where(start, end, filters):
+        """Returns the WHERE clause and its parameters restricting rows to [start, end) and filters."""
+        conditions = []
+        parameters = []
+        if start is not None:
+            conditions.append("start_dttm >= ?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append("start_dttm < ?")
+            parameters.append(end)
+        for column_name, values in (filters or {}).items():
+            matches = []
+            exact = [value for value in values if not value.endswith("*")]
+            for value in values:
+                if value.endswith("*"):
+                    matches.append(f"starts_with({column_name}, ?)")
+                    parameters.append(value[:-1])
+            if exact:
+                matches.append(f"{column_name} IN ({', '.join('?' * len(exact))})")
+                parameters.extend(exact)
+            conditions.append("(" + " OR ".join(matches) + ")")
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), parameters
+
+    def _aggregate(self, columns, group_by, start, end, filters, order_by=None):
+        """Runs SELECT columns ... GROUP BY group_by over the files of [start, end)."""
+        for column_name in filters or {}:
+            if column_name not in DIMENSIONS:
+                raise ValueError(f"The Parquet store cannot filter on {column_name}")
+        source = self._source(start, end)
+        if source is None:
+            return []
+        where, parameters = self._where(start, end, filters)
+        statement = f"SELECT {', '.join(columns)} FROM {source}{where}"
+        if group_by:
+            statement += f" GROUP BY {', '.join(group_by)}"
+        if order_by:
+            statement += f" ORDER BY {order_by}"
+        cursor = self._connection()
+        try:
+            return cursor.execute(statement, parameters).fetchall()
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _dimension(column_name):
+        if column_name not in DIMENSIONS:
+            raise ValueError(f"The Parquet store cannot group by {column_name}")
+        return column_name
+
+    @staticmethod
+    def _time_bucket(time_group):
+        if time_group not in TIME_GROUPS:
+            raise ValueError(f"Invalid time group: {time_group}")
+        return f"CAST(date_trunc('{time_group}', start_dttm) AS TIMESTAMP)"
+
+    def model_rows(
+        self,
+        group_by_column,
+        second_group_by_column=None,
+        time_group=None,
+        start=None,
+        end=None,
+        filters=None,
+    ):
+        """Returns the rows of api_utils.build_model_query over [start, end) from the files."""
+        group_by = [self._dimension(group_by_column)]
+        columns = [group_by[0], "SUM(primary_count)"]
+        if second_group_by_column:
+            group_by.append(self._dimension(second_group_by_column))
+            columns.append(group_by[-1])
+        if time_group:
+            group_by.append(self._time_bucket(time_group))
+            columns.append(group_by[-1])
+        return self._aggregate(columns, group_by, start, end, filters)
+
+    def rollup_rows(self, levels, time_group=None, start=None, end=None, filters=None):
+        """Returns the rows of api_utils.fetch_rollup_rows over [start, end) from the files."""
+        level_columns = [self._dimension(level) for level in levels]
+        columns = [*level_columns, "SUM(primary_count)"]
+        group_by = [f"ROLLUP ({', '.join(level_columns)})"]
+        if time_group:
+            columns.append(self._time_bucket(time_group))
+            group_by.insert(0, columns[-1])
+        columns.append(f"GROUPING({', '.join(level_columns)})")
+        return self._aggregate(columns, group_by, start, end, filters)
+
+    def global_sums(self, time_group, start=None, end=None, filters=None):
+        """Returns the rows of api_utils.build_global_sum_query over [start, end) from the files."""
+        bucket = self._time_bucket(time_group)
+        return self._aggregate([bucket, "SUM(primary_count)"], [bucket], start, end, filters, order_by=bucket)
+
+    def export_month(self, engine, month):
+        """
+        Writes the rows of one month from the database to its file, replacing any previous export.
+
+        Returns:
+            int: The number of rows exported.
+        """
+        end = next_month(month)
+        path = self.path(month)
+        csv_path = f"{path}.{os.getpid()}.csv"
+        parquet_path = f"{path}.{os.getpid()}.tmp"
+        query = (
+            select(*[TABLE.c[name] for name in COLUMNS])
+            .where(TABLE.c.start_dttm >= month, TABLE.c.start_dttm < end)
+        )
+
+        count = 0
+        try:
+            with open(csv_path, "w", newline="") as file, engine.connect() as connection:
+                writer = csv.writer(file)
+                result = connection.execution_options(stream_results=True).execute(query)
+                for rows in result.partitions(10000):
+                    writer.writerows([NULL if value is None else value for value in row] for row in rows)
+                    count += len(rows)
+
+            column_types = "{" + ", ".join(f"{_quote(name)}: {_quote(kind)}" for name, kind in COLUMNS.items()) + "}"
+            cursor = self._connection()
+            try:
+                cursor.execute(
+                    f"COPY (SELECT * FROM read_csv({_quote(csv_path)}, header = false, "
+                    f"nullstr = {_quote(NULL)}, columns = {column_types}) ORDER BY start_dttm) "
+                    f"TO {_quote(parquet_path)} (FORMAT PARQUET, COMPRESSION ZSTD)"
+                )
+            finally:
+                cursor.close()
+            os.replace(parquet_path, path)
+        finally:
+            for leftover in (csv_path, parquet_path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        return count
+
+
+def export_closed_months(engine, store, since=None, force=False, log=print):
+    """
+    Exports every closed month missing from the store, and re-exports those from since onward.
+
+    A month is closed once an hour after it has been ingested. Months are exported from the first
+    month of data, so the exports are contiguous.
+
+    Args:
+        engine (Engine): The engine of the database to export from.
+        store (ParquetStore): The store to export into.
+        since (datetime): Re-export the exported months holding this hour or later, e.g. the first
+            hour an ingest loaded. Optional.
+        force (bool): Re-export every closed month.
+        log (callable): Receives a line per exported month.
+
+    Returns:
+        list: The starts of the months exported.
+    """
+    with engine.connect() as connection:
+        first, last = connection.execute(
+            select(func.min(TABLE.c.start_dttm), func.max(TABLE.c.start_dttm))
+        ).one()
+    if first is None:
+        return []
+
+    # recorded first, so until the months from it are exported, the store is not used
+    store.set_first_month(month_start(first))
+    exported = set(store.months())
+    closed_before = month_start(last + timedelta(hours=1))
+    month = month_start(first)
+    done = []
+    while month < closed_before:
+        stale = since is not None and next_month(month) > since
+        if force or month not in exported or stale:
+            count = store.export_month(engine, month)
+            log(f"Exported {count} rows of {month:%Y-%m} to {store.path(month)}")
+            done.append(month)
+        month = next_month(month)
+    return done
+
+
+_store = None
+
+
+def get_store():
+    """Returns the store, or None if PARQUET_DIR is not set or DuckDB is not installed."""
+    global _store
+    if duckdb is None or not PARQUET_DIR:
+        return None
+    if _store is None:
+        threads = os.getenv("DUCKDB_THREADS")
+        _store = ParquetStore(PARQUET_DIR, int(threads) if threads else None)
+    return _store
+
+
+if __name__ == "__main__":
+    import argparse
+    from api_utils import engine
+
+    parser = argparse.ArgumentParser(description="Export closed months of hourly data to Parquet.")
+    parser.add_argument("--force", action="store_true", help="re-export every closed month")
+    parser.add_argument("--month", help="only export this month, e.g. 2024-03")
+    args = parser.parse_args()
+
+    store = get_store()
+    if store is None:
+        raise SystemExit("Set PARQUET_DIR and install duckdb to export to Parquet.")
+    if args.month:
+        month = datetime.strptime(args.month, "%Y-%m")
+        print(f"Exported {store.export_month(engine, month)} rows of {args.month} to {store.path(month)}")
+    else:
+        print(f"Exported {len(export_closed_months(engine, store, force=args.force))} months")
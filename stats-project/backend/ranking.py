@@ -0,0 +1,135 @@
+"""
+ranking.py
+
+This module provides top-N queries: the N groups with the largest (or smallest) totals, optionally with
+every other group summed into one "Other" row.
+
+For a breakdown such as downloads per country per day, the groups are ranked by their total over the
+whole range, and the kept groups keep one row per day, as does "Other". On databases with window
+functions, the grouping, ranking and bucketing run in one SQL statement:
+
+    SELECT CASE WHEN group_rank <= N THEN country ELSE 'Other' END, SUM(data), time_group
+    FROM (SELECT *, DENSE_RANK() OVER (ORDER BY group_total DESC, country) AS group_rank
+          FROM (SELECT *, SUM(data) OVER (PARTITION BY country) AS group_total
+                FROM (<the query_model aggregation>)))
+    GROUP BY ...
+
+MySQL before 8.0 has no window functions, and the in-memory cube is not SQL, so there the aggregated
+rows are ranked in Python instead, giving the same rows in the same order.
+
+Ties are broken by the group's value, so results are stable. Rows are ordered by rank, "Other" last,
+then by their remaining columns.
+
+Functions:
+    supports_window_functions(dialect):
+        Whether the database can rank the groups itself.
+
+    build_top_n_query(session, query, group_by_column, limit, order='desc', other=False):
+        Wraps an aggregation query so that it only returns the top groups.
+
+    top_n_rows(rows, limit, order='desc', other=False):
+        Keeps the rows of the top groups of already aggregated rows.
+
+Modules:
+    sqlalchemy: SQL toolkit and Object-Relational Mapping (ORM) library.
+"""
+
+from collections import defaultdict
+from sqlalchemy import case, func, literal_column
+
+OTHER_LABEL = "Other"
+
+ORDERS = ("desc", "asc")
+
+
+def supports_window_functions(dialect):
+    """Whether the database can rank the groups itself; MySQL gained window functions in 8.0."""
+    if dialect.name == "mysql":
+        return (dialect.server_version_info or (0,)) >= (8, 0)
+    return True
+
+
+def build_top_n_query(session, query, group_by_column, limit, order="desc", other=False):
+    """
+    Wraps an aggregation query so that it only returns its top groups, in one statement.
+
+    Args:
+        session (Session): The session the query will run in.
+        query (Query): An aggregation whose rows are (group_by, data, *other columns), as from
+            api_utils.build_model_query.
+        group_by_column (str): The name of the column ranked, the first of the query.
+        limit (int): The number of groups kept.
+        order (str): 'desc' keeps the groups with the largest totals, 'asc' the smallest.
+        other (bool): Whether the remaining groups are summed into one OTHER_LABEL row per
+            combination of the other columns.
+
+    Returns:
+        Query: Rows of the same shape as query's, in rank order.
+    """
+    grouped = query.subquery("grouped")
+    rest = [column for column in grouped.c if column.name not in (group_by_column, "data")]
+
+    group_total = func.sum(grouped.c.data).over(partition_by=grouped.c[group_by_column])
+    totalled = session.query(*grouped.c, group_total.label("group_total")).subquery("totalled")
+
+    total_order = totalled.c.group_total.desc() if order == "desc" else totalled.c.group_total.asc()
+    group_rank = func.dense_rank().over(order_by=(total_order, totalled.c[group_by_column]))
+    ranked = session.query(*totalled.c, group_rank.label("group_rank")).subquery("ranked")
+
+    # inlined rather than bound, so PostgreSQL sees the same expressions in GROUP BY and ORDER BY
+    kept = ranked.c.group_rank <= literal_column(str(int(limit)))
+    group_value = ranked.c[group_by_column]
+    rank_key = ranked.c.group_rank
+    if other:
+        group_value = case((kept, group_value), else_=literal_column(f"'{OTHER_LABEL}'"))
+        rank_key = case((kept, ranked.c.group_rank), else_=literal_column(str(int(limit) + 1)))
+    rest_columns = [ranked.c[column.name] for column in rest]
+
+    top = session.query(
+        group_value.label(group_by_column),
+        func.sum(ranked.c.data).label("data"),
+        *rest_columns,
+    )
+    if not other:
+        top = top.filter(kept)
+    return top.group_by(rank_key, group_value, *rest_columns).order_by(rank_key, *rest_columns)
+
+
+def _sort_key(values):
+    """Orders values with None last, as PostgreSQL does."""
+    return tuple((value is None, value) for value in values)
+
+
+def top_n_rows(rows, limit, order="desc", other=False):
+    """
+    Keeps the rows of the top groups of already aggregated rows, like build_top_n_query.
+
+    Args:
+        rows (list): Rows of (group_by, data, *other columns), one per distinct combination.
+        The remaining arguments are those of build_top_n_query.
+
+    Returns:
+        list: Rows of the same shape, in rank order.
+    """
+    totals = defaultdict(int)
+    for row in rows:
+        totals[row[0]] += row[1]
+    sign = -1 if order == "desc" else 1
+    ranked = sorted(totals, key=lambda group: (sign * totals[group], group is None, group))
+    rank = {group: index for index, group in enumerate(ranked[:limit])}
+
+    kept = sorted(
+        (tuple(row) for row in rows if row[0] in rank),
+        key=lambda row: (rank[row[0]], _sort_key(row[2:])),
+    )
+    if not other:
+        return kept
+
+    others = defaultdict(int)
+    for row in rows:
+        if row[0] not in rank:
+            others[tuple(row[2:])] += row[1]
+    kept.extend(
+        (OTHER_LABEL, total, *rest) for rest, total in sorted(others.items(), key=lambda item: _sort_key(item[0]))
+    )
+    return kept
@@ -0,0 +1,127 @@
+"""
+replicas.py
+
+This module routes the read queries of api_utils to read-only replicas of the database.
+
+When DATABASE_REPLICA_URIS is set, every session made by api_utils.Session sends its SELECT statements
+to one of the replicas, chosen when the session first reads and kept until it is closed, so the
+statements of one call see one consistent copy of the data. Any other statement, such as the writes of
+a rollup refresh, goes to the primary, and so does everything after it in the same session, so a
+session reads its own writes. Sessions that must read from the primary, e.g. to refresh the rollups
+from the newest data, can ask for it with use_primary.
+
+Replicas are chosen with one of two strategies, set by DB_REPLICA_ROUTING:
+    round_robin: Each session takes the next replica in turn. The default.
+    least_busy: Each session takes the replica with the fewest connections checked out by this
+        process, the first listed on a tie.
+
+Classes:
+    ReplicaRouter:
+        Chooses the replica each session reads from.
+
+    RoutingSession:
+        A Session sending its reads to the replica its router chooses.
+
+Environment Variables:
+    DATABASE_REPLICA_URIS: A comma separated list of replica database URLs. Optional; without it,
+        every query goes to DATABASE_URI.
+    DB_REPLICA_ROUTING: round_robin or least_busy. Defaults to round_robin.
+
+Usage:
+    api_utils builds its session factory with RoutingSession and a ReplicaRouter over its replica engines.
+"""
+
+import itertools
+import threading
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.selectable import CompoundSelect, Select
+
+ROUTING_STRATEGIES = ("round_robin", "least_busy")
+
+
+class ReplicaRouter:
+    """
+    Chooses the replica each session reads from.
+
+    Attributes:
+        engines (list): The replica engines.
+        strategy (str): 'round_robin' or 'least_busy'.
+    """
+
+    def __init__(self, engines, strategy="round_robin"):
+        if not engines:
+            raise ValueError("A replica router needs at least one replica")
+        if strategy not in ROUTING_STRATEGIES:
+            raise ValueError(f"Invalid DB_REPLICA_ROUTING, use {' or '.join(ROUTING_STRATEGIES)}: {strategy}")
+        self.engines = list(engines)
+        self.strategy = strategy
+        self._turns = itertools.cycle(self.engines)
+        # connections checked out of each replica's pool, by this process
+        self._in_use = {engine: 0 for engine in self.engines}
+        self._lock = threading.Lock()
+        for engine in self.engines:
+            event.listen(engine, "checkout", self._counter(engine, 1))
+            event.listen(engine, "checkin", self._counter(engine, -1))
+
+    def _counter(self, engine, step):
+        def count(*args):
+            with self._lock:
+                self._in_use[engine] += step
+        return count
+
+    def choose(self):
+        """Returns the engine the next session reads from."""
+        with self._lock:
+            if self.strategy == "least_busy":
+                return min(self.engines, key=self._in_use.__getitem__)
+            return next(self._turns)
+
+    def in_use(self):
+        """Returns the number of connections checked out of each replica, by URL without password."""
+        with self._lock:
+            return {repr(engine.url): count for engine, count in self._in_use.items()}
+
+    def dispose(self):
+        """Drops the pooled connections of every replica, e.g. in a newly forked worker."""
+        for engine in self.engines:
+            engine.dispose(close=False)
+        with self._lock:
+            self._in_use = {engine: 0 for engine in self.engines}
+
+
+class RoutingSession(Session):
+    """
+    A Session sending its SELECT statements to the replica its router chooses, and the rest to its bind.
+
+    Without a router, it behaves as a plain Session.
+    """
+
+    def __init__(self, *args, router=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.router = router
+        self._replica = None
+        self._primary = False
+
+    def use_primary(self):
+        """Sends every statement of this session to the primary until it is closed."""
+        self._primary = True
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.router is None or self._primary:
+            return super().get_bind(mapper, clause=clause, **kwargs)
+        if mapper is None and clause is None:
+            # a plain lookup, e.g. of the dialect, rather than a statement about to run
+            return super().get_bind(**kwargs)
+        if not isinstance(clause, (Select, CompoundSelect)):
+            # a write, or a statement that may be one; read from the primary from now on
+            self._primary = True
+            return super().get_bind(mapper, clause=clause, **kwargs)
+        if self._replica is None:
+            self._replica = self.router.choose()
+        return self._replica
+
+    def close(self):
+        super().close()
+        self._replica = None
+        self._primary = False
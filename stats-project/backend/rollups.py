@@ -0,0 +1,223 @@
+"""
+rollups.py
+
+This module maintains the daily, monthly and yearly rollup tables built from hourly_download_data,
+and decides which table a query should read from.
+
+Every rollup row is keyed by (time bucket, country, category, archive, download_type), so any
+aggregation that only groups on those dimensions can be answered from a rollup instead of scanning
+every hourly row. Rollups are refreshed incrementally: only the buckets overlapping a range of
+newly ingested hours are recomputed.
+
+Functions:
+    truncate_datetime(value, time_group):
+        Returns the first instant of the time bucket containing value.
+
+    refresh_rollups(session, start, end):
+        Recomputes every rollup bucket overlapping the hourly range [start, end).
+
+    refresh_incremental(session):
+        Refreshes the rollups from their current watermark up to the newest hourly row.
+
+    select_source_model(model, columns, time_group=None, start=None, end=None):
+        Returns the coarsest rollup able to answer a query, or the model itself.
+
+Modules:
+    os: Provides a way of using operating system dependent functionality.
+    sqlalchemy: SQL toolkit and Object-Relational Mapping (ORM) library.
+    models: Contains the SQLAlchemy models for the application.
+    time_buckets: Groups and filters rows by the start of their time bucket.
+
+Environment Variables:
+    USE_ROLLUPS: Set to 'true' once the rollup tables have been created and backfilled.
+
+Usage:
+    python migrations.py                        # create the rollup tables
+    python rollups.py backfill                  # rebuild the rollups over all hourly data
+    python rollups.py refresh                   # refresh from the rollup watermark onward
+    python rollups.py refresh --start 2024-03-01 --end 2024-03-02
+"""
+
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, select
+from models import HourlyDownloadData, ROLLUP_MODELS, get_rollup_model
+from time_buckets import get_time_group_column, apply_time_range
+
+ROLLUPS_ENABLED = os.getenv("USE_ROLLUPS", "false").lower() in ("1", "true", "yes")
+
+# Columns a rollup can be grouped or filtered by
+ROLLUP_DIMENSIONS = ("country", "category", "archive", "download_type")
+
+# Which table each rollup is summed from
+ROLLUP_SOURCES = {"day": HourlyDownloadData, "month": ROLLUP_MODELS["day"], "year": ROLLUP_MODELS["month"]}
+
+
+def truncate_datetime(value, time_group):
+    """Returns the first instant of the day, month or year containing value."""
+    if time_group == "day":
+        return datetime(value.year, value.month, value.day)
+    elif time_group == "month":
+        return datetime(value.year, value.month, 1)
+    elif time_group == "year":
+        return datetime(value.year, 1, 1)
+    raise ValueError(f"truncate_datetime recieved an invalid time group: {time_group}")
+
+
+def next_bucket(value, time_group):
+    """Returns the first instant of the bucket following the one containing value."""
+    value = truncate_datetime(value, time_group)
+    if time_group == "day":
+        return value + timedelta(days=1)
+    elif time_group == "month":
+        if value.month == 12:
+            return datetime(value.year + 1, 1, 1)
+        return datetime(value.year, value.month + 1, 1)
+    return datetime(value.year + 1, 1, 1)
+
+
+def _bucket_range(start, end, time_group):
+    """Widens the half-open range [start, end) outward to whole buckets."""
+    low = truncate_datetime(start, time_group)
+    high = truncate_datetime(end, time_group)
+    if high < end:
+        high = next_bucket(end, time_group)
+    return low, high
+
+
+def refresh_rollups(session, start, end):
+    """
+    Recomputes every rollup bucket that overlaps the hourly range [start, end).
+
+    The daily rollup is summed from the hourly table, the monthly rollup from the daily one
+    and the yearly rollup from the monthly one, so each level only reads a handful of rows.
+    Each level is rebuilt with a single INSERT ... SELECT, so no rows pass through Python.
+    The caller is responsible for committing the session.
+
+    Args:
+        session (Session): The session to run the refresh in.
+        start (datetime): The first hour that changed.
+        end (datetime): The hour after the last hour that changed.
+
+    Returns:
+        dict: The number of rows written to each rollup, keyed by time group.
+    """
+    written = {}
+    for time_group, rollup in ROLLUP_MODELS.items():
+        source = ROLLUP_SOURCES[time_group]
+        low, high = _bucket_range(start, end, time_group)
+
+        session.query(rollup).filter(
+            rollup.start_dttm >= low, rollup.start_dttm < high
+        ).delete(synchronize_session=False)
+
+        dimensions = [getattr(source, name) for name in ROLLUP_DIMENSIONS]
+        time_bucket = get_time_group_column(source, time_group)
+        summary = apply_time_range(
+            select(
+                time_bucket,
+                *dimensions,
+                func.sum(source.primary_count),
+                func.sum(source.cross_count),
+            ),
+            source,
+            low,
+            high,
+        ).group_by(time_bucket, *dimensions)
+
+        result = session.execute(
+            insert(rollup.__table__).from_select(
+                ["start_dttm", *ROLLUP_DIMENSIONS, "primary_count", "cross_count"],
+                summary,
+            )
+        )
+        written[time_group] = result.rowcount
+    return written
+
+
+def refresh_incremental(session):
+    """
+    Refreshes the rollups from their watermark up to the newest hourly row.
+
+    The most recent daily bucket is always recomputed because it may have been built from
+    a partial day.
+
+    Returns:
+        tuple: The (start, end) hourly range that was refreshed, or None if there is no data.
+    """
+    newest = session.query(func.max(HourlyDownloadData.start_dttm)).scalar()
+    if newest is None:
+        return None
+    start = session.query(func.max(ROLLUP_MODELS["day"].start_dttm)).scalar()
+    if start is None:
+        start = session.query(func.min(HourlyDownloadData.start_dttm)).scalar()
+    end = newest + timedelta(hours=1)
+    refresh_rollups(session, start, end)
+    return start, end
+
+
+def select_source_model(model, columns, time_group=None, start=None, end=None):
+    """
+    Returns the coarsest table able to answer an aggregation of model.
+
+    A rollup can only be used if every grouped column is one of its dimensions, its time grain
+    is at least as fine as the requested time group, and any range boundaries fall on the start
+    of one of its buckets. Without a time group the coarsest such rollup is used, as it holds
+    the fewest rows.
+
+    Args:
+        model (SQLAlchemy Model): The model the request was made against.
+        columns (list): The column names the query groups by. None entries are ignored.
+        time_group (str): The time group being aggregated by, if any.
+        start (datetime): The inclusive lower bound of the requested range, if any.
+        end (datetime): The exclusive upper bound of the requested range, if any.
+
+    Returns:
+        The rollup model to read from, or model itself if no rollup fits.
+    """
+    if not ROLLUPS_ENABLED or model is not HourlyDownloadData:
+        return model
+    if any(column not in ROLLUP_DIMENSIONS for column in columns if column):
+        return model
+
+    grains = list(ROLLUP_MODELS)
+    if time_group is not None:
+        if time_group not in grains:
+            return model
+        grains = grains[: grains.index(time_group) + 1]
+
+    for grain in reversed(grains):
+        if all(
+            bound is None or truncate_datetime(bound, grain) == bound
+            for bound in (start, end)
+        ):
+            return get_rollup_model(grain)
+    return model
+
+
+if __name__ == "__main__":
+    import argparse
+    from api_utils import Session
+
+    parser = argparse.ArgumentParser(description="Maintain the download rollup tables.")
+    parser.add_argument("command", choices=("backfill", "refresh"))
+    parser.add_argument("--start", type=datetime.fromisoformat, help="first changed hour")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="hour after the last change")
+    args = parser.parse_args()
+
+    session = Session()
+    # the refresh must read the newest rows, which replicas may not have yet
+    session.use_primary()
+    try:
+        if args.command == "backfill":
+            args.start = session.query(func.min(HourlyDownloadData.start_dttm)).scalar()
+            args.end = session.query(func.max(HourlyDownloadData.start_dttm)).scalar()
+            if args.end is not None:
+                args.end += timedelta(hours=1)
+        if args.start and args.end:
+            print(f"Refreshed rollups: {refresh_rollups(session, args.start, args.end)}")
+        else:
+            print(f"Refreshed rollups over {refresh_incremental(session)}")
+        session.commit()
+    finally:
+        session.close()
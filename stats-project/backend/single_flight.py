@@ -0,0 +1,159 @@
+"""
+single_flight.py
+
+This module coalesces identical concurrent computations, so that when many identical requests arrive
+at once, the database runs their query once.
+
+Within a process, the first caller for a key computes the result and every caller arriving while it
+runs waits for that result instead of computing it again. Callers can be on different threads and event
+loops, as Flask's async views are, so they wait on a concurrent.futures.Future. An error is shared the
+same way, and the next caller after it tries again.
+
+When COALESCE_DIR is set, computations are also coalesced across the processes of a host, e.g. the
+gunicorn workers: the computing caller of each process takes an exclusive lock on a file named after
+the shared key in that directory, and the first to get it writes its result next to the lock. The
+others then read that result once they get the lock, instead of computing it. Shared keys must change
+whenever the result may, e.g. by including the newest ingested hour; results older than two ingest
+periods are deleted as new ones are written. File locks need fcntl, so this is POSIX only.
+
+Classes:
+    SingleFlight:
+        Runs one computation per key at a time, sharing its result with concurrent callers.
+
+Environment Variables:
+    COALESCE_DIR: A directory on local disk where computations are coalesced across processes.
+        Optional; without it, they are coalesced within each process only.
+
+Usage:
+    Use the module level single_flight instance; api.py coalesces result cache misses with it.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+# shared results older than this are deleted, as no current key can name them
+SHARED_RESULT_MAX_AGE = 2 * 3600
+
+
+class SingleFlight:
+    """
+    Runs one computation per key at a time, sharing its result with concurrent callers.
+
+    Attributes:
+        shared_dir (str): The directory where computations are coalesced across processes, or None.
+        leaders (int): The number of computations run.
+        followers (int): The number of callers answered with another caller's result.
+    """
+
+    def __init__(self, shared_dir=None):
+        if shared_dir and fcntl is None:
+            raise ValueError("COALESCE_DIR needs file locks, which this platform lacks")
+        self.shared_dir = shared_dir
+        self.leaders = 0
+        self.followers = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+
+    async def run(self, key, compute, shared_key=None):
+        """
+        Returns the result of compute, awaiting the call already in flight for key if there is one.
+
+        Args:
+            key (hashable): Identifies the computation within this process.
+            compute (callable): A coroutine function computing the result.
+            shared_key (str): Identifies the computation across processes, as a file name. Results
+                shared across processes must be (body, mimetype) pairs of bytes and str.
+
+        Returns:
+            The result of compute, from this call or a concurrent one.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leading = future is None
+            if leading:
+                future = self._calls[key] = Future()
+                self.leaders += 1
+            else:
+                self.followers += 1
+        if not leading:
+            return await asyncio.wrap_future(future)
+
+        try:
+            if self.shared_dir and shared_key:
+                result = await self._run_shared(shared_key, compute)
+            else:
+                result = await compute()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def _run_shared(self, shared_key, compute):
+        """Computes the result, or reads the one another process computed while holding the lock."""
+        path = os.path.join(self.shared_dir, shared_key)
+        lock_file = open(path + ".lock", "a")
+        try:
+            # blocks until no other process is computing this key
+            await asyncio.to_thread(fcntl.flock, lock_file.fileno(), fcntl.LOCK_EX)
+            shared = self._read(path + ".result")
+            if shared is not None:
+                with self._lock:
+                    self.leaders -= 1
+                    self.followers += 1
+                return shared
+            result = await compute()
+            self._write(path + ".result", result)
+            return result
+        finally:
+            # closing the file releases the lock
+            lock_file.close()
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, "rb") as file:
+                mimetype, body = file.read().split(b"\n", 1)
+        except (FileNotFoundError, ValueError):
+            return None
+        return body, mimetype.decode("utf-8")
+
+    def _write(self, path, result):
+        body, mimetype = result
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(mimetype.encode("utf-8") + b"\n" + body)
+        # readers only ever see a complete result
+        os.replace(temporary_path, path)
+        self._delete_old_results()
+
+    def _delete_old_results(self):
+        cutoff = time.time() - SHARED_RESULT_MAX_AGE
+        for entry in os.scandir(self.shared_dir):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        """Returns the number of computations run and of callers that shared one."""
+        with self._lock:
+            return {"leaders": self.leaders, "followers": self.followers, "in_flight": len(self._calls)}
+
+
+single_flight = SingleFlight(shared_dir=os.getenv("COALESCE_DIR") or None)
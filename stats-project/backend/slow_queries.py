@@ -0,0 +1,225 @@
+"""
+slow_queries.py
+
+This module provides an opt-in log of slow aggregation queries, with the database's plan for each.
+
+When SLOW_QUERY_MS is set, every statement run by query_model, query_rollup, query_global_sum or
+query_todays_downloads (recognised by the query_shape execution option, see metrics.py) that takes at
+least that long is recorded with its SQL, bound parameters and duration in a bounded ring buffer.
+Its plan is then captured in the background, on a connection of its own to the replica that ran the
+statement (see replicas.py), or else to the primary, so the request that ran the query is not delayed:
+    PostgreSQL: EXPLAIN (ANALYZE, BUFFERS), which runs the query again. Set SLOW_QUERY_ANALYZE=0
+        to capture the estimated plan only.
+    MySQL: EXPLAIN.
+    SQLite: EXPLAIN QUERY PLAN.
+
+Plans are captured one at a time; while SLOW_QUERY_EXPLAIN_BACKLOG are waiting, new entries are
+recorded without one, so a burst of slow queries cannot pile EXPLAIN ANALYZE runs onto the database.
+
+The log is served by GET /api/slow_queries.
+
+Classes:
+    SlowQueryLog:
+        A thread-safe ring buffer of slow statements and their plans.
+
+Environment Variables:
+    SLOW_QUERY_MS: Statements taking at least this many milliseconds are recorded. Defaults to 0,
+        which disables the log.
+    SLOW_QUERY_LOG_SIZE: The number of statements kept, newest first. Defaults to 50.
+    SLOW_QUERY_ANALYZE: Whether PostgreSQL plans are captured with ANALYZE and BUFFERS. Defaults to 1.
+    SLOW_QUERY_EXPLAIN_BACKLOG: The most plans waiting to be captured. Defaults to 5.
+
+Usage:
+    Use the module level slow_query_log instance; api_utils gives it the engine plans are captured on.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# the kinds of query_shape recorded, i.e. the aggregation queries of api_utils
+RECORDED_KINDS = ("model", "model_top", "rollup", "global_sum", "todays_downloads")
+
+EXPLAIN_PREFIXES = {
+    "mysql": "EXPLAIN ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+}
+
+
+def explain_prefix(dialect_name, analyze=True):
+    """Returns the statement prefix capturing a plan on the given database, or None if unsupported."""
+    if dialect_name == "postgresql":
+        return "EXPLAIN (ANALYZE, BUFFERS) " if analyze else "EXPLAIN "
+    return EXPLAIN_PREFIXES.get(dialect_name)
+
+
+def _jsonable(value):
+    """Returns a bound parameter value as JSON can hold it."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): _jsonable(item) for key, item in value.items()}
+    return str(value)
+
+
+class SlowQueryLog:
+    """
+    A thread-safe ring buffer of slow statements and their plans.
+
+    Attributes:
+        threshold_ms (float): Statements taking at least this long are recorded; 0 disables the log.
+        max_entries (int): The number of statements kept.
+        analyze (bool): Whether PostgreSQL plans are captured with ANALYZE and BUFFERS.
+        explain_backlog (int): The most plans waiting to be captured.
+    """
+
+    def __init__(self, threshold_ms=0, max_entries=50, analyze=True, explain_backlog=5):
+        self.threshold_ms = threshold_ms
+        self.max_entries = max_entries
+        self.analyze = analyze
+        self.explain_backlog = explain_backlog
+        self._entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+        self._engine = None
+        self._replicas = set()
+        self._executor = None
+        self._executor_pid = None
+        self._waiting = 0
+
+    @property
+    def enabled(self):
+        """Whether slow statements are being recorded."""
+        return self.threshold_ms > 0
+
+    def set_engine(self, engine, replicas=()):
+        """
+        Sets the synchronous engines plans are captured on.
+
+        Args:
+            engine (Engine): The engine capturing the plans of statements run anywhere but on a replica.
+            replicas (list): The replica engines, each capturing the plans of the statements it ran.
+        """
+        self._engine = engine
+        self._replicas = set(replicas)
+
+    def is_slow(self, seconds, shape):
+        """Whether a statement of the given query shape taking seconds should be recorded."""
+        if not self.enabled or not shape:
+            return False
+        return shape.split(":")[0] in RECORDED_KINDS and seconds * 1000 >= self.threshold_ms
+
+    def record(self, statement, parameters, seconds, shape, dialect_name, engine=None):
+        """
+        Records a slow statement and queues the capture of its plan.
+
+        Args:
+            statement (str): The SQL as sent to the driver.
+            parameters: The bound parameters as sent to the driver.
+            seconds (float): How long the statement took.
+            shape (str): The query shape, see metrics.query_shape.
+            dialect_name (str): The database the statement ran on.
+            engine (Engine): The engine the statement ran on. Optional.
+
+        Returns:
+            dict: The new entry. Its 'plan' is filled in once captured.
+        """
+        entry = {
+            "recorded_at": datetime.now(dt_timezone.utc).isoformat(timespec="seconds"),
+            "shape": shape,
+            "duration_ms": round(seconds * 1000, 2),
+            "dialect": dialect_name,
+            "statement": statement,
+            "parameters": _jsonable(parameters),
+            "plan": None,
+            "plan_error": None,
+        }
+        with self._lock:
+            executor = self._get_executor()
+            self._entries.appendleft(entry)
+            prefix = explain_prefix(dialect_name, self.analyze)
+            explain_engine = engine if engine in self._replicas else self._engine
+            if prefix is None:
+                entry["plan_error"] = f"EXPLAIN is not supported on {dialect_name}"
+            elif explain_engine is None:
+                entry["plan_error"] = "No engine to capture the plan on"
+            elif self._waiting >= self.explain_backlog:
+                entry["plan_error"] = "Skipped, too many plans waiting to be captured"
+            else:
+                self._waiting += 1
+                executor.submit(self._explain, explain_engine, entry, prefix, statement, parameters)
+        return entry
+
+    def _get_executor(self):
+        # a forked worker gets its own thread
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-explain")
+            self._executor_pid = os.getpid()
+            self._waiting = 0
+        return self._executor
+
+    def _explain(self, engine, entry, prefix, statement, parameters):
+        """Captures the plan of a recorded statement into its entry."""
+        plan = error = None
+        try:
+            with engine.connect() as connection:
+                with connection.begin() as transaction:
+                    rows = connection.exec_driver_sql(prefix + statement, parameters).fetchall()
+                    # EXPLAIN ANALYZE runs the query; never keep anything it did
+                    transaction.rollback()
+            plan = [" ".join(str(value) for value in row) for row in rows]
+        except Exception as e:
+            error = f"Could not capture the plan: {e}"
+        with self._lock:
+            entry["plan"] = plan
+            entry["plan_error"] = error
+            self._waiting -= 1
+
+    def entries(self):
+        """Returns copies of the recorded entries, newest first."""
+        with self._lock:
+            return [dict(entry) for entry in self._entries]
+
+    def clear(self):
+        """Drops every recorded entry."""
+        with self._lock:
+            self._entries.clear()
+
+
+slow_query_log = SlowQueryLog(
+    threshold_ms=float(os.getenv("SLOW_QUERY_MS", "0")),
+    max_entries=int(os.getenv("SLOW_QUERY_LOG_SIZE", "50")),
+    analyze=os.getenv("SLOW_QUERY_ANALYZE", "1") != "0",
+    explain_backlog=int(os.getenv("SLOW_QUERY_EXPLAIN_BACKLOG", "5")),
+)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if slow_query_log.enabled:
+        conn.info.setdefault("slow_query_start_times", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get("slow_query_start_times")
+    if not start_times:
+        return
+    seconds = time.perf_counter() - start_times.pop()
+    shape = context.execution_options.get("query_shape") if context is not None else None
+    if slow_query_log.is_slow(seconds, shape):
+        slow_query_log.record(statement, parameters, seconds, shape, conn.dialect.name, conn.engine)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    # the statement failed, so after_cursor_execute will not pop its start time
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("slow_query_start_times"):
+        connection.info["slow_query_start_times"].pop()
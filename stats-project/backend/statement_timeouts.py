@@ -0,0 +1,179 @@
+"""
+statement_timeouts.py
+
+This module bounds how long the aggregation queries may run, so that one runaway query cannot hold a
+connection for minutes and starve the pool.
+
+Statements are recognised by their query_shape execution option (see metrics.py). Each shape gets the
+timeout of its most specific entry in STATEMENT_TIMEOUTS, e.g. for "model:country,category:day" the
+first of "model:country,category:day", "model:country,category" and "model" that is listed, or
+STATEMENT_TIMEOUT_MS otherwise. Statements without a shape, such as the writes of ingest.py, are never
+limited. The timeout is enforced by the database:
+    PostgreSQL: SET LOCAL statement_timeout before the statement, which lasts until the end of its
+        transaction; statements without a shape later in the same transaction reset it first.
+    MySQL: A MAX_EXECUTION_TIME optimizer hint added to the SELECT (MySQL 5.7.8 or later).
+    SQLite: A progress handler interrupting the statement once its time is up, for local development
+        and tests. Rows fetched after the statement has started returning them are not limited.
+
+A statement cancelled for exceeding its timeout raises QueryTimeout instead of the driver's error, which
+the API answers with 503 Service Unavailable.
+
+Classes:
+    QueryTimeout:
+        Raised when a statement is cancelled for exceeding its timeout.
+
+Functions:
+    parse_timeouts(value):
+        Parses STATEMENT_TIMEOUTS into a dict of shape prefixes and milliseconds.
+
+    timeout_for(shape):
+        Returns the timeout in milliseconds of a query shape, or 0 for none.
+
+Environment Variables:
+    STATEMENT_TIMEOUT_MS: The timeout of statements with a query shape not listed in STATEMENT_TIMEOUTS.
+        Defaults to 0, no timeout.
+    STATEMENT_TIMEOUTS: Comma separated shape=milliseconds pairs, e.g. "model=20000,rollup=30000,
+        todays_downloads=2000". 0 removes the timeout of a shape. Optional.
+"""
+
+import os
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+# SQLSTATE of a statement cancelled by statement_timeout on PostgreSQL, and MySQL's error number for
+# one cancelled by MAX_EXECUTION_TIME
+POSTGRESQL_QUERY_CANCELED = "57014"
+MYSQL_EXECUTION_TIME_EXCEEDED = 3024
+
+
+class QueryTimeout(Exception):
+    """Raised when a statement is cancelled for exceeding its timeout."""
+
+    def __init__(self, shape, timeout_ms):
+        super().__init__(f"The query took longer than its {timeout_ms} ms budget, try a narrower query")
+        self.shape = shape
+        self.timeout_ms = timeout_ms
+
+
+def parse_timeouts(value):
+    """
+    Parses STATEMENT_TIMEOUTS into a dict of shape prefixes and milliseconds.
+
+    Raises:
+        ValueError: If an entry is not a shape=milliseconds pair.
+    """
+    timeouts = {}
+    for entry in (value or "").split(","):
+        if not entry.strip():
+            continue
+        shape, _, milliseconds = entry.partition("=")
+        if not shape.strip() or not milliseconds.strip().isdigit():
+            raise ValueError(f"Invalid STATEMENT_TIMEOUTS entry, use shape=milliseconds: {entry}")
+        timeouts[shape.strip()] = int(milliseconds)
+    return timeouts
+
+
+DEFAULT_TIMEOUT_MS = int(os.getenv("STATEMENT_TIMEOUT_MS", "0"))
+TIMEOUTS = parse_timeouts(os.getenv("STATEMENT_TIMEOUTS"))
+
+
+def timeout_for(shape):
+    """Returns the timeout in milliseconds of a query shape, or 0 for none."""
+    if not shape:
+        return 0
+    parts = shape.split(":")
+    for length in range(len(parts), 0, -1):
+        prefix = ":".join(parts[:length])
+        if prefix in TIMEOUTS:
+            return TIMEOUTS[prefix]
+    return DEFAULT_TIMEOUT_MS
+
+
+def _run(conn, statement):
+    # on a cursor of its own, as the statement's cursor may be a server-side one
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(statement)
+    finally:
+        cursor.close()
+
+
+def _with_hint(statement, timeout_ms):
+    stripped = statement.lstrip()
+    if not stripped[:6].upper() == "SELECT":
+        return statement
+    return f"SELECT /*+ MAX_EXECUTION_TIME({timeout_ms}) */{stripped[6:]}"
+
+
+@event.listens_for(Engine, "before_cursor_execute", retval=True)
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    shape = context.execution_options.get("query_shape") if context is not None else None
+    timeout_ms = timeout_for(shape)
+    dialect = conn.dialect.name
+
+    if dialect == "postgresql":
+        if timeout_ms:
+            _run(conn, f"SET LOCAL statement_timeout = {timeout_ms}")
+            conn.info["statement_timeout_set"] = True
+        elif conn.info.pop("statement_timeout_set", False):
+            _run(conn, "SET LOCAL statement_timeout TO DEFAULT")
+    elif dialect == "mysql" and timeout_ms:
+        statement = _with_hint(statement, timeout_ms)
+    elif dialect == "sqlite" and timeout_ms:
+        deadline = time.monotonic() + timeout_ms / 1000
+        conn.connection.dbapi_connection.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+        conn.info["statement_deadline"] = True
+
+    if timeout_ms:
+        conn.info["statement_timeout"] = (shape, timeout_ms)
+    return statement, parameters
+
+
+def _clear_sqlite_deadline(conn):
+    if conn.info.pop("statement_deadline", False):
+        conn.connection.dbapi_connection.set_progress_handler(None, 1000)
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.pop("statement_timeout", None)
+    _clear_sqlite_deadline(conn)
+
+
+def _is_timeout(error, dialect):
+    """Whether a driver error is the cancellation of a statement for exceeding its timeout."""
+    if dialect == "postgresql":
+        code = getattr(error, "pgcode", None) or getattr(error, "sqlstate", None)
+        return code == POSTGRESQL_QUERY_CANCELED or "statement timeout" in str(error)
+    if dialect == "mysql":
+        return bool(error.args) and error.args[0] == MYSQL_EXECUTION_TIME_EXCEEDED
+    if dialect == "sqlite":
+        return "interrupted" in str(error)
+    return False
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is None:
+        return None
+    limit = connection.info.pop("statement_timeout", None)
+    _clear_sqlite_deadline(connection)
+    error = exception_context.original_exception
+    if limit is not None and _is_timeout(error, connection.dialect.name):
+        return QueryTimeout(*limit)
+    return None
+
+
+# SET LOCAL ends with the transaction
+@event.listens_for(Engine, "commit")
+@event.listens_for(Engine, "rollback")
+def _end_transaction(conn):
+    conn.info.pop("statement_timeout_set", None)
+
+
+@event.listens_for(Pool, "reset")
+def _reset(dbapi_connection, connection_record):
+    connection_record.info.pop("statement_timeout_set", None)
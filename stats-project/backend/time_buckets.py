@@ -0,0 +1,216 @@
+"""
+time_buckets.py
+
+This module provides the time bucketing used to aggregate data by hour, day, month or year.
+
+Rows are grouped on the start of their time bucket, a single timestamp column, rather than on separate
+extract() values for the year, month and day. On PostgreSQL this is date_trunc(), which the matching
+expression indexes created by migrations.py can serve; the rollup tables store the bucket start
+directly, so grouping them at their own grain needs no function at all. Range filters compare
+start_dttm directly so the planner can use an index range scan.
+
+Classes:
+    TimeBucket:
+        SQL expression truncating a timestamp to the start of its hour, day, month or year.
+
+Functions:
+    get_time_group_column(model, time_group):
+        Returns the expression giving the start of each row's time bucket.
+
+    apply_time_range(query, model, start=None, end=None):
+        Restricts a query to rows whose start_dttm lies in [start, end).
+
+    format_time_group(value, time_group):
+        Formats a bucket start the way the API returns it.
+
+    format_time_groups(values, time_group):
+        Formats a column of bucket starts, each distinct bucket once.
+
+    local_day_range(timezone, local_date):
+        Returns the UTC [start, end) range of a local calendar day.
+
+    sum_by_local_hour(hour_totals, timezone):
+        Sums totals per UTC hour by their hour of the day in a timezone.
+
+Modules:
+    datetime, zoneinfo: Used to convert between UTC hours and local days.
+    sqlalchemy: SQL toolkit and Object-Relational Mapping (ORM) library.
+"""
+
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+from sqlalchemy import DateTime
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.sql.traversals import InternalTraversal
+
+TIME_GROUPS = ("hour", "day", "month", "year")
+
+# strftime/DATE_FORMAT patterns producing the start of each bucket
+# (SQLite buckets match the text format SQLAlchemy stores DateTime values in)
+SQLITE_FORMATS = {
+    "hour": "%Y-%m-%d %H:00:00.000000",
+    "day": "%Y-%m-%d 00:00:00.000000",
+    "month": "%Y-%m-01 00:00:00.000000",
+    "year": "%Y-01-01 00:00:00.000000",
+}
+MYSQL_FORMATS = {
+    "hour": "%Y-%m-%d %H:00:00",
+    "day": "%Y-%m-%d",
+    "month": "%Y-%m-01",
+    "year": "%Y-01-01",
+}
+
+# how each bucket start is written in API responses
+OUTPUT_FORMATS = {
+    "hour": "%Y-%m-%d %H:00:00",
+    "day": "%Y-%m-%d",
+    "month": "%Y-%m-01",
+    "year": "%Y-01-01",
+}
+
+
+class TimeBucket(FunctionElement):
+    """SQL expression truncating a timestamp to the start of its hour, day, month or year."""
+
+    type = DateTime()
+    name = "time_bucket"
+    inherit_cache = True
+    # the time group is compiled into the SQL, so it must be part of the compiled cache key
+    _traverse_internals = FunctionElement._traverse_internals + [("time_group", InternalTraversal.dp_string)]
+
+    def __init__(self, time_group, column):
+        if time_group not in TIME_GROUPS:
+            raise ValueError(f"TimeBucket recieved an invalid time group: {time_group}")
+        self.time_group = time_group
+        super().__init__(column)
+
+
+@compiles(TimeBucket)
+def _compile_time_bucket(element, compiler, **kw):
+    return "date_trunc('%s', %s)" % (
+        element.time_group,
+        compiler.process(element.clauses, **kw),
+    )
+
+
+@compiles(TimeBucket, "mysql")
+def _compile_time_bucket_mysql(element, compiler, **kw):
+    return "CAST(DATE_FORMAT(%s, '%s') AS DATETIME)" % (
+        compiler.process(element.clauses, **kw),
+        MYSQL_FORMATS[element.time_group].replace("%", "%%"),
+    )
+
+
+@compiles(TimeBucket, "sqlite")
+def _compile_time_bucket_sqlite(element, compiler, **kw):
+    return "strftime('%s', %s)" % (
+        SQLITE_FORMATS[element.time_group],
+        compiler.process(element.clauses, **kw),
+    )
+
+
+def get_time_group_column(model, time_group):
+    """
+    Helper function returning the expression giving the start of each row's time bucket.
+
+    Args:
+        model (SQLAlchemy Model): The model to bucket, either the hourly data or a rollup.
+        time_group (str): The time group to bucket by ('hour', 'day', 'month', 'year').
+
+    Returns:
+        An SQLAlchemy column expression labelled 'time_group'.
+
+    Raises:
+        ValueError: If an invalid time group is provided.
+    """
+    if time_group not in TIME_GROUPS:
+        raise ValueError(f"get_time_group_column recieved an invalid time group: {time_group}")
+
+    # rollups already store the start of their bucket
+    if getattr(model, "time_group", None) == time_group:
+        return model.start_dttm.label("time_group")
+    return TimeBucket(time_group, model.start_dttm).label("time_group")
+
+
+def apply_time_range(query, model, start=None, end=None):
+    """
+    Restricts a query to rows whose start_dttm lies in the half-open range [start, end).
+
+    Args:
+        query (Query): The query to restrict.
+        model (SQLAlchemy Model): The model being queried.
+        start (datetime): The inclusive lower bound, or None.
+        end (datetime): The exclusive upper bound, or None.
+
+    Returns:
+        Query: The restricted query.
+    """
+    if start is not None:
+        query = query.filter(model.start_dttm >= start)
+    if end is not None:
+        query = query.filter(model.start_dttm < end)
+    return query
+
+
+def format_time_group(value, time_group):
+    """Formats a bucket start the way the API returns it, e.g. '2024-03-01' for a month."""
+    return value.strftime(OUTPUT_FORMATS[time_group])
+
+
+def format_time_groups(values, time_group):
+    """
+    Formats a column of bucket starts like format_time_group.
+
+    A breakdown by day repeats each day once per group, so each distinct bucket is formatted once
+    and the column is filled in from those.
+
+    Args:
+        values (list): Bucket starts, as returned by the database or the cube.
+        time_group (str): The time group the buckets belong to.
+
+    Returns:
+        list: The formatted buckets, in the order of values.
+    """
+    output_format = OUTPUT_FORMATS[time_group]
+    formatted = {value: value.strftime(output_format) for value in set(values)}
+    return list(map(formatted.__getitem__, values))
+
+
+UTC = ZoneInfo("UTC")
+
+
+def local_day_range(timezone, local_date):
+    """
+    Returns the UTC [start, end) range of a local calendar day, as naive datetimes like start_dttm.
+
+    Comparing start_dttm against this range, rather than converting every row into the timezone,
+    lets the database use an index range scan. Days around a daylight saving change are 23 or 25
+    hours long.
+    """
+    zone = ZoneInfo(timezone)
+    start = datetime.combine(local_date, time(), tzinfo=zone)
+    end = datetime.combine(local_date + timedelta(days=1), time(), tzinfo=zone)
+    return (
+        start.astimezone(UTC).replace(tzinfo=None),
+        end.astimezone(UTC).replace(tzinfo=None),
+    )
+
+
+def sum_by_local_hour(hour_totals, timezone):
+    """
+    Sums totals per UTC hour by their hour of the day in a timezone.
+
+    Args:
+        hour_totals (iterable): Pairs of (naive UTC hour start, total).
+        timezone (str): The IANA timezone to shift the hours into.
+
+    Returns:
+        list: Pairs of (local hour, total) in hour order.
+    """
+    zone = ZoneInfo(timezone)
+    by_hour = {}
+    for hour_start, total in hour_totals:
+        local_hour = hour_start.replace(tzinfo=UTC).astimezone(zone).hour
+        by_hour[local_hour] = by_hour.get(local_hour, 0) + total
+    return sorted(by_hour.items())
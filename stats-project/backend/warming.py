@@ -0,0 +1,192 @@
+"""
+warming.py
+
+This module keeps the responses of the dashboard pages in the result cache, so that no visitor waits
+for a cold aggregation after an hourly ingest.
+
+Without it, result cache entries expire at each ingest boundary and the first request for each query
+afterwards runs the full aggregation. When WARM_CACHE is set, a background thread in each process:
+    1. recomputes every query in DASHBOARD_QUERIES, along with the in-memory cube and today's hourly
+       totals, as soon as the app starts;
+    2. then checks for a new ingested hour every WARM_POLL_SECONDS, and recomputes the queries as soon
+       as one lands, or at the next ingest boundary at the latest;
+    3. swaps the new responses into the result cache at once, followed by the newest ingested hour
+       the ETags are derived from, so every response is consistent with its validators.
+
+While the queries are being recomputed, both caches keep serving their expired entries for up to
+CACHE_STALE_SECONDS (stale-while-revalidate), so requests keep getting the previous hour's responses.
+Responses outside the dashboard set are dropped at the swap and computed on their next request.
+
+The caches are per process, so under gunicorn each worker warms its own; the thread is started by the
+first request a worker handles.
+
+Classes:
+    CacheWarmer:
+        The background thread recomputing the dashboard queries.
+
+Functions:
+    init_app(app):
+        Starts warming the app's caches, if WARM_CACHE is set.
+
+Environment Variables:
+    WARM_CACHE: Set to 1 to warm the dashboard queries in the background. Defaults to 0.
+    WARM_POLL_SECONDS: How often to check for a new ingested hour. Defaults to 60.
+    CACHE_STALE_SECONDS: How long expired responses are still served while warming. Defaults to 900.
+
+Usage:
+    Call init_app(app) from the app factory.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+import api
+from metrics import WARM_FAILURES, WARM_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# what the pages under templates/stats and the React charts (frontend/src/components/charts) request,
+# as /batch queries; the React charts ask for today's downloads in the visitor's timezone, so only
+# UTC can be warmed
+DASHBOARD_QUERIES = [
+    {"endpoint": "get_data", "model": "hourly", "group_by": "country"},
+    {"endpoint": "get_data", "model": "hourly", "group_by": "archive"},
+    {"endpoint": "get_data", "model": "hourly", "group_by": "category"},
+    {"endpoint": "get_data", "model": "hourly", "group_by": "archive", "time_group": "year"},
+    {
+        "endpoint": "get_data",
+        "model": "hourly",
+        "group_by": "archive",
+        "second_group_by": "category",
+        "time_group": "year",
+    },
+    {"endpoint": "get_data", "model": "hourly", "group_by": "country", "format": "columnar"},
+    {"endpoint": "get_data", "model": "hourly", "group_by": "archive", "format": "columnar"},
+    {"endpoint": "get_data", "model": "hourly", "group_by": "category", "format": "columnar"},
+    {"endpoint": "get_global_sum", "model": "hourly", "time_group": "month"},
+    {"endpoint": "get_global_sum", "model": "hourly", "time_group": "month", "format": "columnar"},
+    {"endpoint": "get_todays_downloads", "timezone": "UTC"},
+]
+
+WATERMARK_KEY = ("latest_ingest",)
+
+
+class CacheWarmer:
+    """
+    The background thread recomputing the dashboard queries after each ingest.
+
+    Attributes:
+        app (Flask): The app whose JSON provider serializes the responses.
+        queries (list): The queries kept warm, as /batch queries.
+        poll_seconds (float): How often to check for a new ingested hour.
+        watermark (datetime): The newest ingested hour the cached responses were computed from.
+        expires_at (float): The ingest boundary at which the cached responses expire, as a timestamp.
+    """
+
+    def __init__(self, app, queries=DASHBOARD_QUERIES, poll_seconds=60):
+        self.app = app
+        self.queries = queries
+        self.poll_seconds = poll_seconds
+        self.watermark = None
+        self.expires_at = None
+        self._thread = None
+        self._thread_pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        """Starts the thread in this process, if it is not already running."""
+        with self._lock:
+            # a forked worker gets its own thread
+            if self._thread is not None and self._thread_pid == os.getpid():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name="cache-warmer", daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def stop(self):
+        """Asks the thread to finish after its current refresh."""
+        self._stop.set()
+
+    def run(self):
+        """Refreshes the cache now, then after every new ingest or ingest boundary, until stopped."""
+        while True:
+            try:
+                if self.is_due():
+                    self.refresh()
+            except Exception:
+                # keep polling; the caches fall back to computing on request once the stale entries expire
+                WARM_FAILURES.inc(endpoint="refresh")
+                logger.exception("Cache warming failed")
+            if self._stop.wait(self.poll_seconds):
+                break
+
+    def is_due(self):
+        """Whether a new hour has been ingested, or the cached responses have reached their expiry."""
+        if self.expires_at is None or api.result_cache.clock() >= self.expires_at:
+            return True
+        return api.query_latest_ingest() != self.watermark
+
+    def refresh(self):
+        """
+        Recomputes every dashboard query and swaps the responses into the result cache.
+
+        Returns:
+            dict: The number of responses computed and failed, and the seconds taken.
+        """
+        began = time.perf_counter()
+        watermark = api.query_latest_ingest()
+        api.load_cube()
+        api.load_hourly_totals()
+
+        entries = {}
+        failed = 0
+        with self.app.app_context():
+            for spec in self.queries:
+                try:
+                    key, compute, output_format = api.parse_batch_query(spec)
+                    entries[key] = api.serialize(asyncio.run(compute()), output_format)
+                except Exception:
+                    failed += 1
+                    WARM_FAILURES.inc(endpoint=spec.get("endpoint", "unknown"))
+                    logger.exception("Cache warming failed for %s", spec)
+
+        # responses first: until the watermark moves, clients validate against the previous hour, and
+        # at worst fetch the new responses once more, rather than keep old ones under a new ETag
+        api.result_cache.replace(entries)
+        api.watermark_cache.set(WATERMARK_KEY, watermark)
+        self.watermark = watermark
+        self.expires_at = api.result_cache.next_expiry()
+
+        seconds = time.perf_counter() - began
+        WARM_SECONDS.observe(seconds)
+        return {"computed": len(entries), "failed": failed, "seconds": seconds}
+
+
+def _ensure_started():
+    # gunicorn forks its workers after loading the app, and threads do not survive a fork
+    warmer.start()
+
+
+warmer = None
+
+
+def init_app(app):
+    """
+    Starts warming the app's caches in the background, if WARM_CACHE is set.
+
+    Returns:
+        CacheWarmer: The warmer, or None if warming is disabled.
+    """
+    global warmer
+    if os.getenv("WARM_CACHE", "0") != "1":
+        return None
+    stale_seconds = int(os.getenv("CACHE_STALE_SECONDS", "900"))
+    api.result_cache.max_stale = stale_seconds
+    api.watermark_cache.max_stale = stale_seconds
+    warmer = CacheWarmer(app, poll_seconds=float(os.getenv("WARM_POLL_SECONDS", "60")))
+    app.before_request(_ensure_started)
+    return warmer
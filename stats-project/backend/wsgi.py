@@ -0,0 +1,10 @@
+# backend/wsgi.py
+#
+# Production entry point. Serve with gunicorn, which reads its settings from gunicorn.conf.py:
+#
+#     gunicorn -c gunicorn.conf.py wsgi:app
+
+import os
+from factory import create_app
+
+app = create_app(os.environ.get("APP_CONFIG", "production"))
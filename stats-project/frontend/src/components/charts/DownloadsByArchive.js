@@ -1,5 +1,7 @@
 import { useEffect, useRef, useState } from 'react';
 import Plotly from 'plotly.js-dist';
+import { fetchBatched } from '../../utils/batch';
+import { decodeColumns } from '../../utils/columnar';
 
 const DownloadsByArchive = () => {
   const chartRef = useRef(null);
@@ -7,16 +9,9 @@ const DownloadsByArchive = () => {
   const [error, setError] = useState(false);
 
   useEffect(() => {
-    fetch('http://127.0.0.1:8080/api/get_data?model=hourly&group_by=archive') // Change me for production!
-      .then(response => {
-        if (!response.ok) {
-          throw new Error('Network response was not ok ' + response.statusText);
-        }
-        return response.json();
-      })
-      .then(data => {
-        const archives = data.map(d => d.archive);
-        const totals = data.map(d => d.data);
+    fetchBatched('get_data', { model: 'hourly', group_by: 'archive', format: 'columnar' })
+      .then(payload => {
+        const { archive: archives, data: totals } = decodeColumns(payload);
 
         const getColorMap = (archives) => {
           const colors = [
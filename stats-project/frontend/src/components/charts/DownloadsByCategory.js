@@ -1,5 +1,7 @@
 import { useEffect, useRef, useState } from 'react';
 import Plotly from 'plotly.js-dist';
+import { fetchBatched } from '../../utils/batch';
+import { decodeColumns } from '../../utils/columnar';
 
 const DownloadsByCategory = () => {
   const chartRef = useRef(null);
@@ -7,18 +9,11 @@ const DownloadsByCategory = () => {
   const [error, setError] = useState(false);
 
   useEffect(() => {
-    fetch('http://127.0.0.1:8080/api/get_data?model=hourly&group_by=category') // Change for production
-      .then(response => {
-        if (!response.ok) {
-          throw new Error('Network response was not ok ' + response.statusText);
-        }
-        return response.json();
-      })
-      .then(data => {
+    fetchBatched('get_data', { model: 'hourly', group_by: 'category', format: 'columnar' })
+      .then(payload => {
         const extractArchive = category => category.split('.')[0];
 
-        const categories = data.map(d => d.category);
-        const totals = data.map(d => d.data);
+        const { category: categories, data: totals } = decodeColumns(payload);
         const archives = categories.map(extractArchive);
 
         const archiveColors = {
@@ -1,5 +1,7 @@
 import { useEffect, useRef, useState } from 'react';
 import Plotly from 'plotly.js-dist';
+import { fetchBatched } from '../../utils/batch';
+import { decodeColumns } from '../../utils/columnar';
 
 const DownloadsByCountry = () => {
   const chartRef = useRef(null);
@@ -7,16 +9,9 @@ const DownloadsByCountry = () => {
   const [error, setError] = useState(false);
 
   useEffect(() => {
-    fetch('http://127.0.0.1:8080/api/get_data?model=hourly&group_by=country') // Update this in production
-      .then(response => {
-        if (!response.ok) {
-          throw new Error('Network response was not ok');
-        }
-        return response.json();
-      })
-      .then(data => {
-        const countries = data.map(d => d.country);
-        const totals = data.map(d => d.data);
+    fetchBatched('get_data', { model: 'hourly', group_by: 'country', format: 'columnar' })
+      .then(payload => {
+        const { country: countries, data: totals } = decodeColumns(payload);
 
         const trace = {
           type: 'choropleth',
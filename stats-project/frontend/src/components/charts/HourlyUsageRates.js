@@ -1,5 +1,6 @@
 import { useEffect, useRef, useState } from 'react';
 import Plotly from 'plotly.js-dist';
+import { fetchBatched } from '../../utils/batch';
 
 const HourlyUsage = () => {
   const chartRef = useRef(null);
@@ -12,13 +13,7 @@ const HourlyUsage = () => {
     const userTimezone = Intl.DateTimeFormat().resolvedOptions().timeZone;
     setTimezone(userTimezone);
 
-    fetch(`http://127.0.0.1:8080/api/get_todays_downloads?model=hourly&timezone=${encodeURIComponent(userTimezone)}`)
-      .then(response => {
-        if (!response.ok) {
-          throw new Error('Network response was not ok');
-        }
-        return response.json();
-      })
+    fetchBatched('get_todays_downloads', { model: 'hourly', timezone: userTimezone })
       .then(data => {
         if (data.length === 0) {
           throw new Error('No data available');
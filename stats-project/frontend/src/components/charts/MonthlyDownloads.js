@@ -1,5 +1,7 @@
 import { useEffect, useRef, useState } from 'react';
 import Plotly from 'plotly.js-dist';
+import { fetchBatched } from '../../utils/batch';
+import { decodeColumns } from '../../utils/columnar';
 
 const MonthlyDownloads = () => {
   const chartRef = useRef(null);
@@ -7,20 +9,17 @@ const MonthlyDownloads = () => {
   const [error, setError] = useState(false);
 
   useEffect(() => {
-    fetch(`http://127.0.0.1:8080/api/get_global_sum?model=hourly&time_group=month`)
-      .then(response => {
-        if (!response.ok) throw new Error('Network response was not ok');
-        return response.json();
-      })
-      .then(data => {
+    fetchBatched('get_global_sum', { model: 'hourly', time_group: 'month', format: 'columnar' })
+      .then(payload => {
+        const { time_group: timeGroups, total_sum: totalSums } = decodeColumns(payload);
+
         const formatISOToMonthYear = (isoString) => {
           const date = new Date(isoString);
           const options = { year: 'numeric', month: 'long' };
           return date.toLocaleDateString('en-US', options);
         };
 
-        const formattedDates = data.map(d => formatISOToMonthYear(d.time_group));
-        const totalSums = data.map(d => d.total_sum);
+        const formattedDates = timeGroups.map(formatISOToMonthYear);
 
         const trace = {
           x: formattedDates,
@@ -0,0 +1,47 @@
+// Collects the stats API queries made while a page renders and sends them as one /api/batch request.
+// fetchBatched resolves with the same data the matching GET endpoint would return.
+const API_URL = 'http://127.0.0.1:8080/api'; // Change me for production!
+const BATCH_MAX_QUERIES = 20; // matches the server's limit
+
+let pending = [];
+
+const sendBatch = (queued) => {
+  fetch(`${API_URL}/batch`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ queries: queued.map(({ query }) => query) }),
+  })
+    .then(response => {
+      if (!response.ok) {
+        throw new Error('Network response was not ok');
+      }
+      return response.json();
+    })
+    .then(({ results }) => {
+      results.forEach((result, i) => {
+        if (result.status === 200) {
+          queued[i].resolve(result.data);
+        } else {
+          queued[i].reject(new Error(result.error));
+        }
+      });
+    })
+    .catch(error => queued.forEach(({ reject }) => reject(error)));
+};
+
+const flush = () => {
+  const queued = pending;
+  pending = [];
+  for (let i = 0; i < queued.length; i += BATCH_MAX_QUERIES) {
+    sendBatch(queued.slice(i, i + BATCH_MAX_QUERIES));
+  }
+};
+
+export const fetchBatched = (endpoint, params = {}) =>
+  new Promise((resolve, reject) => {
+    pending.push({ query: { endpoint, ...params }, resolve, reject });
+    // wait for the other charts rendering in this pass to queue their queries
+    if (pending.length === 1) {
+      setTimeout(flush, 0);
+    }
+  });
@@ -0,0 +1,10 @@
+// Decodes responses requested with format=columnar from the stats API.
+// Each field arrives as one array; dimension fields hold indexes into a dictionary of distinct values.
+export const decodeColumns = (payload) => {
+  const columns = {};
+  Object.entries(payload.columns).forEach(([name, values]) => {
+    const dictionary = payload.dictionaries[name];
+    columns[name] = dictionary ? values.map(code => dictionary[code]) : values;
+  });
+  return columns;
+};
@@ -0,0 +1,265 @@
+"""
+benchmark.py
+
+Measures the latency percentiles and throughput of every api_utils query and /api endpoint against a
+database of synthetic data, so performance changes can be compared between branches.
+
+Each case is run --warmup times untimed, then --runs times one after another for its p50, p95, p99 and
+max latency, then --runs times again spread over --concurrency threads for its throughput. Endpoints are
+measured twice: "cold" clears the result cache before every request so the query runs each time, and
+"warm" is served from the cache. The in-memory cube and live totals are loaded as the app loads them,
+so set CUBE_DAYS to benchmark with the cube.
+
+Results can be saved with --json and compared with a saved run with --compare: any case whose p50
+grew by more than --threshold is reported, and the script exits with status 1, so a CI job can run it
+on both sides of a pull request.
+
+Usage:
+    python benchmark.py [--url sqlite:////tmp/stats_bench.db] [--generate] [--years 3] [--rows-per-hour 200]
+        [--runs 30] [--warmup 3] [--concurrency 4] [--only get_data] [--json results.json]
+        [--compare baseline.json] [--threshold 0.2]
+
+    --generate (re)loads the database with synthetic_data.py first; otherwise the database must already
+    hold data. --only runs the cases whose name contains the given text.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_DIR), "backend"))
+sys.path.insert(0, TESTS_DIR)
+
+import synthetic_data  # noqa: E402
+
+
+def percentile(timings, fraction):
+    """Returns the value below which the given fraction of the sorted timings fall."""
+    index = max(0, min(len(timings) - 1, int(round(fraction * len(timings))) - 1))
+    return timings[index]
+
+
+def measure(run, runs, warmup, concurrency):
+    """
+    Times one case.
+
+    Returns:
+        dict: p50, p95, p99, max and mean latency in milliseconds, and throughput in calls per second.
+    """
+    for _ in range(warmup):
+        run()
+
+    timings = []
+    for _ in range(runs):
+        began = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - began) * 1000)
+    timings.sort()
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(run) for _ in range(runs)]:
+            future.result()
+    elapsed = time.perf_counter() - began
+
+    return {
+        "p50": statistics.median(timings),
+        "p95": percentile(timings, 0.95),
+        "p99": percentile(timings, 0.99),
+        "max": timings[-1],
+        "mean": statistics.fmean(timings),
+        "throughput": runs / elapsed,
+    }
+
+
+def query_cases(api_utils):
+    """Returns (name, callable) pairs calling each api_utils query."""
+    now = datetime.now(dt_timezone.utc).replace(tzinfo=None, minute=0, second=0, microsecond=0)
+    month_ago = now - timedelta(days=30)
+    top = {"country": ["united states", "china", "india"]}
+    model = "hourly"
+
+    def stream():
+        for _ in api_utils.stream_model(model, "country", time_group="day", start=month_ago):
+            pass
+
+    return [
+        ("query_model country", lambda: api_utils.query_model(model, "country")),
+        ("query_model country by month", lambda: api_utils.query_model(model, "country", time_group="month")),
+        ("query_model category, download_type", lambda: api_utils.query_model(model, "category", "download_type")),
+        ("query_model country by day, last 30 days",
+            lambda: api_utils.query_model(model, "country", time_group="day", start=month_ago)),
+        ("query_model category, filtered by country",
+            lambda: api_utils.query_model(model, "category", filters=top)),
+        ("query_model_columns country by day",
+            lambda: api_utils.query_model_columns(model, "country", time_group="day")),
+        ("stream_model country by day, last 30 days", stream),
+        ("query_rollup archive, category", lambda: api_utils.query_rollup(model, ["archive", "category"])),
+        ("query_rollup archive, category by month",
+            lambda: api_utils.query_rollup(model, ["archive", "category"], time_group="month")),
+        ("query_global_sum by month", lambda: api_utils.query_global_sum(model, "month")),
+        ("query_global_sum by day", lambda: api_utils.query_global_sum(model, "day")),
+        ("query_global_sum by hour, last 30 days",
+            lambda: api_utils.query_global_sum(model, "hour", start=month_ago)),
+        ("query_global_sum by day, filtered by country",
+            lambda: api_utils.query_global_sum(model, "day", filters=top)),
+        ("query_todays_downloads UTC", lambda: api_utils.query_todays_downloads("UTC")),
+        ("query_todays_downloads America/New_York",
+            lambda: api_utils.query_todays_downloads("America/New_York")),
+    ]
+
+
+ENDPOINTS = [
+    ("GET get_data country", "/api/get_data?model=hourly&group_by=country"),
+    ("GET get_data country by month", "/api/get_data?model=hourly&group_by=country&time_group=month"),
+    ("GET get_data category, download_type",
+        "/api/get_data?model=hourly&group_by=category&second_group_by=download_type"),
+    ("GET get_data country by day, columnar",
+        "/api/get_data?model=hourly&group_by=country&time_group=day&format=columnar"),
+    ("GET get_data country by day, streamed",
+        "/api/get_data?model=hourly&group_by=country&time_group=day&stream=true"),
+    ("GET get_data rollup archive, category", "/api/get_data?model=hourly&rollup=archive,category"),
+    ("GET get_global_sum by month", "/api/get_global_sum?model=hourly&time_group=month"),
+    ("GET get_global_sum by day", "/api/get_global_sum?model=hourly&time_group=day"),
+    ("GET get_todays_downloads", "/api/get_todays_downloads?timezone=America/New_York"),
+]
+
+BATCH_BODY = {
+    "queries": [
+        {"endpoint": "get_data", "model": "hourly", "group_by": "country", "time_group": "month"},
+        {"endpoint": "get_data", "model": "hourly", "group_by": "category"},
+        {"endpoint": "get_data", "model": "hourly", "group_by": "download_type", "time_group": "month"},
+        {"endpoint": "get_global_sum", "model": "hourly", "time_group": "month"},
+        {"endpoint": "get_todays_downloads", "timezone": "UTC"},
+    ]
+}
+
+
+def endpoint_cases(app, api):
+    """Returns (name, callable) pairs requesting each /api endpoint, cold and warm."""
+
+    def request(url, cold):
+        def run():
+            if cold:
+                api.result_cache.clear()
+            if url == "/api/batch":
+                response = app.test_client().post(url, json=BATCH_BODY)
+            else:
+                response = app.test_client().get(url)
+            response.get_data()
+            if response.status_code != 200:
+                raise RuntimeError(f"{url} returned {response.status_code}")
+        return run
+
+    cases = []
+    for name, url in ENDPOINTS + [("POST batch of 5", "/api/batch")]:
+        cases.append((f"{name} (cold)", request(url, True)))
+        # streamed responses are never cached
+        if "stream=true" not in url:
+            cases.append((f"{name} (warm)", request(url, False)))
+    return cases
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints the p50 change of each case against a saved run.
+
+    Returns:
+        list: The names of the cases whose p50 grew by more than threshold.
+    """
+    previous = {case["name"]: case for case in baseline["cases"]}
+    regressions = []
+    print(f"\nCompared with {baseline.get('created', 'the baseline')}:")
+    for case in results["cases"]:
+        before = previous.get(case["name"])
+        if before is None:
+            continue
+        change = case["p50"] / before["p50"] - 1 if before["p50"] else 0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(case["name"])
+        print(f"  {case['name']:<55} {before['p50']:9.2f} -> {case['p50']:9.2f} ms ({change:+.0%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=synthetic_data.DEFAULT_URL)
+    parser.add_argument("--generate", action="store_true", help="load synthetic data first")
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--rows-per-hour", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--only", help="only run cases whose name contains this text")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="compare with the results saved in this file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p50 growth reported as a regression")
+    args = parser.parse_args()
+
+    # api_utils creates its engine on import
+    os.environ["DATABASE_URI"] = args.url
+    from sqlalchemy import create_engine
+    if args.generate:
+        summary = synthetic_data.load(
+            create_engine(args.url), args.years, args.rows_per_hour, rollups=True, log=lambda line: None
+        )
+        print(f"Loaded {summary['rows']} rows in {summary['seconds']:.1f}s")
+
+    import api
+    import api_utils
+    from factory import create_app
+
+    app = create_app("production")
+    with api_utils.Session() as session:
+        row_count = session.query(api_utils.func.count()).select_from(api_utils.HourlyDownloadData).scalar()
+    print(f"{row_count} rows in hourly_download_data on {api_utils.engine.dialect.name}")
+    if not row_count:
+        sys.exit("The database is empty: pass --generate to load synthetic data.")
+
+    cases = query_cases(api_utils) + endpoint_cases(app, api)
+    if args.only:
+        cases = [(name, run) for name, run in cases if args.only in name]
+
+    results = {
+        "created": datetime.now(dt_timezone.utc).isoformat(timespec="seconds"),
+        "dialect": api_utils.engine.dialect.name,
+        "rows": row_count,
+        "python": platform.python_version(),
+        "runs": args.runs,
+        "concurrency": args.concurrency,
+        "cube_days": os.getenv("CUBE_DAYS", "0"),
+        "cases": [],
+    }
+    print(f"\n{'case':<55} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9} {'per sec':>9}")
+    for name, run in cases:
+        timing = measure(run, args.runs, args.warmup, args.concurrency)
+        results["cases"].append({"name": name, **timing})
+        print(
+            f"{name:<55} {timing['p50']:9.2f} {timing['p95']:9.2f} {timing['p99']:9.2f} "
+            f"{timing['max']:9.2f} {timing['throughput']:9.1f}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"\nResults written to {args.json}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
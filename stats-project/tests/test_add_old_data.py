@@ -0,0 +1,74 @@
+import json
+import logging
+import os
+
+import add_old_data
+
+
+def write_series(directory, name, series):
+    path = directory / f"{name}_data.json"
+    path.write_text(json.dumps(series))
+    return path
+
+
+def test_inject_old_data_merges_and_prefers_live(tmp_path, monkeypatch):
+    """Test the historical series is merged in time order, with live periods taking precedence."""
+    monkeypatch.setattr(add_old_data, "OLD_DATA_DIR", str(tmp_path))
+    write_series(
+        tmp_path,
+        "monthly",
+        [
+            {"time_group": "2023-02-01", "total_sum": 2},
+            {"time_group": "2023-01-01", "total_sum": 1},
+            {"time_group": "2023-03-01", "total_sum": 3},
+        ],
+    )
+    live = [
+        {"total_sum": 30, "time_group": "2023-03-01"},
+        {"total_sum": 40, "time_group": "2023-04-01"},
+    ]
+
+    merged = add_old_data.inject_old_data(live, "monthly")
+
+    assert merged == [
+        {"time_group": "2023-01-01", "total_sum": 1},
+        {"time_group": "2023-02-01", "total_sum": 2},
+        {"total_sum": 30, "time_group": "2023-03-01"},
+        {"total_sum": 40, "time_group": "2023-04-01"},
+    ]
+    assert len(live) == 2  # the live result is not modified
+
+
+def test_load_old_data_reloads_on_change(tmp_path, monkeypatch):
+    """Test a series is held in memory and only re-read once its file changes."""
+    monkeypatch.setattr(add_old_data, "OLD_DATA_DIR", str(tmp_path))
+    path = write_series(tmp_path, "yearly", [{"time_group": "2020-01-01", "total_sum": 5}])
+
+    first = add_old_data.load_old_data("yearly")
+    assert first == (("2020-01-01", 5),)
+    assert add_old_data.load_old_data("yearly") is first
+
+    write_series(tmp_path, "yearly", [{"time_group": "2020-01-01", "total_sum": 6}])
+    mtime = os.path.getmtime(path) + 10
+    os.utime(path, (mtime, mtime))
+    assert add_old_data.load_old_data("yearly") == (("2020-01-01", 6),)
+
+
+def test_inject_old_data_skips_invalid_file(tmp_path, monkeypatch):
+    """Test an invalid file leaves the live result unchanged."""
+    monkeypatch.setattr(add_old_data, "OLD_DATA_DIR", str(tmp_path))
+    (tmp_path / "monthly_data.json").write_text("not json")
+    live = [{"total_sum": 1, "time_group": "2024-01-01"}]
+
+    assert add_old_data.inject_old_data(live, "monthly") == live
+
+
+def test_missing_file_is_reported_once(tmp_path, monkeypatch, caplog):
+    """Test a missing file is logged on the first lookup only, not on every request."""
+    monkeypatch.setattr(add_old_data, "OLD_DATA_DIR", str(tmp_path))
+    live = [{"total_sum": 1, "time_group": "2024-01-01"}]
+
+    with caplog.at_level(logging.WARNING, logger="add_old_data"):
+        for _ in range(3):
+            assert add_old_data.inject_old_data(live, "monthly") == live
+    assert len([record for record in caplog.records if "not found" in record.getMessage()]) == 1
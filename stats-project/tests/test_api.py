@@ -1,3 +1,35 @@
+import time
+
+import pytest
+
+
+@pytest.fixture
+def fake_queries(monkeypatch):
+    """
+    Fixture clearing the API's caches, with no data ingested, and returning a helper replacing one of its
+    async queries with a fake, e.g. fake_queries("query_model_async", rows). The arguments of every fake
+    call are recorded in fake_queries.calls as (args, kwargs).
+    """
+    import api
+
+    calls = []
+
+    def fake(name, result=(), delay=0):
+        async def query(*args, **kwargs):
+            calls.append((args, kwargs))
+            if delay:
+                time.sleep(delay)
+            return list(result)
+
+        monkeypatch.setattr(api, name, query)
+
+    fake.calls = calls
+    monkeypatch.setattr(api, "query_latest_ingest", lambda: None)
+    api.watermark_cache.clear()
+    api.result_cache.clear()
+    return fake
+
+
 def test_get_data_missing_params(client):
     """Test /get_data with missing required parameters."""
     response = client.get("/api/get_data")
@@ -9,3 +41,172 @@ def test_get_global_sum_invalid_time_group(client):
     response = client.get("/api/get_global_sum?model=test_model&time_group=invalid")
     assert response.status_code == 400
     assert response.get_json() == {"error": "Invalid time_group, use year, month, or day"}
+
+def test_get_data_not_modified(client, monkeypatch, fake_queries):
+    """Test /get_data answers a matching If-None-Match with a 304 without querying."""
+    from datetime import datetime
+    import api
+
+    monkeypatch.setattr(api, "query_latest_ingest", lambda: datetime(2024, 3, 25, 14))
+    fake_queries("query_model_async")
+
+    url = "/api/get_data?model=hourly&group_by=country"
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers["Last-Modified"] == "Mon, 25 Mar 2024 15:00:00 GMT"
+
+    api.result_cache.clear()
+    etag = response.headers["ETag"]
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert client.get(url, headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+    assert len(fake_queries.calls) == 1
+
+def test_get_data_passes_filters(client, fake_queries):
+    """Test /get_data parses the range and dimension filters before querying."""
+    from datetime import datetime
+
+    fake_queries("query_model_async")
+    calls = fake_queries.calls
+
+    response = client.get(
+        "/api/get_data?model=hourly&group_by=category&start=2024-03-01"
+        "&category=cs.*,math.AG&country=United States"
+    )
+    assert response.status_code == 200
+    assert calls == [
+        (
+            (
+                "hourly",
+                "category",
+                None,
+                None,
+                datetime(2024, 3, 1),
+                None,
+                {"category": ["cs.*", "math.AG"], "country": ["united states"]},
+            ),
+            {},
+        )
+    ]
+
+    response = client.get("/api/get_data?model=hourly&group_by=category&archive=,")
+    assert response.status_code == 400
+
+    calls.clear()
+    response = client.get("/api/get_data?model=hourly&group_by=category&start=2024-03-01T01:00%2B01:00")
+    assert response.status_code == 200
+    assert calls[0][0][4] == datetime(2024, 3, 1)
+    response = client.get("/api/get_data?model=hourly&group_by=category&start=2024-03-02&end=2024-03-01")
+    assert response.status_code == 400
+
+def test_get_data_streams_rows(client, monkeypatch, fake_queries):
+    """Test /get_data streams NDJSON and chunked JSON arrays across batches."""
+    import api
+
+    rows = [{"country": name, "data": i} for i, name in enumerate(["Gb", "Jp", "Us"])]
+    monkeypatch.setattr(api, "stream_model", lambda *args: iter(rows))
+    monkeypatch.setattr(api, "STREAM_BATCH_SIZE", 2)
+
+    response = client.get("/api/get_data?model=hourly&group_by=country&format=ndjson")
+    assert response.mimetype == "application/x-ndjson"
+    assert response.get_data(as_text=True).splitlines() == [
+        '{"country":"Gb","data":0}',
+        '{"country":"Jp","data":1}',
+        '{"country":"Us","data":2}',
+    ]
+
+    response = client.get("/api/get_data?model=hourly&group_by=country&stream=true")
+    assert response.get_json() == rows
+
+def test_batch_runs_each_distinct_query_once(client, fake_queries):
+    """Test /batch answers every query in order, sharing the cache with the GET endpoints."""
+    fake_queries("query_model_async", [{"country": "Gb", "data": 1}])
+    fake_queries("query_global_sum_async", [{"total_sum": 5, "time_group": "2024-03-01"}])
+    calls = fake_queries.calls
+
+    by_country = {"endpoint": "get_data", "model": "hourly", "group_by": "country"}
+    response = client.post(
+        "/api/batch",
+        json={
+            "queries": [
+                by_country,
+                {"endpoint": "get_global_sum", "model": "hourly", "time_group": "month"},
+                by_country,
+            ]
+        },
+    )
+    assert response.status_code == 200
+    assert response.get_json() == {
+        "results": [
+            {"status": 200, "data": [{"country": "Gb", "data": 1}]},
+            {"status": 200, "data": [{"total_sum": 5, "time_group": "2024-03-01"}]},
+            {"status": 200, "data": [{"country": "Gb", "data": 1}]},
+        ]
+    }
+    assert len(calls) == 2
+
+    # the GET request for the same query is a cache hit
+    assert client.get("/api/get_data?model=hourly&group_by=country").get_json() == [
+        {"country": "Gb", "data": 1}
+    ]
+    assert len(calls) == 2
+
+    response = client.post(
+        "/api/batch",
+        json={"queries": [{"endpoint": "get_data", "model": "hourly"}, by_country]},
+    )
+    assert response.get_json()["results"][0] == {
+        "status": 400,
+        "error": "Missing required parameters",
+    }
+    assert response.get_json()["results"][1]["status"] == 200
+
+    assert client.post("/api/batch", json={"queries": []}).status_code == 400
+
+def test_get_todays_downloads_accepts_any_iana_timezone(client, monkeypatch, fake_queries):
+    """Test /get_todays_downloads answers from the hourly totals for any IANA timezone."""
+    import api
+    import api_utils
+
+    monkeypatch.setattr(api, "load_hourly_totals", lambda: None)
+    monkeypatch.setattr(
+        api_utils, "live_todays_downloads", lambda tz: [{"hour": 9, "total_primary": 3}]
+    )
+
+    response = client.get("/api/get_todays_downloads?timezone=Europe/Paris")
+    assert response.status_code == 200
+    assert response.get_json() == [{"hour": 9, "total_primary": 3}]
+
+    response = client.get("/api/get_todays_downloads?timezone=Mars/Olympus_Mons")
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid timezone 'Mars/Olympus_Mons'"}
+
+def test_get_data_validates_limit(client, fake_queries):
+    """Test /get_data passes limit, order and other to query_model, and rejects invalid combinations."""
+    fake_queries("query_model_async")
+
+    response = client.get("/api/get_data?model=hourly&group_by=country&limit=10&other=true")
+    assert response.status_code == 200
+    assert [kwargs for _, kwargs in fake_queries.calls] == [{"limit": 10, "order": "desc", "other": True}]
+
+    for query in ("limit=0", "limit=ten", "limit=5&order=up", "other=true", "limit=5&stream=true",
+                  "limit=5&rollup=archive,category"):
+        response = client.get(f"/api/get_data?model=hourly&group_by=country&{query}")
+        assert response.status_code == 400, query
+
+def test_identical_concurrent_requests_query_once(app, fake_queries):
+    """Test identical requests missing the cache together wait for one query."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    fake_queries("query_model_async", [{"country": "Gb", "data": 1}], delay=0.2)
+
+    def get(_):
+        return app.test_client().get("/api/get_data?model=hourly&group_by=country").get_json()
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        results = list(executor.map(get, range(6)))
+    assert results == [[{"country": "Gb", "data": 1}]] * 6
+    assert len(fake_queries.calls) == 1
+
+    stats = app.test_client().get("/api/cache_stats").get_json()
+    assert stats["replicas"] == {}
@@ -0,0 +1,50 @@
+from datetime import datetime
+
+from api_utils import format_model_columns, format_model_rows, format_rollup_rows, title_countries
+
+
+def test_title_countries():
+    """Test country names are capitalized, and rolled up None values are kept."""
+    assert title_countries(["united states", None, "(unknown country)", "united states"]) == [
+        "United States",
+        None,
+        "(Unknown Country)",
+        "United States",
+    ]
+
+
+def test_format_model_rows_and_columns():
+    """Test rows are formatted with the fields in API order, as dicts or as columns."""
+    rows = [
+        ("united states", 5, "pdf", datetime(2024, 3, 1, 5)),
+        ("japan", 2, "html", datetime(2024, 3, 2, 7)),
+    ]
+    formatted = format_model_rows(rows, "country", "download_type", "day")
+    assert formatted == [
+        {"country": "United States", "data": 5, "download_type": "pdf", "time_group": "2024-03-01"},
+        {"country": "Japan", "data": 2, "download_type": "html", "time_group": "2024-03-02"},
+    ]
+    assert list(formatted[0]) == ["country", "data", "download_type", "time_group"]
+
+    assert format_model_columns(rows, "country", "download_type", "day") == {
+        "country": ["United States", "Japan"],
+        "data": [5, 2],
+        "download_type": ["pdf", "html"],
+        "time_group": ["2024-03-01", "2024-03-02"],
+    }
+    assert format_model_rows([], "country") == []
+    assert format_model_columns([], "country", time_group="day") == {"country": [], "data": [], "time_group": []}
+
+
+def test_format_rollup_rows():
+    """Test rollup rows get their level from the GROUPING() bitmask, with rolled up values kept as None."""
+    rows = [
+        ("cs", "united states", 5, 0),
+        ("cs", None, 5, 1),
+        (None, None, 5, 3),
+    ]
+    assert format_rollup_rows(rows, ["archive", "country"]) == [
+        {"archive": "cs", "country": "United States", "data": 5, "level": 2},
+        {"archive": "cs", "country": None, "data": 5, "level": 1},
+        {"archive": None, "country": None, "data": 5, "level": 0},
+    ]
@@ -0,0 +1,71 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import api_utils
+import async_queries
+from models import Base, HourlyDownloadData
+
+
+def test_async_queries_fall_back_to_threads(monkeypatch):
+    """Test the async queries run the synchronous ones when no asyncio engine is configured."""
+    monkeypatch.setattr(async_queries, "ASYNC_DATABASE_URL", None)
+    monkeypatch.setattr(api_utils, "query_model", lambda *args: [{"args": args}])
+    monkeypatch.setattr(api_utils, "query_global_sum", lambda *args: [{"sum": args}])
+
+    async def both():
+        return await asyncio.gather(
+            async_queries.query_model_async("hourly", "country"),
+            async_queries.query_global_sum_async("hourly", "month"),
+        )
+
+    by_country, by_month = asyncio.run(both())
+    assert by_country == [{"args": ("hourly", "country", None, None, None, None, None)}]
+    assert by_month == [{"sum": ("hourly", "month", None, None, None)}]
+
+
+def test_async_queries_use_asyncio_engine(tmp_path, monkeypatch):
+    """Test the async queries build the same SQL on the asyncio engine."""
+    pytest.importorskip("aiosqlite")
+    path = tmp_path / "stats.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session, session.begin():
+        session.add_all(
+            [
+                HourlyDownloadData(
+                    country=country,
+                    download_type="pdf",
+                    archive="cs",
+                    category=category,
+                    primary_count=count,
+                    cross_count=0,
+                    start_dttm=start_dttm,
+                )
+                for country, category, count, start_dttm in [
+                    ("united states", "cs.AI", 1, datetime(2024, 3, 30, 23)),
+                    ("united states", "cs.LG", 2, datetime(2024, 4, 1, 1)),
+                    ("japan", "cs.AI", 4, datetime(2024, 4, 1, 2)),
+                ]
+            ]
+        )
+    monkeypatch.setattr(async_queries, "ASYNC_DATABASE_URL", f"sqlite+aiosqlite:///{path}")
+    monkeypatch.setattr(async_queries, "_engine", None)
+
+    async def queries():
+        return await asyncio.gather(
+            async_queries.query_model_async("hourly", "country"),
+            async_queries.query_global_sum_async(
+                "hourly", "day", start=datetime(2024, 4, 1), filters={"category": ["cs.*"]}
+            ),
+        )
+
+    by_country, by_day = asyncio.run(queries())
+    assert sorted(by_country, key=lambda row: row["country"]) == [
+        {"country": "Japan", "data": 4},
+        {"country": "United States", "data": 3},
+    ]
+    assert by_day == [{"total_sum": 6, "time_group": "2024-04-01"}]
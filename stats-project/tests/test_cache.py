@@ -0,0 +1,70 @@
+from cache import ResultCache, make_key
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_make_key_normalizes_arguments():
+    """Test argument order and empty values do not change the key."""
+    first = make_key("get_data", {"model": "hourly", "group_by": "country", "time_group": None})
+    second = make_key("get_data", {"group_by": "country", "model": "hourly"})
+    assert first == second
+    assert first != make_key("get_global_sum", {"group_by": "country", "model": "hourly"})
+
+
+def test_entries_expire_at_ingest_boundary():
+    """Test entries live until the next hour plus the ingest delay."""
+    clock = FakeClock(10 * 3600 + 200)
+    cache = ResultCache(ingest_delay=300, clock=clock)
+    cache.set("key", b"[]")
+
+    clock.now = 10 * 3600 + 299
+    assert cache.get("key") == b"[]"
+    clock.now = 10 * 3600 + 300
+    assert cache.get("key") is None
+
+    cache.set("key", b"[]")
+    clock.now = 11 * 3600 + 299
+    assert cache.get("key") == b"[]"
+    clock.now = 11 * 3600 + 300
+    assert cache.get("key") is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    """Test the cache stays within max_entries by dropping the oldest lookup."""
+    cache = ResultCache(max_entries=2)
+    cache.set("a", b"1")
+    cache.set("b", b"2")
+    cache.get("a")
+    cache.set("c", b"3")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1"
+    assert cache.get("c") == b"3"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_stale_entries_are_served_until_replaced():
+    """Test expired entries are served for max_stale seconds, and replace swaps in a new set of entries."""
+    clock = FakeClock(10 * 3600 + 200)
+    cache = ResultCache(ingest_delay=300, clock=clock, max_stale=600)
+    cache.set("a", b"old")
+    cache.set("b", b"old")
+
+    clock.now = 10 * 3600 + 800
+    assert cache.get("a") == b"old"
+    assert cache.stats()["stale_hits"] == 1
+
+    cache.replace({"a": b"new"})
+    assert cache.get("a") == b"new"
+    assert cache.get("b") is None
+    clock.now = 11 * 3600 + 899
+    assert cache.get("a") == b"new"
+    clock.now = 11 * 3600 + 900
+    assert cache.get("a") is None
@@ -0,0 +1,29 @@
+from columnar import encode_columnar, rows_to_columns
+
+
+def test_encode_columnar_dictionary_encodes_dimensions():
+    """Test dimension columns are replaced by codes into a dictionary of distinct values."""
+    columns = {
+        "country": ["Us", "Gb", "Us"],
+        "data": [5, 7, 2],
+        "time_group": ["2024-03-01", "2024-03-01", "2024-04-01"],
+    }
+    assert encode_columnar(columns, {"country", "time_group"}) == {
+        "length": 3,
+        "columns": {"country": [0, 1, 0], "data": [5, 7, 2], "time_group": [0, 0, 1]},
+        "dictionaries": {"country": ["Us", "Gb"], "time_group": ["2024-03-01", "2024-04-01"]},
+    }
+
+
+def test_rows_to_columns():
+    """Test rows are transposed into parallel lists."""
+    rows = [{"time_group": "2024-03-01", "total_sum": 4}, {"time_group": "2024-04-01", "total_sum": 9}]
+    assert rows_to_columns(rows, ("time_group", "total_sum")) == {
+        "time_group": ["2024-03-01", "2024-04-01"],
+        "total_sum": [4, 9],
+    }
+    assert encode_columnar(rows_to_columns([], ("total_sum",)), ()) == {
+        "length": 0,
+        "columns": {"total_sum": []},
+        "dictionaries": {},
+    }
@@ -0,0 +1,93 @@
+from datetime import datetime
+
+import pytest
+
+np = pytest.importorskip("numpy")
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+import cube as cube_module  # noqa: E402
+from cube import DownloadCube, refresh_cube  # noqa: E402
+from migrations import migrate  # noqa: E402
+from models import HourlyDownloadData  # noqa: E402
+
+
+def make_cube():
+    rows = [
+        ("us", "cs.AI", "cs", "pdf", datetime(2024, 3, 30, 23), 1),
+        ("us", "cs.AI", "cs", "pdf", datetime(2024, 3, 31, 1), 2),
+        ("gb", "math.AG", "math", "pdf", datetime(2024, 3, 31, 2), 4),
+        ("us", "cs.LG", "cs", "html", datetime(2024, 4, 1, 0), 8),
+    ]
+    return DownloadCube.empty(datetime(2024, 3, 30)).extended(rows, datetime(2024, 4, 1, 1))
+
+
+def test_cube_groups_by_dimensions_and_time():
+    """Test vectorized group-bys match the equivalent SQL sums."""
+    cube = make_cube()
+    start = datetime(2024, 3, 30)
+    assert sorted(cube.aggregate(["country"], start=start)) == [("gb", 4), ("us", 11)]
+    assert sorted(cube.aggregate(["archive"], "month", start=start)) == [
+        ("cs", datetime(2024, 3, 1), 3),
+        ("cs", datetime(2024, 4, 1), 8),
+        ("math", datetime(2024, 3, 1), 4),
+    ]
+    assert sorted(cube.aggregate([], "day", start=datetime(2024, 3, 31))) == [
+        (datetime(2024, 3, 31), 6),
+        (datetime(2024, 4, 1), 8),
+    ]
+
+
+def test_cube_applies_filters_and_ranges():
+    """Test dimension filters, prefix filters and ranges restrict the rows summed."""
+    cube = make_cube()
+    start = datetime(2024, 3, 30)
+    assert cube.aggregate(["country"], start=start, filters={"category": ["cs.*"]}) == [("us", 11)]
+    assert cube.aggregate(
+        ["category"], start=start, end=datetime(2024, 3, 31, 2), filters={"download_type": ["pdf"]}
+    ) == [("cs.AI", 3)]
+    assert cube.aggregate(["country"], start=start, filters={"country": ["fr"]}) == []
+
+
+def test_cube_covers_and_trims():
+    """Test the cube only claims ranges it holds, and drops rows older than keep_from."""
+    cube = make_cube()
+    assert cube.covers(datetime(2024, 3, 30))
+    assert not cube.covers(None)
+    assert not cube.covers(datetime(2024, 3, 29))
+    assert not cube.covers(datetime(2024, 3, 30), datetime(2024, 4, 2))
+
+    trimmed = cube.extended([], datetime(2024, 4, 1, 1), keep_from=datetime(2024, 3, 31))
+    assert len(trimmed) == 3
+    assert not trimmed.covers(datetime(2024, 3, 30))
+
+
+def test_refresh_rereads_hours_rewritten_by_a_later_batch(tmp_path, monkeypatch):
+    """Test a second ingest batch for an hour the cube already holds is picked up by the next refresh."""
+    monkeypatch.setattr(cube_module, "CUBE_DAYS", 35)
+    monkeypatch.setattr(cube_module, "_cube", None)
+    engine = create_engine(f"sqlite:///{tmp_path / 'stats.db'}")
+    migrate(engine)
+    hour = datetime(2024, 3, 31, 5)
+
+    def add(country, count):
+        with Session(engine) as session, session.begin():
+            session.merge(
+                HourlyDownloadData(
+                    country=country,
+                    download_type="pdf",
+                    archive="cs",
+                    category="cs.AI",
+                    primary_count=count,
+                    cross_count=0,
+                    start_dttm=hour,
+                )
+            )
+
+    add("japan", 1)
+    with Session(engine) as session:
+        assert refresh_cube(session).aggregate(["country"], start=hour) == [("japan", 1)]
+    add("france", 2)
+    add("japan", 5)
+    with Session(engine) as session:
+        assert sorted(refresh_cube(session).aggregate(["country"], start=hour)) == [("france", 2), ("japan", 5)]
@@ -0,0 +1,81 @@
+from datetime import datetime
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.dialects import mysql, postgresql
+from sqlalchemy.orm import Session
+
+import api_utils
+from grouping import Rollup, rollup_level, rollup_rows
+from models import Base, HourlyDownloadData
+
+
+def test_rollup_compiles_per_dialect():
+    """Test ROLLUP is emitted as ROLLUP(...) on PostgreSQL and WITH ROLLUP on MySQL."""
+    table = HourlyDownloadData.__table__
+    statement = (
+        select(table.c.archive, table.c.category, func.sum(table.c.primary_count))
+        .group_by(Rollup(table.c.archive, table.c.category))
+    )
+    assert "GROUP BY ROLLUP(hourly_download_data.archive, hourly_download_data.category)" in str(
+        statement.compile(dialect=postgresql.dialect())
+    )
+    assert "GROUP BY hourly_download_data.archive, hourly_download_data.category WITH ROLLUP" in str(
+        statement.compile(dialect=mysql.dialect())
+    )
+
+
+def test_rollup_rows_adds_subtotals():
+    """Test the Python rollup matches GROUP BY ROLLUP, keeping the time bucket."""
+    march, april = datetime(2024, 3, 1), datetime(2024, 4, 1)
+    rows = [
+        ("cs", "cs.AI", 1, march),
+        ("cs", "cs.LG", 2, march),
+        ("math", "math.AG", 4, march),
+        ("cs", "cs.AI", 8, april),
+    ]
+    result = rollup_rows(rows, 2, has_time_group=True)
+
+    assert sorted(
+        (row for row in result if row[-1] != 0), key=lambda row: (row[-1], row[3], str(row[0]))
+    ) == [
+        ("cs", None, 3, march, 1),
+        ("math", None, 4, march, 1),
+        ("cs", None, 8, april, 1),
+        (None, None, 7, march, 3),
+        (None, None, 8, april, 3),
+    ]
+    assert [rollup_level(grouping, 2) for grouping in (0, 1, 3)] == [2, 1, 0]
+
+
+def test_query_rollup_on_sqlite(monkeypatch):
+    """Test every level of a rollup comes back tagged, on a database without ROLLUP."""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session, session.begin():
+        session.add_all(
+            [
+                HourlyDownloadData(
+                    country=country,
+                    download_type="pdf",
+                    archive=category.split(".")[0],
+                    category=category,
+                    primary_count=count,
+                    cross_count=0,
+                    start_dttm=datetime(2024, 3, 1, hour),
+                )
+                for hour, (country, category, count) in enumerate(
+                    [("japan", "cs.AI", 1), ("japan", "cs.LG", 2), ("united states", "math.AG", 4)]
+                )
+            ]
+        )
+    monkeypatch.setattr(api_utils, "Session", lambda: Session(engine))
+
+    result = api_utils.query_rollup("hourly", ["country", "archive"])
+
+    assert sorted(result, key=lambda row: (-row["level"], str(row["country"]), str(row["archive"]))) == [
+        {"country": "Japan", "archive": "cs", "data": 3, "level": 2},
+        {"country": "United States", "archive": "math", "data": 4, "level": 2},
+        {"country": "Japan", "archive": None, "data": 3, "level": 1},
+        {"country": "United States", "archive": None, "data": 4, "level": 1},
+        {"country": None, "archive": None, "data": 7, "level": 0},
+    ]
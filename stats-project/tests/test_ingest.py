@@ -0,0 +1,49 @@
+import os
+from datetime import datetime
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import Session
+
+from ingest import ingest, read_extract
+from models import Base, HourlyDownloadData, MonthlyDownloadRollup
+
+
+def make_row(hour, primary_count, country="us"):
+    return {
+        "country": country,
+        "download_type": "pdf",
+        "archive": "cs",
+        "category": "cs.AI",
+        "primary_count": primary_count,
+        "cross_count": 0,
+        "start_dttm": datetime(2024, 3, 25, hour),
+    }
+
+
+def test_ingest_is_idempotent_and_refreshes_rollups():
+    """Test re-ingesting the same hours overwrites rows and keeps the rollups in step."""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+
+    rows = [make_row(14, 120), make_row(15, 30), make_row(14, 5, country="gb")]
+    summary = ingest(engine, rows, batch_size=2, log=lambda line: None)
+    assert summary["rows"] == 3
+    assert summary["start"] == datetime(2024, 3, 25, 14)
+    assert summary["end"] == datetime(2024, 3, 25, 16)
+
+    # a corrected extract for hour 15, with a duplicate key inside the batch
+    ingest(engine, [make_row(15, 1), make_row(15, 40)], log=lambda line: None)
+
+    with Session(engine) as session:
+        assert session.query(HourlyDownloadData).count() == 3
+        assert session.query(func.sum(HourlyDownloadData.primary_count)).scalar() == 165
+        monthly = {row.country: row.primary_count for row in session.query(MonthlyDownloadRollup)}
+        assert monthly == {"us": 160, "gb": 5}
+
+
+def test_read_extract_parses_json_array():
+    """Test the bundled JSON test data can be read as an extract."""
+    path = os.path.join(os.path.dirname(__file__), "test_data", "test_download_data.json")
+    rows = list(read_extract(path))
+    assert rows[0]["start_dttm"] == datetime(2024, 3, 25, 14)
+    assert rows[0]["primary_count"] == 120
@@ -0,0 +1,110 @@
+from datetime import date, datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from live_totals import HourlyTotals, refresh_hourly_totals
+from time_buckets import local_day_range
+from models import Base, HourlyDownloadData
+
+
+def test_local_day_range_handles_offsets_and_dst():
+    """Test local days map to the right UTC range, including 23 hour days."""
+    assert local_day_range("Asia/Kolkata", date(2024, 3, 25)) == (
+        datetime(2024, 3, 24, 18, 30),
+        datetime(2024, 3, 25, 18, 30),
+    )
+    assert local_day_range("America/New_York", date(2024, 3, 10)) == (
+        datetime(2024, 3, 10, 5),
+        datetime(2024, 3, 11, 4),
+    )
+
+
+def test_by_local_hour_shifts_utc_hours():
+    """Test UTC hours are summed by their local hour, and days outside the window are refused."""
+    totals = HourlyTotals(
+        datetime(2024, 3, 24, 0),
+        {
+            datetime(2024, 3, 24, 22): 1,  # 2024-03-24 18:00 in New York
+            datetime(2024, 3, 25, 3): 2,  # 2024-03-24 23:00 in New York
+            datetime(2024, 3, 25, 4): 4,  # 2024-03-25 00:00 in New York
+            datetime(2024, 3, 25, 14): 8,
+        },
+    )
+    assert totals.by_local_hour("UTC", date(2024, 3, 25)) == [(3, 2), (4, 4), (14, 8)]
+    assert totals.by_local_hour("America/New_York", date(2024, 3, 25)) == [(0, 4), (10, 8)]
+    assert totals.by_local_hour("America/New_York", date(2024, 3, 23)) is None
+
+
+def test_refresh_reads_the_last_48_hours():
+    """Test the refresh sums every row of each hour within the window."""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session, session.begin():
+        session.add_all(
+            [
+                HourlyDownloadData(
+                    country=country,
+                    download_type="pdf",
+                    archive="cs",
+                    category="cs.AI",
+                    primary_count=count,
+                    cross_count=0,
+                    start_dttm=start_dttm,
+                )
+                for country, count, start_dttm in [
+                    ("japan", 1, datetime(2024, 3, 22, 23)),
+                    ("japan", 2, datetime(2024, 3, 25, 13)),
+                    ("peru", 4, datetime(2024, 3, 25, 13)),
+                ]
+            ]
+        )
+
+    with Session(engine) as session:
+        totals = refresh_hourly_totals(session, now=datetime(2024, 3, 25, 14, 20))
+    assert totals.start == datetime(2024, 3, 23, 15)
+    assert totals.totals == {datetime(2024, 3, 25, 13): 6}
+
+
+def test_query_todays_downloads_uses_utc_range(monkeypatch):
+    """Test the SQL fallback sums the local day's UTC hours, through the start_dttm index."""
+    import api_utils
+    import live_totals
+    from migrations import migrate
+
+    engine = create_engine("sqlite://")
+    migrate(engine)
+    today = datetime.now(api_utils.ZoneInfo("Asia/Kolkata")).date()
+    start, end = local_day_range("Asia/Kolkata", today)
+    with Session(engine) as session, session.begin():
+        session.add_all(
+            [
+                HourlyDownloadData(
+                    country="india",
+                    download_type="pdf",
+                    archive="cs",
+                    category=category,
+                    primary_count=count,
+                    cross_count=0,
+                    start_dttm=start_dttm,
+                )
+                for category, count, start_dttm in [
+                    ("cs.AI", 1, start),
+                    ("cs.LG", 2, start),
+                    ("cs.AI", 4, end),  # tomorrow, locally
+                ]
+            ]
+        )
+    monkeypatch.setattr(api_utils, "Session", lambda: Session(engine))
+    monkeypatch.setattr(live_totals, "_totals", None)
+
+    assert api_utils.query_todays_downloads("Asia/Kolkata") == [{"hour": 0, "total_primary": 3}]
+
+    with Session(engine) as session:
+        query = api_utils.build_todays_downloads_query(session, "Asia/Kolkata", today)
+        compiled = query.statement.compile(engine)
+        plan = session.connection().exec_driver_sql(
+            f"EXPLAIN QUERY PLAN {compiled}",
+            tuple(str(compiled.params[name]) for name in compiled.positiontup),
+        ).fetchall()
+    assert "ix_hourly_download_data_start_dttm_primary_count" in str(plan)
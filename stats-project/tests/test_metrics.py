@@ -0,0 +1,62 @@
+from sqlalchemy import create_engine, text
+
+import metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    """Test observations are counted in every bucket they fit, with escaped labels."""
+    histogram = metrics.Histogram("test_seconds", "Test.", ("shape",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, shape='a"b')
+    histogram.observe(0.5, shape='a"b')
+
+    lines = histogram.render()
+    assert 'test_seconds_bucket{shape="a\\"b",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{shape="a\\"b",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{shape="a\\"b",le="+Inf"} 2' in lines
+    assert 'test_seconds_count{shape="a\\"b"} 2' in lines
+
+
+def test_sql_events_record_query_shape_and_request_span():
+    """Test executed statements are timed under their query shape and the current request's sql span."""
+    engine = create_engine("sqlite://")
+    timings = metrics.RequestTimings()
+    token = metrics._timings.set(timings)
+    try:
+        with engine.connect() as connection:
+            connection.execution_options(query_shape="test:shape").execute(text("SELECT 1"))
+            with metrics.span("format", 3):
+                pass
+    finally:
+        metrics._timings.reset(token)
+
+    assert "test:shape" in metrics.render()
+    assert timings.spans["sql"][1] == 1
+    header = timings.server_timing(0.01)
+    assert 'sql;dur=' in header and 'desc="1 query"' in header
+    assert 'format;dur=' in header and 'desc="3 rows"' in header
+    assert header.endswith("total;dur=10.00")
+
+
+def test_server_timing_header_and_metrics_endpoint(client, monkeypatch):
+    """Test API responses carry a Server-Timing header and are counted on /metrics."""
+    import api
+
+    monkeypatch.setattr(api, "query_latest_ingest", lambda: None)
+    async def query_todays_downloads(timezone):
+        return [{"hour": 0, "total_primary": 1}]
+
+    monkeypatch.setattr(api, "query_todays_downloads_async", query_todays_downloads)
+    api.watermark_cache.clear()
+    api.result_cache.clear()
+
+    response = client.get("/api/get_todays_downloads")
+    assert response.status_code == 200
+    assert "serialize;dur=" in response.headers["Server-Timing"]
+    assert "total;dur=" in response.headers["Server-Timing"]
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    body = response.get_data(as_text=True)
+    assert 'stats_requests_total{endpoint="api.get_todays_downloads",status="200"}' in body
+    assert "# TYPE stats_request_duration_seconds histogram" in body
@@ -0,0 +1,109 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("duckdb")
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+import api_utils  # noqa: E402
+from migrations import migrate  # noqa: E402
+from models import HourlyDownloadData  # noqa: E402
+from parquet_store import ParquetStore, export_closed_months, merge_rows  # noqa: E402
+
+ROWS = [
+    ("united states", "cs.AI", "cs", "pdf", datetime(2024, 1, 5, 3), 1),
+    ("japan", "math.AG", "math", "pdf", datetime(2024, 1, 31, 23), 2),
+    ("united states", "cs.LG", "cs", "html", datetime(2024, 2, 10, 12), 4),
+    ("france", "cs.AI", "cs", "pdf", datetime(2024, 2, 29, 23), 8),
+    ("japan", "cs.AI", "cs", "pdf", datetime(2024, 3, 1, 0), 16),
+    ("united states", "math.AG", "math", "pdf", datetime(2024, 3, 2, 5), 32),
+]
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'stats.db'}")
+    migrate(engine)
+    with Session(engine) as session, session.begin():
+        for country, category, archive, download_type, start_dttm, count in ROWS:
+            session.add(
+                HourlyDownloadData(
+                    country=country,
+                    category=category,
+                    archive=archive,
+                    download_type=download_type,
+                    primary_count=count,
+                    cross_count=0,
+                    start_dttm=start_dttm,
+                )
+            )
+    monkeypatch.setattr(api_utils, "Session", lambda: Session(engine))
+    return engine
+
+
+def queries():
+    return [
+        api_utils.query_model("hourly", "country"),
+        api_utils.query_model("hourly", "archive", "category", "month", filters={"category": ["cs.*"]}),
+        api_utils.query_model("hourly", "country", time_group="day", start=datetime(2024, 2, 20)),
+        api_utils.query_model("hourly", "category", limit=2, order="desc", other=True),
+        api_utils.query_rollup("hourly", ["archive", "category"], "year"),
+        api_utils.query_global_sum("hourly", "month", end=datetime(2024, 3, 2)),
+        api_utils.query_global_sum("hourly", "year", filters={"download_type": ["pdf"]}),
+    ]
+
+
+def sort_key(value):
+    return sorted(value, key=repr) if isinstance(value, list) else value
+
+
+def test_closed_months_are_exported_and_merged_with_the_database(database, tmp_path, monkeypatch):
+    """Test queries split between the Parquet files and the database answer as the database alone does."""
+    expected = queries()
+
+    store = ParquetStore(str(tmp_path / "parquet"))
+    assert export_closed_months(database, store, log=lambda line: None) == [
+        datetime(2024, 1, 1),
+        datetime(2024, 2, 1),
+    ]
+    assert store.boundary() == datetime(2024, 3, 1)
+    assert store.split(datetime(2024, 3, 1)) is None
+    monkeypatch.setattr(api_utils, "get_parquet_store", lambda: store)
+
+    assert api_utils.history_split("hourly", ["country"]) == datetime(2024, 3, 1)
+    assert api_utils.history_split("hourly", ["country"], start=datetime(2024, 3, 1)) is None
+    assert api_utils.history_split("hourly", ["paper_id"]) is None
+    assert [sort_key(value) for value in queries()] == [sort_key(value) for value in expected]
+
+
+def test_exports_follow_new_ingests(database, tmp_path):
+    """Test a month closes an hour after it is ingested, and months reloaded since are exported again."""
+    store = ParquetStore(str(tmp_path / "parquet"))
+    export_closed_months(database, store, log=lambda line: None)
+    assert export_closed_months(database, store, log=lambda line: None) == []
+    assert export_closed_months(database, store, since=datetime(2024, 2, 3), log=lambda line: None) == [
+        datetime(2024, 2, 1)
+    ]
+    assert store.global_sums("month") == [(datetime(2024, 1, 1), 3), (datetime(2024, 2, 1), 12)]
+
+
+def test_partial_exports_are_not_queried(database, tmp_path, monkeypatch):
+    """Test a store missing the first months of data is never used, so no hours are left out."""
+    store = ParquetStore(str(tmp_path / "parquet"))
+    monkeypatch.setattr(api_utils, "get_parquet_store", lambda: store)
+    store.export_month(database, datetime(2024, 2, 1))
+    assert store.boundary() is None
+    assert api_utils.history_split("hourly", ["country"]) is None
+
+    store.set_first_month(datetime(2024, 1, 1))
+    assert store.boundary() is None
+    export_closed_months(database, store, log=lambda line: None)
+    assert store.first_month() == datetime(2024, 1, 1)
+    assert store.boundary() == datetime(2024, 3, 1)
+
+
+def test_merge_rows():
+    """Test rows of the same group are summed across sets, whichever set they come from."""
+    merged = merge_rows([[("cs", 1, "pdf"), ("math", 2, "pdf")], [("cs", 4, "pdf"), ("cs", 8, "html")]], 1)
+    assert sorted(merged) == [("cs", 5, "pdf"), ("cs", 8, "html"), ("math", 2, "pdf")]
@@ -0,0 +1,68 @@
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import api_utils
+from models import Base, HourlyDownloadData
+from ranking import OTHER_LABEL, top_n_rows
+
+MARCH, APRIL = datetime(2024, 3, 1), datetime(2024, 4, 1)
+
+
+def test_top_n_rows_ranks_over_the_whole_range():
+    """Test groups are ranked by their total over every bucket, ties broken by value, the rest summed."""
+    rows = [
+        ("us", 5, MARCH),
+        ("jp", 9, MARCH),
+        ("us", 6, APRIL),
+        ("de", 2, APRIL),
+        ("gb", 2, MARCH),
+    ]
+    assert top_n_rows(rows, 1) == [("us", 5, MARCH), ("us", 6, APRIL)]
+    assert top_n_rows(rows, 2, other=True) == [
+        ("us", 5, MARCH),
+        ("us", 6, APRIL),
+        ("jp", 9, MARCH),
+        (OTHER_LABEL, 2, MARCH),
+        (OTHER_LABEL, 2, APRIL),
+    ]
+    assert top_n_rows(rows, 1, order="asc") == [("de", 2, APRIL)]
+
+
+def test_query_model_limit_matches_in_sql_and_python(monkeypatch):
+    """Test the window function query returns the same rows as ranking in Python."""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    counts = {"us": [5, 6], "jp": [9, 0], "de": [1, 1], "gb": [2, 3], "fr": [1, 2]}
+    with Session(engine) as session, session.begin():
+        for country, (march, april) in counts.items():
+            for hour, count in ((MARCH, march), (APRIL, april)):
+                session.add(
+                    HourlyDownloadData(
+                        country=country,
+                        download_type="pdf",
+                        archive="cs",
+                        category="cs.AI",
+                        primary_count=count,
+                        cross_count=0,
+                        start_dttm=hour,
+                    )
+                )
+    monkeypatch.setattr(api_utils, "Session", lambda: Session(engine))
+
+    for kwargs in ({}, {"other": True}, {"order": "asc", "other": True}):
+        result = api_utils.query_model("hourly", "country", time_group="month", limit=2, **kwargs)
+        with Session(engine) as session:
+            all_rows = api_utils.build_model_query(session, "hourly", "country", time_group="month").all()
+        expected = api_utils.format_model_rows(
+            top_n_rows(all_rows, 2, **kwargs), "country", time_group="month"
+        )
+        assert result == expected
+
+    result = api_utils.query_model("hourly", "country", limit=2, other=True)
+    assert result == [
+        {"country": "Us", "data": 11},
+        {"country": "Jp", "data": 9},
+        {"country": "Other", "data": 10},
+    ]
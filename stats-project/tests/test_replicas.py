@@ -0,0 +1,105 @@
+from datetime import datetime
+
+from sqlalchemy import create_engine, func
+
+import api_utils
+import slow_queries
+from migrations import migrate
+from models import HourlyDownloadData
+from replicas import ReplicaRouter, RoutingSession
+
+
+def make_database(path, countries, hour=datetime(2024, 3, 25, 14)):
+    engine = create_engine(f"sqlite:///{path}")
+    migrate(engine)
+    with RoutingSession(engine) as session, session.begin():
+        for country in countries:
+            session.add(
+                HourlyDownloadData(
+                    country=country,
+                    download_type="pdf",
+                    archive="cs",
+                    category="cs.AI",
+                    primary_count=1,
+                    cross_count=0,
+                    start_dttm=hour,
+                )
+            )
+    return engine
+
+
+def countries(session):
+    return sorted(row[0] for row in session.query(HourlyDownloadData.country))
+
+
+def test_reads_go_to_a_replica_and_writes_to_the_primary(tmp_path):
+    """Test a session reads from its replica until it writes, then uses the primary until closed."""
+    primary = make_database(tmp_path / "primary.db", ["france"])
+    replica = make_database(tmp_path / "replica.db", ["japan"])
+    session = RoutingSession(primary, router=ReplicaRouter([replica]))
+
+    assert countries(session) == ["japan"]
+    session.query(HourlyDownloadData).filter_by(country="france").update({"primary_count": 5})
+    assert countries(session) == ["france"]
+    session.commit()
+    session.close()
+
+    assert countries(session) == ["japan"]
+    session.use_primary()
+    assert session.query(func.sum(HourlyDownloadData.primary_count)).scalar() == 5
+    session.close()
+
+
+def test_replicas_are_chosen_in_turn_or_by_load(tmp_path):
+    """Test round_robin alternates replicas and least_busy avoids one with a connection checked out."""
+    first = make_database(tmp_path / "first.db", ["france"])
+    second = make_database(tmp_path / "second.db", ["japan"])
+
+    router = ReplicaRouter([first, second])
+    assert [router.choose() for _ in range(3)] == [first, second, first]
+
+    router = ReplicaRouter([first, second], "least_busy")
+    with first.connect():
+        assert router.choose() is second
+        assert list(router.in_use().values()) == [1, 0]
+    assert router.choose() is first
+    assert list(router.in_use().values()) == [0, 0]
+
+
+def test_ranked_and_rollup_queries_read_from_the_replica(tmp_path, monkeypatch):
+    """Test looking up the dialect before a limited or rollup query does not pin the session to the primary."""
+    primary = make_database(tmp_path / "primary.db", ["france"])
+    replica = make_database(tmp_path / "replica.db", ["japan"])
+    router = ReplicaRouter([replica])
+    monkeypatch.setattr(api_utils, "Session", lambda: RoutingSession(primary, router=router))
+
+    assert api_utils.query_model("hourly", "country", limit=5) == [{"country": "Japan", "data": 1}]
+    rollup = api_utils.query_rollup("hourly", ["country"])
+    assert "Japan" in str(rollup) and "France" not in str(rollup)
+
+
+def test_watermark_comes_from_the_primary_and_plans_from_the_replica(tmp_path, monkeypatch):
+    """Test the newest ingested hour is read from the primary, and slow plans are captured where the query ran."""
+    primary = make_database(tmp_path / "primary.db", ["france"], datetime(2024, 3, 25, 15))
+    replica = make_database(tmp_path / "replica.db", ["japan"])
+    router = ReplicaRouter([replica])
+    monkeypatch.setattr(api_utils, "Session", lambda: RoutingSession(primary, router=router))
+    assert api_utils.query_latest_ingest() == datetime(2024, 3, 25, 15)
+
+    log = slow_queries.SlowQueryLog(threshold_ms=1e-6)
+    log.set_engine(primary, [replica])
+    monkeypatch.setattr(slow_queries, "slow_query_log", log)
+    with RoutingSession(primary, router=router) as session:
+        api_utils.build_model_query(session, "hourly", "country").all()
+    log._executor.submit(lambda: None).result()
+    [entry] = log.entries()
+    assert entry["plan_error"] is None
+    with primary.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE hourly_download_data")
+
+    entry = log.record(entry["statement"], (), 1.0, "model:country", "sqlite", replica)
+    log._executor.submit(lambda: None).result()
+    assert entry["plan_error"] is None
+    entry = log.record(entry["statement"], (), 1.0, "model:country", "sqlite", primary)
+    log._executor.submit(lambda: None).result()
+    assert "no such table" in entry["plan_error"]
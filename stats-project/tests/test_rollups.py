@@ -0,0 +1,103 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import rollups
+from models import (
+    Base,
+    HourlyDownloadData,
+    DailyDownloadRollup,
+    MonthlyDownloadRollup,
+    YearlyDownloadRollup,
+)
+
+
+def hourly_row(start_dttm, primary_count, country="us", category="cs.AI"):
+    return {
+        "country": country,
+        "download_type": "pdf",
+        "archive": category.split(".")[0],
+        "category": category,
+        "primary_count": primary_count,
+        "cross_count": 1,
+        "start_dttm": start_dttm,
+    }
+
+
+@pytest.fixture
+def session():
+    """Fixture providing a session on an empty in-memory database."""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def test_refresh_rollups_sums_each_grain(session):
+    """Test each rollup holds the hourly sums for its buckets."""
+    session.execute(
+        HourlyDownloadData.__table__.insert(),
+        [
+            hourly_row(datetime(2024, 3, 25, 14), 120),
+            hourly_row(datetime(2024, 3, 25, 15), 30),
+            hourly_row(datetime(2024, 3, 26, 9), 5),
+            hourly_row(datetime(2024, 4, 1, 0), 7, country="gb"),
+        ],
+    )
+    rollups.refresh_rollups(session, datetime(2024, 3, 25), datetime(2024, 4, 1, 1))
+
+    daily = {
+        (row.start_dttm, row.country): row.primary_count
+        for row in session.query(DailyDownloadRollup)
+    }
+    assert daily == {
+        (datetime(2024, 3, 25), "us"): 150,
+        (datetime(2024, 3, 26), "us"): 5,
+        (datetime(2024, 4, 1), "gb"): 7,
+    }
+    monthly = {
+        (row.start_dttm, row.country): row.primary_count
+        for row in session.query(MonthlyDownloadRollup)
+    }
+    assert monthly == {(datetime(2024, 3, 1), "us"): 155, (datetime(2024, 4, 1), "gb"): 7}
+    yearly = [(row.country, row.primary_count) for row in session.query(YearlyDownloadRollup)]
+    assert sorted(yearly) == [("gb", 7), ("us", 155)]
+
+
+def test_refresh_rollups_is_incremental(session):
+    """Test refreshing a new hour replaces only the buckets it overlaps."""
+    session.execute(
+        HourlyDownloadData.__table__.insert(),
+        [hourly_row(datetime(2024, 3, 25, 14), 120), hourly_row(datetime(2024, 3, 26, 1), 3)],
+    )
+    rollups.refresh_rollups(session, datetime(2024, 3, 25), datetime(2024, 3, 27))
+    session.execute(
+        HourlyDownloadData.__table__.insert(), [hourly_row(datetime(2024, 3, 26, 2), 4)]
+    )
+    rollups.refresh_rollups(session, datetime(2024, 3, 26, 2), datetime(2024, 3, 26, 3))
+
+    daily = {row.start_dttm.day: row.primary_count for row in session.query(DailyDownloadRollup)}
+    assert daily == {25: 120, 26: 7}
+    assert session.query(MonthlyDownloadRollup).one().primary_count == 127
+
+
+def test_select_source_model(monkeypatch):
+    """Test the coarsest rollup holding the grouped columns is chosen."""
+    monkeypatch.setattr(rollups, "ROLLUPS_ENABLED", True)
+    select = rollups.select_source_model
+    assert select(HourlyDownloadData, ["country"]) is YearlyDownloadRollup
+    assert select(HourlyDownloadData, ["archive", "category"], "month") is MonthlyDownloadRollup
+    assert select(HourlyDownloadData, ["country", None], "day") is DailyDownloadRollup
+    assert select(HourlyDownloadData, ["start_dttm"]) is HourlyDownloadData
+    assert select(HourlyDownloadData, [], "hour") is HourlyDownloadData
+
+    # range boundaries must fall on the start of a rollup bucket
+    assert select(HourlyDownloadData, ["country"], None, datetime(2024, 3, 1)) is MonthlyDownloadRollup
+    assert select(HourlyDownloadData, ["country"], None, datetime(2024, 3, 15)) is DailyDownloadRollup
+    assert select(HourlyDownloadData, ["country"], "year", None, datetime(2024, 3, 2, 5)) is HourlyDownloadData
+
+    monkeypatch.setattr(rollups, "ROLLUPS_ENABLED", False)
+    assert select(HourlyDownloadData, ["country"]) is HourlyDownloadData
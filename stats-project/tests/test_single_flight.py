@@ -0,0 +1,54 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def test_concurrent_callers_share_one_computation():
+    """Test callers on other threads and event loops await the computation in flight, errors included."""
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    async def compute():
+        calls.append(1)
+        await asyncio.to_thread(release.wait)
+        return (b"[]", "application/json")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(asyncio.run, flight.run("key", compute)) for _ in range(8)]
+        while flight.stats()["followers"] < 7:
+            time.sleep(0.01)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert calls == [1]
+    assert results == [(b"[]", "application/json")] * 8
+    assert flight.stats() == {"leaders": 1, "followers": 7, "in_flight": 0}
+
+    async def fail():
+        raise ValueError("Invalid")
+
+    with pytest.raises(ValueError):
+        asyncio.run(flight.run("key", fail))
+    assert asyncio.run(flight.run("key", compute)) == (b"[]", "application/json")
+
+
+def test_results_are_shared_across_processes(tmp_path):
+    """Test a process holding the lock second reads the result the first one wrote."""
+    first = SingleFlight(shared_dir=str(tmp_path))
+    second = SingleFlight(shared_dir=str(tmp_path))
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return (b'{"a":1}\n', "application/json")
+
+    assert asyncio.run(first.run("key", compute, shared_key="etag")) == (b'{"a":1}\n', "application/json")
+    assert asyncio.run(second.run("key", compute, shared_key="etag")) == (b'{"a":1}\n', "application/json")
+    assert calls == [1]
+    assert second.stats()["followers"] == 1
@@ -0,0 +1,76 @@
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import api
+import slow_queries
+from api_utils import build_model_query
+from models import Base, HourlyDownloadData
+
+
+def make_log(monkeypatch, engine=None, **kwargs):
+    log = slow_queries.SlowQueryLog(threshold_ms=1e-6, **kwargs)
+    log.set_engine(engine)
+    monkeypatch.setattr(slow_queries, "slow_query_log", log)
+    monkeypatch.setattr(api, "slow_query_log", log)
+    return log
+
+
+def test_slow_aggregations_are_logged_with_their_plan(tmp_path, monkeypatch):
+    """Test a slow aggregation is recorded with its SQL, parameters and plan, and other statements are not."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'stats.db'}")
+    Base.metadata.create_all(engine)
+    log = make_log(monkeypatch, engine)
+
+    with Session(engine) as session:
+        session.query(HourlyDownloadData).count()
+        build_model_query(session, "hourly", "country", start=datetime(2024, 3, 1)).all()
+    log._executor.submit(lambda: None).result()
+
+    [entry] = log.entries()
+    assert entry["shape"] == "model:country"
+    assert entry["dialect"] == "sqlite"
+    assert "GROUP BY" in entry["statement"]
+    assert entry["parameters"] == ["2024-03-01 00:00:00.000000"]
+    assert entry["plan_error"] is None
+    assert any("hourly_download_data" in line for line in entry["plan"])
+
+
+def test_log_is_bounded_and_limits_waiting_plans(monkeypatch):
+    """Test only the newest entries are kept, and plans are skipped once the backlog is full."""
+    log = make_log(monkeypatch, max_entries=2, explain_backlog=0)
+    for index in range(3):
+        log.record(f"SELECT {index}", (), 1.0, "global_sum:day", "postgresql")
+
+    entries = log.entries()
+    assert [entry["statement"] for entry in entries] == ["SELECT 2", "SELECT 1"]
+    assert entries[0]["plan_error"] == "No engine to capture the plan on"
+    assert not log.is_slow(1.0, "latest_ingest")
+    assert not log.is_slow(1.0, None)
+
+
+def test_slow_queries_endpoint(client, monkeypatch):
+    """Test /slow_queries is hidden when disabled, refused without ADMIN_TOKEN, guarded by it, and can be cleared."""
+    log = make_log(monkeypatch)
+    log.threshold_ms = 0
+    assert client.get("/api/slow_queries").status_code == 404
+
+    log.threshold_ms = 100
+    log.record("SELECT 1", (), 1.0, "model:country", "mysql")
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    assert client.get("/api/slow_queries").status_code == 403
+    assert client.delete("/api/slow_queries").status_code == 403
+    assert len(log.entries()) == 1
+
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    assert client.get("/api/slow_queries").status_code == 403
+
+    headers = {"Authorization": "Bearer secret"}
+    response = client.get("/api/slow_queries", headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()["threshold_ms"] == 100
+    assert [entry["statement"] for entry in response.get_json()["queries"]] == ["SELECT 1"]
+
+    assert client.delete("/api/slow_queries", headers=headers).status_code == 204
+    assert log.entries() == []
@@ -0,0 +1,56 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+import statement_timeouts
+from statement_timeouts import QueryTimeout, parse_timeouts, timeout_for
+
+# counts to a hundred million, which takes SQLite far longer than the timeouts below
+SLOW_QUERY = text(
+    "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000) "
+    "SELECT count(*) FROM n"
+)
+
+
+def test_timeouts_are_looked_up_by_most_specific_shape(monkeypatch):
+    """Test a shape takes the timeout of its longest listed prefix, or the default."""
+    monkeypatch.setattr(statement_timeouts, "TIMEOUTS", parse_timeouts("model=2000, model:country:day=500"))
+    monkeypatch.setattr(statement_timeouts, "DEFAULT_TIMEOUT_MS", 10000)
+    assert timeout_for("model:country:day") == 500
+    assert timeout_for("model:category:day") == 2000
+    assert timeout_for("rollup:archive") == 10000
+    assert timeout_for(None) == 0
+    with pytest.raises(ValueError):
+        parse_timeouts("model=fast")
+
+
+def test_slow_statement_raises_query_timeout(monkeypatch):
+    """Test a shaped statement past its budget is cancelled, and unshaped statements are not limited."""
+    monkeypatch.setattr(statement_timeouts, "TIMEOUTS", {"model": 50})
+    engine = create_engine("sqlite://")
+    with engine.connect() as connection:
+        with pytest.raises(QueryTimeout) as error:
+            connection.execution_options(query_shape="model:country").execute(SLOW_QUERY)
+        assert error.value.timeout_ms == 50
+        assert connection.execute(text("SELECT 1")).scalar() == 1
+
+
+def test_get_data_answers_a_timeout_with_503(client, monkeypatch):
+    """Test /get_data and /batch report a query past its budget as 503 Service Unavailable."""
+    import api
+
+    monkeypatch.setattr(api, "query_latest_ingest", lambda: None)
+    async def query_model(*args):
+        raise QueryTimeout("model:country", 50)
+
+    monkeypatch.setattr(api, "query_model_async", query_model)
+    api.watermark_cache.clear()
+    api.result_cache.clear()
+
+    response = client.get("/api/get_data?model=hourly&group_by=country")
+    assert response.status_code == 503
+    assert "50 ms" in response.get_json()["error"]
+
+    response = client.post(
+        "/api/batch", json={"queries": [{"endpoint": "get_data", "model": "hourly", "group_by": "country"}]}
+    )
+    assert response.get_json()["results"][0]["status"] == 503
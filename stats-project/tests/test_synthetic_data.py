@@ -0,0 +1,42 @@
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import Session
+
+from models import HourlyDownloadData
+from synthetic_data import load, synthetic_rows
+
+END = datetime(2024, 3, 25, 12)
+
+
+def test_synthetic_rows_are_deterministic_and_unique_per_hour():
+    """Test the same seed gives the same rows, with no duplicate primary keys."""
+    rows = list(synthetic_rows(years=0, rows_per_hour=50, seed=3, end=END))
+    assert rows == list(synthetic_rows(years=0, rows_per_hour=50, seed=3, end=END))
+    assert rows != list(synthetic_rows(years=0, rows_per_hour=50, seed=4, end=END))
+
+    keys = {(row["country"], row["download_type"], row["category"], row["start_dttm"]) for row in rows}
+    assert len(keys) == len(rows) == 50
+    assert all(row["start_dttm"] == END for row in rows)
+    assert all(row["archive"] == row["category"].split(".")[0] for row in rows)
+
+
+def test_synthetic_rows_are_skewed():
+    """Test the most popular country gets far more downloads than the median one."""
+    downloads = Counter()
+    for row in synthetic_rows(years=0, rows_per_hour=200, end=END):
+        downloads[row["country"]] += row["primary_count"]
+    counts = sorted(downloads.values(), reverse=True)
+    assert downloads.most_common(1)[0][0] == "united states"
+    assert counts[0] > 5 * counts[len(counts) // 2]
+
+
+def test_load_replaces_table_contents():
+    """Test loading twice leaves only the second load's rows."""
+    engine = create_engine("sqlite://")
+    load(engine, years=0, rows_per_hour=10, log=lambda line: None)
+    summary = load(engine, years=0, rows_per_hour=5, log=lambda line: None)
+
+    with Session(engine) as session:
+        assert session.query(func.count()).select_from(HourlyDownloadData).scalar() == summary["rows"] == 5
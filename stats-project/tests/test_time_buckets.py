@@ -0,0 +1,105 @@
+from datetime import datetime
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, HourlyDownloadData, MonthlyDownloadRollup
+from time_buckets import (
+    TimeBucket,
+    apply_time_range,
+    format_time_group,
+    format_time_groups,
+    get_time_group_column,
+)
+
+
+def test_buckets_group_and_filter_hourly_rows():
+    """Test rows are grouped on their bucket start and filtered to [start, end)."""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.execute(
+        HourlyDownloadData.__table__.insert(),
+        [
+            {
+                "country": "us",
+                "download_type": "pdf",
+                "archive": "cs",
+                "category": "cs.AI",
+                "primary_count": count,
+                "cross_count": 0,
+                "start_dttm": start_dttm,
+            }
+            for count, start_dttm in [
+                (1, datetime(2024, 2, 29, 23)),
+                (2, datetime(2024, 3, 1, 0)),
+                (4, datetime(2024, 3, 31, 23)),
+                (8, datetime(2024, 4, 1, 0)),
+            ]
+        ],
+    )
+
+    bucket = get_time_group_column(HourlyDownloadData, "month")
+    query = session.query(func.sum(HourlyDownloadData.primary_count), bucket)
+    query = apply_time_range(
+        query, HourlyDownloadData, datetime(2024, 3, 1), datetime(2024, 4, 1, 1)
+    ).group_by(bucket)
+    result = {format_time_group(row[1], "month"): row[0] for row in query}
+    assert result == {"2024-03-01": 6, "2024-04-01": 8}
+    session.close()
+
+
+def test_buckets_of_different_time_groups_compile_separately():
+    """Test a query by month does not reuse the cached SQL of the same query by year, or day by hour."""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.execute(
+        HourlyDownloadData.__table__.insert(),
+        [
+            {
+                "country": "us",
+                "download_type": "pdf",
+                "archive": "cs",
+                "category": "cs.AI",
+                "primary_count": 1,
+                "cross_count": 0,
+                "start_dttm": start_dttm,
+            }
+            for start_dttm in [datetime(2024, 3, 1, 5), datetime(2024, 3, 1, 6), datetime(2024, 4, 2, 0)]
+        ],
+    )
+
+    def buckets(time_group):
+        bucket = get_time_group_column(HourlyDownloadData, time_group)
+        query = session.query(bucket, func.sum(HourlyDownloadData.primary_count)).group_by(bucket)
+        return sorted(format_time_group(row[0], time_group) for row in query)
+
+    assert buckets("month") == ["2024-03-01", "2024-04-01"]
+    assert buckets("year") == ["2024-01-01"]
+    assert buckets("day") == ["2024-03-01", "2024-04-02"]
+    assert buckets("hour") == ["2024-03-01 05:00:00", "2024-03-01 06:00:00", "2024-04-02 00:00:00"]
+    session.close()
+
+
+def test_rollups_group_on_their_stored_bucket():
+    """Test a rollup queried at its own grain uses its start_dttm column directly."""
+    column = get_time_group_column(MonthlyDownloadRollup, "month")
+    assert column.element.compare(MonthlyDownloadRollup.__table__.c.start_dttm)
+    assert isinstance(get_time_group_column(MonthlyDownloadRollup, "year").element, TimeBucket)
+
+
+def test_format_time_group():
+    """Test bucket starts are formatted per time group."""
+    value = datetime(2024, 3, 1, 5)
+    assert format_time_group(value, "year") == "2024-01-01"
+    assert format_time_group(value, "month") == "2024-03-01"
+    assert format_time_group(value, "day") == "2024-03-01"
+    assert format_time_group(value, "hour") == "2024-03-01 05:00:00"
+
+
+def test_format_time_groups_keeps_order():
+    """Test a column of repeated bucket starts is formatted in place."""
+    march, april = datetime(2024, 3, 1), datetime(2024, 4, 1)
+    assert format_time_groups([march, april, march], "month") == ["2024-03-01", "2024-04-01", "2024-03-01"]
+    assert format_time_groups([], "day") == []
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+import api
+import warming
+from metrics import WARM_FAILURES
+
+
+def test_refresh_swaps_in_dashboard_responses(app, monkeypatch):
+    """Test a refresh caches every dashboard query, so the pages are answered without querying, and counts failures."""
+    calls = []
+    monkeypatch.setattr(api, "query_latest_ingest", lambda: datetime(2024, 3, 25, 14))
+
+    async def query_model(*args, **kwargs):
+        calls.append(args)
+        return [{args[1]: "x", "data": 1}]
+
+    monkeypatch.setattr(api, "query_model_async", query_model)
+    api.watermark_cache.clear()
+    api.result_cache.clear()
+    api.result_cache.set(("unrelated",), (b"[]", "application/json"))
+
+    invalid = {"endpoint": "get_data", "model": "hourly", "group_by": "nope"}
+    warmer = warming.CacheWarmer(app, queries=warming.DASHBOARD_QUERIES[:3] + [invalid])
+    summary = warmer.refresh()
+    assert summary["computed"] == 3 and summary["failed"] == 1
+    assert 'stats_cache_warm_failures_total{endpoint="get_data"}' in "\n".join(WARM_FAILURES.render())
+    assert warmer.watermark == datetime(2024, 3, 25, 14)
+    assert api.result_cache.get(("unrelated",)) is None
+
+    response = app.test_client().get("/api/get_data?model=hourly&group_by=archive")
+    assert response.status_code == 200
+    assert response.get_json() == [{"archive": "x", "data": 1}]
+    assert len(calls) == 3
+
+
+def test_refresh_is_due_after_a_new_ingest(app, monkeypatch):
+    """Test the warmer refreshes once a newer hour has been ingested."""
+    latest = [datetime(2024, 3, 25, 14)]
+    monkeypatch.setattr(api, "query_latest_ingest", lambda: latest[0])
+    warmer = warming.CacheWarmer(app, queries=[])
+    assert warmer.is_due()
+
+    warmer.refresh()
+    assert not warmer.is_due()
+    latest[0] = datetime(2024, 3, 25, 15)
+    assert warmer.is_due()